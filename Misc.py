@@ -5,13 +5,20 @@
 import maya.cmds as cmds
 import maya.mel  as mel
 
+import os
 from datetime import datetime
 
 import cv2
 
+from stNoh import ArchiveWriter
 from stNoh import Fur
 from stNoh import FurParam
+from stNoh import FurWriter
+from stNoh import ImageIO
+from stNoh import RenderBackend
+from stNoh import RenderCache
 from stNoh import RenderSetting
+from stNoh import Timing
 
 
 ###############################################################################
@@ -28,29 +35,61 @@ def show_text_on_image_cv2(img_cv2, text, winTitle="temp"):
     return None
 
 
+###############################################################################
+## subroutine: attribute values of a node for the render cache key
+###############################################################################
+def get_attribute_values(node, exclude=[]):
+    """
+    Returns sorted list of (attribute, value) of the node, except exclude.
+    Attributes which cannot be read as a value (e.g. message) are skipped.
+    """
+    values = []
+    for attr in sorted(set(cmds.listAttr(node, r=True, s=True) or [])):
+        if attr in exclude:
+            continue
+        try:
+            values.append( (attr, cmds.getAttr("{0}.{1}".format(node, attr))) )
+        except (RuntimeError, ValueError):
+            pass
+    return values
+
+
 ###############################################################################
 ## wrapper class for rendering MayaFur
 ###############################################################################
-class FurRenderer:
+class FurRenderer(RenderBackend.RenderBackend):
 
     ############################################################
     ## ctor / dtor
     ############################################################
     def __init__(self):
-
-        ## default image size as QHD
-        self.imageW_px  = 960
-        self.imageH_px  = 540
-        self.imgFileExt = "jpg" ## default file extension for rendered image
+        RenderBackend.RenderBackend.__init__(self) ## default image size as QHD
 
         ## default setting
         self.fur_desc = "MyFurDescription"
         self.material = "lambert1"
         self.camera   = "RenderCam1"
+
+        ## diff-only writer for fur attributes
+        self.writer = FurWriter.FurAttributeWriter(self.fur_desc, self.material)
+
+        ## scratch path for RenderImage()
+        self.folder_path = None
+        self.scene_key   = None
+
+        ## in-memory framebuffer mode (see SetFramebufferMode)
+        self.framebuffer  = False
+        self.archive      = True
+        self.scratch_path = os.path.join(ImageIO.GetScratchDir(), "furrender_{0}_{1}".format(os.getpid(), id(self)))
+
+        ## mayapy (no render window): batch renderer
+        self.headless = cmds.about(batch=True)
         pass
 
     def __del__(self):
+        self.Close()
         Fur.InitFurDescription(self.fur_desc)
+        self.writer.Invalidate()
         Fur.CopyFurBaseColor2Material(self.fur_desc, self.material)
         pass
 
@@ -58,60 +97,164 @@ class FurRenderer:
     ## member functions
     ############################################################
 
-    ## change image size & extension
-    def SetImageFormat(self, imageW_px, imageH_px, imgFileExt="jpg"):
-        self.imageW_px  = imageW_px
-        self.imageH_px  = imageH_px
-        self.imgFileExt = imgFileExt
+    ## render to uncompressed scratch frame instead of lossy image files
+    def SetFramebufferMode(self, enable=True, archive=False):
+        """
+        enable : render into an uncompressed BMP frame in RAM-backed scratch
+                 space, and return it without any lossy codec
+        archive: also write per-iteration images (imgFileExt) and CSV files
+                 by a background ArchiveWriter
+        """
+        self.framebuffer = enable
+        self.archive     = archive
+
+        if enable and archive and self.archiver is None:
+            self.archiver = ArchiveWriter.ArchiveWriter("all", image_ext=self.imgFileExt)
         return None
 
+    ## state besides the parameters of a render: + framebuffer mode
+    def State(self):
+        state = RenderBackend.RenderBackend.State(self)
+        state["framebuffer"] = (self.framebuffer, self.archive)
+        return state
+
+    def SetState(self, state):
+        if (self.framebuffer, self.archive) != state["framebuffer"]:
+            self.SetFramebufferMode(*state["framebuffer"])
+            self.folder_path = None ## export path & scene key depend on the mode
+        return RenderBackend.RenderBackend.SetState(self, state)
+
     ## initialize renderer setting
     def Init(self, folder_path):
+        self.folder_path = folder_path
 
         ## limit to single view as reference
         RenderSetting.SetRenderer("mayaSoftware")
         RenderSetting.SetImageSize(self.imageW_px, self.imageH_px)
-        RenderSetting.SetExportPath(folder_path, self.imgFileExt)
+        RenderSetting.SetExportPath(folder_path, "bmp" if self.framebuffer else self.imgFileExt)
         cmds.setAttr("defaultRenderGlobals.animation", 0) # activate "(Single frame)"
         cmds.currentTime(1)
 
         ## standby rendering window
-        cmds.select(cl=True)
-        cmds.select(self.camera)
-        cam = cmds.ls(sl=True)
-        cmds.select(cl=True)
-        RenderSetting.Snapshot(cam)
+        if not self.headless:
+            cmds.select(cl=True)
+            cmds.select(self.camera)
+            cam = cmds.ls(sl=True)
+            cmds.select(cl=True)
+            RenderSetting.Snapshot(cam)
+
+        ## scene/camera/render settings for render cache
+        self.scene_key = self.HashScene()
+
+        return None
+
+    def HashScene(self):
+        """
+        Returns hash of everything but fur parameters which changes the image:
+        content of the scene file (edits saved under the same name), camera,
+        render settings and fur description attributes which are not searched.
+        """
+        scene_file = cmds.file(q=True, sn=True)
+        scene_hash = RenderCache.HashFile(scene_file) if scene_file and os.path.isfile(scene_file) else None
+
+        ## fur parameters are part of the render key (see RenderCache.RenderKey)
+        searched = list(FurParam.ParamsGeom.keys()) + list(FurParam.ParamsColor.keys())
+        fur_attrs = [(attr, value) for attr, value in get_attribute_values(self.fur_desc)
+                     if attr not in searched and attr + "R" not in searched] ## compound colors, e.g. "TipColor"
+
+        cam_shape = cmds.listRelatives(self.camera, shapes=True) or []
+        text = repr([
+            scene_file, scene_hash, RenderBackend.RenderBackend.SceneKey(self),
+            self.fur_desc, self.material, self.camera,
+            cmds.xform(self.camera, q=True, ws=True, m=True),
+            [get_attribute_values(shape) for shape in cam_shape],
+            get_attribute_values("defaultRenderGlobals", ["imageFilePrefix"]), ## changed by every render
+            get_attribute_values("defaultResolution"),
+            get_attribute_values("defaultRenderQuality"),
+            fur_attrs,
+            "bmp" if self.framebuffer else self.imgFileExt,
+        ])
+        return RenderCache.HashString(text)
 
+    def SceneKey(self):
+        return self.scene_key
+
+    ## RenderBackend interface
+    def SetParams(self, params_dict):
+        self.writer.SetFurDescription(params_dict) ## only changed attributes are sent
         return None
-    
+
+    def RenderImage(self):
+        img_path = None if self.framebuffer else self.folder_path + "/_render"
+        img_cv2, _, _ = self.RenderFur({}, img_path, False)
+        return img_cv2
+
     ## render image & read (BGR format)
     def RenderFur(self, params_dict, img_path, exportCSV=True):
 
         ## assign fur parameters
-        Fur.SetFurDescription(self.fur_desc, params_dict)
-        Fur.CopyFurBaseColor2Material(self.fur_desc, self.material)
+        t_setparam_start = datetime.now()
+        with Timing.Span("setparam"):
+            self.SetParams(params_dict)
+            self.params_state.update(params_dict)
+        self.t_setparam_elapsed += datetime.now() - t_setparam_start
 
         t_render_start = datetime.now()
 
-        ## export single frame as image
-        cmds.setAttr("defaultRenderGlobals.imageFilePrefix", img_path, type="string")
-        mel.eval('renderWindowRenderCamera "render" renderView '+"{0}".format(self.camera)+";")
+        with Timing.Span("render"):
+            ## skip rendering when the same parameters were rendered before
+            cache_key, img_cv2 = self.LookupCache()
+            cached = img_cv2 is not None
+
+            ## export single frame as image (no filepath: scratch image, e.g. files left to an ArchiveWriter)
+            render_path = self.scratch_path if self.framebuffer or img_path is None else img_path
+            if not cached:
+                cmds.setAttr("defaultRenderGlobals.imageFilePrefix", render_path, type="string")
+                if self.headless:
+                    ## batch renderer writes "<prefix>.0001.<ext>": rename as render window does
+                    render_file = cmds.render(self.camera, x=self.imageW_px, y=self.imageH_px)
+                    os.replace(render_file, render_path + "_tmp." + ("bmp" if self.framebuffer else self.imgFileExt))
+                else:
+                    mel.eval('renderWindowRenderCamera "render" renderView '+"{0}".format(self.camera)+";")
 
         t_render_end = datetime.now()
         t_render_elapsed = t_render_end - t_render_start
 
         t_imageio_start = datetime.now()
 
-        ## export parameter as CSV file if needed
-        if exportCSV:
-            csv_file = img_path + ".csv"
-            FurParam.dict2csv(params_dict, csv_file)
-        
-        ## read rendered image for further processing
-        img_file = img_path + "_tmp." + self.imgFileExt
-        img_cv2  = cv2.imread(img_file)
+        exportCSV = exportCSV and self.exportCSV
+
+        with Timing.Span("imageio"):
+            ## read rendered image for further processing
+            if cached:
+                if not self.framebuffer and img_path is not None:
+                    cv2.imwrite(img_path + "_tmp." + self.imgFileExt, img_cv2) ## same files as rendering
+            else:
+                if self.framebuffer:
+                    img_cv2 = ImageIO.ReadBMP(render_path + "_tmp.bmp")
+                else:
+                    img_file = render_path + "_tmp." + self.imgFileExt
+                    img_cv2  = cv2.imread(img_file)
+
+                self.num_renders += 1
+                if cache_key is not None:
+                    self.cache.Put(cache_key, image=img_cv2)
+
+            ## archival image (and CSV) only when requested, off the critical path
+            if self.framebuffer and self.archiver is not None and img_path is not None:
+                self.archiver.Submit(img_cv2, params_dict if exportCSV else None, img_path)
+                exportCSV = False
+
+            ## export parameter as CSV file if needed
+            if exportCSV and img_path is not None:
+                csv_file = img_path + ".csv"
+                FurParam.dict2csv(params_dict, csv_file)
 
         t_imageio_end = datetime.now()
         t_imageio_elapsed = t_imageio_end - t_imageio_start
 
+        ## accumulate elapsed time
+        self.t_render_elapsed  += t_render_elapsed
+        self.t_imageio_elapsed += t_imageio_elapsed
+
         return img_cv2, t_render_elapsed, t_imageio_elapsed
@@ -0,0 +1,238 @@
+###############################################################################
+## batch driver: optimizes all references of a folder on worker processes
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os, shutil
+import argparse
+import runpy
+import traceback
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from stNoh import FurParam
+from stNoh import Progress
+from stNoh import RefFeature
+from stNoh import SampleQueue
+
+
+###############################################################################
+## parameter normalization [0.0:1.0]
+###############################################################################
+def convert_param_geom_func(params01_vec):
+    params01_dict = {}
+    for cnt, key in enumerate(FurParam.ParamsGeom):
+        params01_dict[key] = params01_vec[cnt]
+
+    params_dict = FurParam.ConvertFurParams(params01_dict, True)
+    return params_dict
+
+def convert_param_color_func(params01_vec):
+    params01_dict = {}
+    for cnt, key in enumerate(FurParam.ParamsColor):
+        params01_dict[key] = params01_vec[cnt]
+
+    params_dict = FurParam.ConvertFurParams(params01_dict, True)
+    return params_dict
+
+def invert_param_func(params_dict, keys):
+    return [FurParam.ConvertFurParam(key, params_dict[key]) for key in keys]
+
+
+###############################################################################
+## worker process side
+###############################################################################
+_renderer = None ## render backend of this worker
+_features = None ## namespace of init_feature.py (VGG19 loaded once per worker)
+
+def InitWorker(backend, scene_path, init_feature_path):
+    """
+    Opens the prepared scene (headless Maya) or creates the offline renderer,
+    and loads the feature functions.
+    """
+    global _renderer, _features
+
+    if "maya" == backend:
+        import maya.standalone
+        maya.standalone.initialize(name="python")
+        import maya.cmds as cmds
+        cmds.file(scene_path, open=True, force=True)
+
+        import Misc
+        _renderer = Misc.FurRenderer()
+    else:
+        from stNoh import FakeFur
+        _renderer = FakeFur.FakeFurRenderer()
+
+    _features = runpy.run_path(init_feature_path, run_name="__main__")
+    return None
+
+def IsFinished(folder_sample):
+    return all([os.path.isfile("{0}/_best_{1}.csv".format(folder_sample, stage)) for stage in ["shape", "color"]])
+
+def RunSample(img_ref_path, folder_sample, image_ext, opts):
+    """
+    Geometry (BayesOpt -> FeatureGrad), then color (BayesOpt -> FeatureGrad).
+    A stage with "_best_<stage>.csv" in folder_sample is not run again,
+    and an interrupted stage continues from its checkpoints.
+    Returns dictionary of cost, wall time and render count.
+    """
+    import search_BayesOpt
+    import search_FeatureGrad
+
+    t_start = datetime.now()
+    num_renders_start = _renderer.num_renders
+
+    calc_cost_func = _features["calc_cost_func"]
+
+    ## initial parameters: default colors (+ parameters of the reference if exists)
+    params_dict = dict(FurParam.ParamsColor)
+    csv_ref_path = os.path.splitext(img_ref_path)[0] + ".csv"
+    if os.path.isfile(csv_ref_path):
+        params_dict.update(FurParam.csv2dict(csv_ref_path))
+
+    stages = [
+        ("shape", FurParam.ParamsGeom , convert_param_geom_func , _features["vgg_max_gray_gram"] , opts["geom"]),
+        ("color", FurParam.ParamsColor, convert_param_color_func, _features["vgg_max_color_gram"], opts["color"]),
+    ]
+    for stage, keys, convert_param_func, get_feature_func, (bo_params, fg_params) in stages:
+        csv_best_path = "{0}/_best_{1}.csv".format(folder_sample, stage)
+        if os.path.isfile(csv_best_path):
+            params_dict.update(FurParam.csv2dict(csv_best_path))
+            continue
+
+        ## deterministic folder per sample & stage
+        folder_stage = "{0}/{1}".format(folder_sample, stage)
+        for folder in [folder_stage + "/bayesopt", folder_stage + "/grad", folder_stage + "/step"]:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        shutil.copy2(img_ref_path, folder_stage+"/_ref_image.{0}".format(image_ext))
+        RefFeature.CopyStore(img_ref_path, folder_stage+"/_ref_image.{0}".format(image_ext))
+
+        _renderer.Init(folder_stage)
+        _renderer.RenderFur(params_dict, None, False) ## parameters of the previous stage
+
+        ## no windows on workers: progress as JSON lines, cancelled by "<out>/_cancel"
+        progress = Progress.LogProgress(folder_stage + "/progress.jsonl",
+                                        cancel_path=os.path.dirname(folder_sample) + "/_cancel")
+        bo_params = dict(bo_params, progress=progress)
+        fg_params = dict(fg_params, progress=progress)
+
+        ## interrupted stage: resumed from the checkpoints of its searches
+        ## (a finished BayesOpt only returns its best point)
+        resume_bo = folder_stage + "/_checkpoint_bayesopt.pkl"
+        resume_fg = folder_stage + "/_checkpoint_featuregrad.pkl"
+
+        ## global search, then local search from its result
+        succeeded, params_stage_dict = search_BayesOpt.BayesOpt(
+            get_feature_func, calc_cost_func, _renderer.RenderFur,
+            convert_param_func, [0.5]*len(keys),
+            folder_stage, image_ext, bo_params,
+            resume_from=resume_bo if os.path.isfile(resume_bo) else None
+        )
+        if succeeded:
+            succeeded, params_stage_dict = search_FeatureGrad.GradientDescent(
+                get_feature_func, calc_cost_func, _renderer.RenderFur,
+                convert_param_func, invert_param_func(params_stage_dict, keys),
+                folder_stage, image_ext, fg_params,
+                resume_from=resume_fg if os.path.isfile(resume_fg) else None
+            )
+        if not succeeded:
+            raise RuntimeError("optimization of {0} was aborted".format(stage))
+
+        params_dict.update(params_stage_dict)
+        _renderer.RenderFur(params_stage_dict, "{0}/_best_{1}".format(folder_sample, stage))
+
+    ## cost of the final result (color feature, as the last stage)
+    G_ref, img_ref_cv2 = RefFeature.LoadReferenceGram(img_ref_path, _features["vgg_max_color_gram"])
+    img_best_cv2, _, _ = _renderer.RenderFur(params_dict, None, False)
+    G_best, _ = _features["vgg_max_color_gram"](img_best_cv2)
+
+    return {
+        "cost"       : float(calc_cost_func(G_ref, G_best)),
+        "wall_time_s": (datetime.now() - t_start).total_seconds(),
+        "renders"    : _renderer.num_renders - num_renders_start,
+    }
+
+
+###############################################################################
+## main routine
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    parser = argparse.ArgumentParser(description="Optimizes fur parameters of all references in a folder concurrently.")
+    parser.add_argument("folder", help="folder of reference images")
+    parser.add_argument("--out", default=None, help="output folder (default: <folder>/../_batch)")
+    parser.add_argument("--ext", default="jpg", help="file extension of reference images")
+    parser.add_argument("--workers", type=int, default=2, help="number of worker processes (one renderer each)")
+    parser.add_argument("--backend", default="maya", choices=["maya", "fake"],
+                        help="maya: headless Maya with --scene, fake: offline renderer (stNoh/FakeFur.py)")
+    parser.add_argument("--scene", default=None, help="prepared Maya scene (see init_scene.py)")
+    parser.add_argument("--geom-iter", type=int, default=100, help="BayesOpt iterations for geometry")
+    parser.add_argument("--color-iter", type=int, default=50, help="BayesOpt iterations for color")
+    args = parser.parse_args()
+
+    folder_out = args.out if args.out is not None else os.path.join(os.path.dirname(os.path.abspath(args.folder)), "_batch")
+    if not os.path.isdir(folder_out):
+        os.makedirs(folder_out)
+
+    ## the same settings as search_RealFurSample.py
+    opts = {
+        "geom" : ({"max_iter":args.geom_iter }, {"max_iter":20,"max_step":15,"delta":0.1  }),
+        "color": ({"max_iter":args.color_iter}, {"max_iter":20,"max_step":10,"delta":0.075}),
+    }
+    init_feature_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_feature.py")
+
+    ############################################################
+    ## job queue: one deterministic folder per sample
+    ############################################################
+    fileList = sorted(next(os.walk(args.folder))[2])
+    fileList = [imgFile for imgFile in fileList if ".{0}".format(args.ext)==os.path.splitext(imgFile)[1]]
+
+    queue = SampleQueue.SampleQueue(folder_out + "/_batch_status.json")
+    for imgFile in fileList:
+        sample = os.path.splitext(imgFile)[0]
+        folder_sample = "{0}/{1}".format(folder_out, sample)
+        queue.Add(sample, "{0}/{1}".format(args.folder, imgFile), folder_sample,
+                  "skipped" if IsFinished(folder_sample) else "pending")
+
+    ############################################################
+    ## run pending samples on worker processes
+    ############################################################
+    executor = ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=InitWorker,
+        initargs=(args.backend, args.scene, init_feature_path))
+
+    futures = {}
+    for sample in queue.Samples("pending"):
+        job = queue.jobs[sample]
+        futures[executor.submit(RunSample, job["reference"], job["folder"], args.ext, opts)] = sample
+
+    while len(futures) > 0:
+        done, _ = wait(list(futures.keys()), timeout=5.0, return_when=FIRST_COMPLETED)
+
+        ## started jobs
+        for future, sample in futures.items():
+            if future.running() and queue.jobs[sample]["status"] == "pending":
+                queue.Set(sample, status="running")
+
+        for future in done:
+            sample = futures.pop(future)
+            try:
+                queue.Set(sample, status="done", **future.result())
+            except Exception as e:
+                traceback.print_exc()
+                queue.Set(sample, status="failed", error=repr(e))
+            print("{0}: {1}".format(sample, queue.jobs[sample]["status"]))
+
+    executor.shutdown(wait=True)
+
+    ############################################################
+    ## summary
+    ############################################################
+    queue.WriteSummary(folder_out + "/_batch_summary.txt")
+    with open(folder_out + "/_batch_summary.txt") as txt:
+        print(txt.read())
@@ -0,0 +1,108 @@
+###############################################################################
+## benchmark: serial vs. batch (asynchronous) Bayesian optimization
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import json
+from datetime import datetime
+
+import numpy as np
+import cv2
+
+from stNoh import FakeFur
+from stNoh import FurParam
+from stNoh import RenderPool
+import search_BayesOpt
+
+
+###############################################################################
+## main routine: run after init_feature.py (vgg_max_gray_gram, calc_cost_func)
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    folder_bench = "C:/FurImages/Benchmark-BayesOptBatch"
+    max_iter     = 80               ## the same evaluation budget for all runs
+    batch_sizes  = [1, 2, 4, 8]     ## 1: serial (original)
+    strategy     = "cl_min"         ## see search_BayesOpt.AskPoints()
+    seed_ref     = 0                ## ground-truth parameters of the reference
+
+    ########################################
+    ## parameter normalization [0.0:1.0]
+    ########################################
+    def convert_param_func(params01_vec):
+        params01_dict = {}
+        for cnt, key in enumerate(FurParam.ParamsGeom):
+            params01_dict[key] = params01_vec[cnt]
+
+        params_dict = FurParam.ConvertFurParams(params01_dict, True)
+        return params_dict
+
+    ## reference: rendered from random parameters by the offline renderer (960x540)
+    params01_vec_ref = np.random.RandomState(seed_ref).random_sample(len(FurParam.ParamsGeom))
+    img_ref_cv2, _, _ = FakeFur.FakeFurRenderer().RenderFur(convert_param_func(params01_vec_ref), None)
+
+    ############################################################
+    ## run
+    ############################################################
+    results = []
+    for batch_size in batch_sizes:
+        folder_root = "{0}/batch{1:02d}_{2}".format(folder_bench, batch_size, datetime.now().strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(folder_root + "/bayesopt")
+        cv2.imwrite(folder_root + "/_ref_image.png", img_ref_cv2) ## lossless: the same image as best_cost below
+
+        renderer = FakeFur.FakeFurRenderer()
+        opt_params_dict = {'max_iter': max_iter, 'batch_size': batch_size, 'strategy': strategy}
+        if batch_size > 1:
+            opt_params_dict['render_pool'] = RenderPool.RenderPool(FakeFur.FakeFurRenderer, num_workers=batch_size, renderer=renderer)
+            list(opt_params_dict['render_pool'].RenderAll([({}, None)] * batch_size)) ## warm-up: start all workers
+
+        t_start = datetime.now()
+        succeeded, best_params_dict = search_BayesOpt.BayesOpt(
+            vgg_max_gray_gram, calc_cost_func, renderer.RenderFur,
+            convert_param_func, [0.5]*len(FurParam.ParamsGeom),
+            folder_root, "png", opt_params_dict
+        )
+        t_elapsed = datetime.now() - t_start
+
+        if opt_params_dict.get('render_pool') is not None:
+            opt_params_dict['render_pool'].Close()
+
+        ## evaluate the best result (render & cost, parameter error to ground truth)
+        img_best_cv2, _, _ = renderer.RenderFur(best_params_dict, None)
+        G_ref, _  = vgg_max_gray_gram(img_ref_cv2)
+        G_best, _ = vgg_max_gray_gram(img_best_cv2)
+        params01_vec_best = [FurParam.ConvertFurParam(key, best_params_dict[key]) for key in FurParam.ParamsGeom]
+
+        result = {
+            "batch_size"  : batch_size,
+            "strategy"    : strategy,
+            "evaluations" : max_iter,
+            "succeeded"   : succeeded,
+            "wall_clock_s": t_elapsed.total_seconds(),
+            "best_cost"   : float(calc_cost_func(G_ref, G_best)),
+            "param_error" : float(np.mean(np.abs(np.array(params01_vec_best) - params01_vec_ref))),
+        }
+        results.append(result)
+        print(result)
+
+        if False==succeeded:
+            break
+
+    ############################################################
+    ## report
+    ############################################################
+    with open(folder_bench + "/bench_BayesOptBatch.json", "w+") as f:
+        json.dump(results, f, indent=2)
+
+    with open(folder_bench + "/bench_BayesOptBatch.txt", "w+") as txt:
+        txt.write("batch  wall-clock[s]  speed-up  best cost  param error\n")
+        for result in results:
+            txt.write("{0:5d}  {1:13.1f}  {2:8.2f}  {3:9.4g}  {4:11.4f}\n".format(
+                result["batch_size"], result["wall_clock_s"],
+                results[0]["wall_clock_s"] / result["wall_clock_s"],
+                result["best_cost"], result["param_error"]))
+
+    cv2.destroyAllWindows()
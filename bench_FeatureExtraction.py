@@ -0,0 +1,224 @@
+###############################################################################
+## micro-benchmark: hot paths of feature extraction & cost evaluation
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import argparse
+import json
+import runpy
+import time
+import tracemalloc
+
+import numpy as np
+import cv2
+
+from stNoh import vgg19
+from stNoh import Gram
+from keras import backend as K
+
+
+###############################################################################
+## subroutine: time & peak memory of a function
+###############################################################################
+def Measure(func, repeat=10, warmup=2, nbytes=None):
+    """
+    Calls func() (warmup + repeat) times.
+    Returns time per call [ms] (mean, p50, min), calls per second,
+    throughput [MB/s] of nbytes (input size) and peak memory [bytes]
+    of one call traced by tracemalloc (NumPy/Python allocations only).
+    """
+    for n in range(warmup):
+        func()
+
+    times = []
+    for n in range(repeat):
+        t_start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t_start)
+    times_ms = np.array(times) * 1e3
+
+    ## separate call: tracing slows down allocations
+    tracemalloc.start()
+    func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean_s = float(np.mean(times))
+    return {
+        "mean_ms"    : float(np.mean(times_ms)),
+        "p50_ms"     : float(np.median(times_ms)),
+        "min_ms"     : float(np.min(times_ms)),
+        "calls_per_s": 1.0 / mean_s if mean_s > 0 else None,
+        "mb_per_s"   : nbytes / mean_s / 1e6 if nbytes is not None and mean_s > 0 else None,
+        "peak_bytes" : int(peak_bytes),
+    }
+
+
+###############################################################################
+## main routine
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    parser = argparse.ArgumentParser(description="Measures preprocess, VGG19 forward pass, Gram matrices and cost evaluation.")
+    parser.add_argument("--out", default=".", help="output folder of bench_FeatureExtraction.json/.txt")
+    parser.add_argument("--repeat", type=int, default=10, help="number of timed calls")
+    parser.add_argument("--image", default=None, help="input image (default: random 960x540 image)")
+    parser.add_argument("--init-feature", default=None, help="script defining the feature functions (default: init_feature.py)")
+    args = parser.parse_args()
+
+    ## VGG19 & feature settings actually used by the search modules
+    init_feature_path = args.init_feature if args.init_feature is not None else \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_feature.py")
+    features = runpy.run_path(init_feature_path, run_name="__main__")
+    model          = features["model_max"]
+    feature_layers = features["feature_layers_max"]
+    weight_layers  = features["weight_layers_max"]
+    calc_cost_func = features["calc_cost_func"]
+
+    ## input image 960x540 (BGR) and the crop of vgg_max_color_gram (260x320)
+    if args.image is not None:
+        img_cv2 = cv2.resize(cv2.imread(args.image), (960, 540))
+    else:
+        img_cv2 = np.random.RandomState(0).randint(0, 256, (540, 960, 3)).astype(np.uint8)
+
+    inputs = [
+        ("960x540", lambda img: cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)), ## gray on 3-channel model (see below)
+        ("320x260", lambda img: img[160:420,320:640,:]),                                                   ## vgg_max_color_gram
+    ]
+
+    ## conv./pooling layers in order, and a function per layer
+    layers = list(model.layers[1:])
+    layer_funcs = [K.function([layer.input], [layer.output]) for layer in layers]
+
+    results = []
+    shapes  = {} ## size -> (H, W) of network input
+    def add(size, stage, name, stat):
+        stat.update({"size": size, "stage": stage, "name": name})
+        results.append(stat)
+        print("{0:<8} {1:<10} {2:<14} {3:10.3f} ms  {4:10.1f} MB peak".format(
+            size, stage, name, stat["mean_ms"], stat["peak_bytes"] / 1e6))
+        return None
+
+    for size, prepare in inputs:
+        img_in = np.ascontiguousarray(prepare(img_cv2))
+        shapes[size] = img_in.shape[:2]
+
+        ############################################################
+        ## preprocess
+        ############################################################
+        add(size, "preprocess", "prepare", Measure(lambda: prepare(img_cv2), args.repeat, nbytes=img_cv2.nbytes))
+        add(size, "preprocess", "preprocess_input", Measure(lambda: vgg19.preprocess_input(img_in), args.repeat, nbytes=img_in.nbytes))
+        img_keras = vgg19.preprocess_input(img_in)
+
+        ############################################################
+        ## forward pass: whole network, then layer by layer
+        ############################################################
+        func_all = K.function([model.input], [model.get_layer(layer).output for layer in feature_layers])
+        stat = Measure(lambda: func_all([img_keras]), args.repeat, nbytes=img_keras.nbytes)
+        stat["activation_bytes"] = vgg19.activation_bytes(img_in.shape[0], img_in.shape[1], feature_layers)
+        add(size, "forward", "feature_layers", stat)
+
+        ## FLOPs of all VGG19 layers (the model may stop at the deepest feature layer)
+        flops = dict([(name, flop) for name, flop, _ in vgg19.layer_flops(img_in.shape[0], img_in.shape[1])])
+
+        activations = {}
+        x = img_keras
+        for layer, layer_func in zip(layers, layer_funcs):
+            x_in = x
+            stat = Measure(lambda: layer_func([x_in]), args.repeat, nbytes=x_in.nbytes)
+            stat["gflops"] = flops[layer.name] / 1e9
+            stat["gflops_per_s"] = stat["gflops"] / (stat["mean_ms"] * 1e-3)
+            add(size, "forward", layer.name, stat)
+            x = layer_func([x_in])[0]
+            activations[layer.name] = x
+
+        ############################################################
+        ## Gram matrices per feature layer: full matrix (np_gram_matrix),
+        ## packed upper triangle (Gram.GramEngine) by syrk & gemm
+        ############################################################
+        G = []
+        for l, layer in enumerate(feature_layers):
+            F = activations[layer][0]
+            add(size, "gram", layer, Measure(lambda: vgg19.np_gram_matrix(F) * weight_layers[l], args.repeat, nbytes=F.nbytes))
+            for kernel in ["syrk", "gemm"]:
+                engine_l = Gram.GramEngine([weight_layers[l]], K.image_data_format(), kernel)
+                add(size, "gram_" + kernel, layer, Measure(lambda: engine_l.Compute([F]), args.repeat, nbytes=F.nbytes))
+            G.append(vgg19.np_gram_matrix(F) * weight_layers[l])
+
+        ## all feature layers into one buffer (as vgg_max_*_gram)
+        F_all = [activations[layer][0] for layer in feature_layers]
+        engine = Gram.GramEngine(weight_layers, K.image_data_format())
+        add(size, "gram_syrk", "all_layers", Measure(lambda: engine.Compute(F_all), args.repeat, nbytes=sum([F.nbytes for F in F_all])))
+        G_packed = engine.Compute(F_all)
+
+        ############################################################
+        ## cost evaluation & G_*_vec: full matrices (concatenated) vs. packed
+        ############################################################
+        def cost_concat(G_ref, G_dst):
+            G_diff = np.concatenate([G_l.flatten() for G_l in G_ref]) - np.concatenate([G_l.flatten() for G_l in G_dst])
+            return np.sum(G_diff ** 2)
+
+        G_ref = [G_l * 1.01 for G_l in G] ## another Gram list of the same shape
+        G_ref_packed = Gram.Pack(G_ref)
+        nbytes = sum([G_l.nbytes for G_l in G])
+        add(size, "cost", "concat", Measure(lambda: cost_concat(G_ref, G), args.repeat * 10, nbytes=2 * nbytes))
+        add(size, "cost", "calc_cost_func", Measure(lambda: calc_cost_func(G_ref_packed, G_packed), args.repeat * 10, nbytes=2 * G_packed.vec.nbytes))
+        add(size, "cost", "G_vec_concat", Measure(lambda: np.concatenate([G_l.flatten() for G_l in G]), args.repeat * 10, nbytes=nbytes))
+        add(size, "cost", "G_vec_packed", Measure(lambda: Gram.Vector(G_packed), args.repeat * 10, nbytes=G_packed.vec.nbytes))
+
+    ############################################################
+    ## gray input at 960x540: BGR->GRAY->BGR on the 3-channel model
+    ## vs. 1-channel model (model_gray) as vgg_max_gray_gram
+    ############################################################
+    size = "960x540"
+    model_gray = features["model_gray"]
+
+    prepare_BGR  = lambda: vgg19.preprocess_input(cv2.cvtColor(cv2.cvtColor(img_cv2, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR))
+    prepare_gray = lambda: vgg19.preprocess_input_gray(cv2.cvtColor(img_cv2, cv2.COLOR_BGR2GRAY))
+    add(size, "gray_input", "prepare_BGR" , Measure(prepare_BGR , args.repeat, nbytes=img_cv2.nbytes))
+    add(size, "gray_input", "prepare_gray", Measure(prepare_gray, args.repeat, nbytes=img_cv2.nbytes))
+    img_keras_BGR, img_keras_gray = prepare_BGR(), prepare_gray()
+
+    ## first layer (folded weights) & all feature layers
+    for name, m, img_keras in [("BGR", model, img_keras_BGR), ("gray", model_gray, img_keras_gray)]:
+        func_conv1 = K.function([m.input], [m.get_layer("block1_conv1").output])
+        func_all   = K.function([m.input], [m.get_layer(layer).output for layer in feature_layers])
+        add(size, "gray_input", "conv1_" + name, Measure(lambda: func_conv1([img_keras]), args.repeat, nbytes=img_keras.nbytes))
+        add(size, "gray_input", "forward_" + name, Measure(lambda: func_all([img_keras]), args.repeat, nbytes=img_keras.nbytes))
+
+    ## whole feature function (preprocess, forward pass, Gram matrices)
+    add(size, "gray_input", "vgg_max_gray", Measure(lambda: features["vgg_max_gray_gram"](img_cv2), args.repeat, nbytes=img_cv2.nbytes))
+
+    ############################################################
+    ## report
+    ############################################################
+    with open(os.path.join(args.out, "bench_FeatureExtraction.json"), "w+") as f:
+        json.dump({"backend": K.backend(), "image_data_format": K.image_data_format(), "results": results}, f, indent=2)
+
+    with open(os.path.join(args.out, "bench_FeatureExtraction.txt"), "w+") as txt:
+        txt.write("{0:<8} {1:<10} {2:<16} {3:>10} {4:>10} {5:>10} {6:>10} {7:>12}\n".format(
+            "size", "stage", "name", "mean[ms]", "p50[ms]", "calls/s", "MB/s", "peak[MB]"))
+        for stat in results:
+            txt.write("{0:<8} {1:<10} {2:<16} {3:10.3f} {4:10.3f} {5:10.1f} {6:>10} {7:12.2f}\n".format(
+                stat["size"], stat["stage"], stat["name"], stat["mean_ms"], stat["p50_ms"], stat["calls_per_s"],
+                "-" if stat["mb_per_s"] is None else "{0:.1f}".format(stat["mb_per_s"]),
+                stat["peak_bytes"] / 1e6))
+
+        ## cost of a forward pass up to each layer (= deepest feature layer)
+        for size, _ in inputs:
+            txt.write("\n{0}: forward pass up to layer\n".format(size))
+            txt.write("{0:<16} {1:>10} {2:>12} {3:>14} {4:>10}\n".format("layer", "GFLOPs", "GFLOP/s", "cum. GFLOPs", "cum. [ms]"))
+            gflops_cum, time_cum = 0.0, 0.0
+            for stat in [stat for stat in results if stat["size"] == size and "gflops" in stat]:
+                gflops_cum += stat["gflops"]
+                time_cum   += stat["mean_ms"]
+                txt.write("{0:<16} {1:10.2f} {2:12.1f} {3:14.2f} {4:10.1f}\n".format(
+                    stat["name"], stat["gflops"], stat["gflops_per_s"], gflops_cum, time_cum))
+
+            ## layers not built (after the deepest feature layer)
+            skipped = [(name, flop) for name, flop, _ in vgg19.layer_flops(*shapes[size]) if name not in [layer.name for layer in layers]]
+            if len(skipped) > 0:
+                txt.write("not built: {0} ({1:.2f} GFLOPs)\n".format(", ".join([name for name, _ in skipped]), sum([flop for _, flop in skipped]) / 1e9))
@@ -0,0 +1,156 @@
+###############################################################################
+## benchmark: image transport from render workers to the feature extractor
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os, shutil
+import json
+import tempfile
+import time
+import multiprocessing
+
+import numpy as np
+import cv2
+
+from stNoh import FakeFur
+from stNoh import SharedFrames
+
+
+###############################################################################
+## producers (render worker side): frames are sent with their send time
+###############################################################################
+def ProduceFiles(img_cv2, num_frames, folder, ext, paths):
+    for cnt in range(num_frames):
+        img_path = "{0}/frame_{1:04d}.{2}".format(folder, cnt, ext)
+        t_send = time.perf_counter()
+        cv2.imwrite(img_path, img_cv2)
+        paths.put( (img_path, t_send) )
+    return None
+
+def ProducePickle(img_cv2, num_frames, frames_queue):
+    for cnt in range(num_frames):
+        frames_queue.put( (img_cv2, time.perf_counter()) )
+    return None
+
+def ProduceRing(img_cv2, num_frames, ring, stats):
+    for cnt in range(num_frames):
+        ring.Put(img_cv2, time.perf_counter())
+    stats.put(ring.Stats())
+    return None
+
+
+###############################################################################
+## consumer (feature extractor side)
+###############################################################################
+def Consume(num_frames, receive):
+    """
+    receive(): returns (img_cv2, t_send, release) of the next frame.
+    Returns frames/s and latency [ms] (send -> pixels readable by consumer).
+    """
+    latencies = []
+    t_start = time.perf_counter()
+    for cnt in range(num_frames):
+        img_cv2, t_send, release = receive()
+        img_cv2.mean(axis=(0,1)) ## touch all pixels (stand-in for VGG input)
+        latencies.append(time.perf_counter() - t_send)
+        release()
+    t_elapsed = time.perf_counter() - t_start
+
+    return {
+        "frames_per_s"     : num_frames / t_elapsed,
+        "latency_mean_ms"  : 1000.0 * float(np.mean(latencies)),
+        "latency_p95_ms"   : 1000.0 * float(np.percentile(latencies, 95)),
+    }
+
+
+###############################################################################
+## main routine
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    folder_bench = os.path.join(tempfile.gettempdir(), "Benchmark-FrameTransport")
+    num_frames   = 200
+    num_slots    = 4   ## slots of FrameRing (< num_frames: backpressure is measured)
+
+    if os.path.isdir(folder_bench):
+        shutil.rmtree(folder_bench)
+    os.makedirs(folder_bench)
+
+    ## 960x540 frame of the offline renderer
+    img_cv2, _, _ = FakeFur.FakeFurRenderer().RenderFur({}, None)
+    imageH_px, imageW_px = img_cv2.shape[:2]
+
+    results = []
+
+    ############################################################
+    ## file: cv2.imwrite -> cv2.imread (current path)
+    ############################################################
+    for ext in ["jpg", "bmp"]:
+        paths = multiprocessing.Queue()
+        producer = multiprocessing.Process(target=ProduceFiles, args=(img_cv2, num_frames, folder_bench, ext, paths))
+        producer.start()
+
+        def receive():
+            img_path, t_send = paths.get()
+            return cv2.imread(img_path), t_send, (lambda: None)
+
+        result = Consume(num_frames, receive)
+        producer.join()
+        result.update({"transport": "file_" + ext, "waits": 0})
+        results.append(result)
+        print(result)
+
+    ############################################################
+    ## pickle through a queue
+    ############################################################
+    frames_queue = multiprocessing.Queue(maxsize=num_slots)
+    producer = multiprocessing.Process(target=ProducePickle, args=(img_cv2, num_frames, frames_queue))
+    producer.start()
+
+    def receive():
+        img_recv_cv2, t_send = frames_queue.get()
+        return img_recv_cv2, t_send, (lambda: None)
+
+    result = Consume(num_frames, receive)
+    producer.join()
+    result.update({"transport": "pickle_queue", "waits": 0})
+    results.append(result)
+    print(result)
+
+    ############################################################
+    ## shared memory ring (zero-copy view on consumer side)
+    ############################################################
+    ring  = SharedFrames.FrameRing(imageW_px, imageH_px, num_slots)
+    stats = multiprocessing.Queue()
+    producer = multiprocessing.Process(target=ProduceRing, args=(img_cv2, num_frames, ring, stats))
+    producer.start()
+
+    def receive():
+        slot, t_send = ring.Next()
+        return ring.Frame(slot), t_send, (lambda: ring.Release(slot))
+
+    result = Consume(num_frames, receive)
+    result.update({"transport": "shared_ring", "waits": stats.get()["waits"]})
+    producer.join()
+    ring.Close()
+    results.append(result)
+    print(result)
+
+    ############################################################
+    ## report
+    ############################################################
+    with open(folder_bench + "/bench_FrameTransport.json", "w+") as f:
+        json.dump(results, f, indent=2)
+
+    with open(folder_bench + "/bench_FrameTransport.txt", "w+") as txt:
+        txt.write("{0}x{1}, {2} frames, {3} ring slots\n".format(imageW_px, imageH_px, num_frames, num_slots))
+        txt.write("transport      frames/s  latency mean[ms]  latency p95[ms]  producer waits\n")
+        for result in results:
+            txt.write("{0:<13} {1:9.1f}  {2:16.2f}  {3:15.2f}  {4:14d}\n".format(
+                result["transport"], result["frames_per_s"],
+                result["latency_mean_ms"], result["latency_p95_ms"], result["waits"]))
+
+    with open(folder_bench + "/bench_FrameTransport.txt") as txt:
+        print(txt.read())
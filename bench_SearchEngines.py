@@ -0,0 +1,223 @@
+###############################################################################
+## benchmark: search engines on the offline renderer (known ground truth)
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os, shutil
+import argparse
+import json
+import runpy
+from datetime import datetime
+
+import numpy as np
+import cv2
+
+from stNoh import FakeFur
+from stNoh import FurParam
+from stNoh import Progress
+import search_BayesOpt
+import search_Conventional
+import search_FeatureGrad
+
+
+###############################################################################
+## parameter normalization [0.0:1.0]
+###############################################################################
+def convert_param_func(params01_vec):
+    params01_dict = {}
+    for cnt, key in enumerate(FurParam.ParamsGeom):
+        params01_dict[key] = params01_vec[cnt]
+
+    params_dict = FurParam.ConvertFurParams(params01_dict, True)
+    return params_dict
+
+def invert_param_func(params_dict):
+    return [FurParam.ConvertFurParam(key, params_dict[key]) for key in FurParam.ParamsGeom]
+
+
+###############################################################################
+## render budget & curves
+###############################################################################
+class BudgetProgress(Progress.NullProgress):
+    """
+    Records (renders, wall time, best cost so far) after every evaluation,
+    and cancels the search when the renderer reaches the render budget.
+    """
+
+    def __init__(self, renderer, budget):
+        Progress.NullProgress.__init__(self)
+        self.renderer = renderer
+        self.budget   = budget
+        self.curve    = [] ## [renders, wall time [s], best cost]
+        self.t_start  = datetime.now()
+        pass
+
+    def Begin(self, max_value, title=""):
+        self.t_start = datetime.now()
+        return None
+
+    def Step(self, value, cost=None, text=""):
+        if cost is not None:
+            cost_best = float(cost) if len(self.curve) == 0 else min(self.curve[-1][2], float(cost))
+            self.curve.append( [self.renderer.num_renders, (datetime.now() - self.t_start).total_seconds(), cost_best] )
+
+        if self.renderer.num_renders >= self.budget:
+            self.Cancel()
+        return None
+
+    def CostAt(self, budget):
+        costs = [cost for renders, _, cost in self.curve if renders <= budget]
+        return costs[-1] if len(costs) > 0 else None
+
+
+###############################################################################
+## engines: (folder, renderer, features, budget, progress) -> best parameters
+###############################################################################
+
+## reference is stored losslessly: the engines & best_cost see the same image
+image_ext = "png"
+
+def RunBayesOpt(folder, renderer, features, budget, progress):
+    _, params_dict = search_BayesOpt.BayesOpt(
+        features["vgg_max_gray_gram"], features["calc_cost_func"], renderer.RenderFur,
+        convert_param_func, [0.5]*len(FurParam.ParamsGeom),
+        folder, image_ext, {"max_iter": budget, "progress": progress}
+    )
+    return params_dict
+
+def RunFeatureGrad(folder, renderer, features, budget, progress):
+    _, params_dict = search_FeatureGrad.GradientDescent(
+        features["vgg_max_gray_gram"], features["calc_cost_func"], renderer.RenderFur,
+        convert_param_func, [0.5]*len(FurParam.ParamsGeom),
+        folder, image_ext, {"max_iter": budget, "max_step": 15, "delta": 0.1, "progress": progress}
+    )
+    return params_dict
+
+def RunSLSQP(folder, renderer, features, budget, progress):
+    _, params_dict = search_Conventional.LocalSearch(
+        features["vgg_max_gray_gram"], features["calc_cost_func"], renderer.RenderFur,
+        convert_param_func, [0.5]*len(FurParam.ParamsGeom),
+        folder, image_ext, {"max_iter": budget, "delta": 0.1, "progress": progress}
+    )
+    return params_dict
+
+Engines = {
+    "bayesopt"   : RunBayesOpt,
+    "featuregrad": RunFeatureGrad,
+    "slsqp"      : RunSLSQP,
+}
+
+
+###############################################################################
+## main routine
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    parser = argparse.ArgumentParser(description="Compares search engines on the offline renderer with known ground truth.")
+    parser.add_argument("--out", default="C:/FurImages/Benchmark-SearchEngines", help="output folder")
+    parser.add_argument("--engines", default="bayesopt,featuregrad,slsqp", help="comma-separated: " + ",".join(sorted(Engines.keys())))
+    parser.add_argument("--samples", type=int, default=3, help="number of ground-truth parameter vectors")
+    parser.add_argument("--seed", type=int, default=0, help="seed of ground-truth parameters")
+    parser.add_argument("--budgets", default="25,50,100", help="comma-separated render budgets (the largest one is run)")
+    parser.add_argument("--size", default="960x540", help="image size of the offline renderer")
+    parser.add_argument("--init-feature", default=None, help="script defining vgg_max_gray_gram & calc_cost_func (default: init_feature.py)")
+    args = parser.parse_args()
+
+    engines = args.engines.split(",")
+    budgets = sorted([int(budget) for budget in args.budgets.split(",")])
+    imageW_px, imageH_px = [int(px) for px in args.size.split("x")]
+
+    ## load VGG19 & feature functions only once
+    init_feature_path = args.init_feature if args.init_feature is not None else \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_feature.py")
+    features = runpy.run_path(init_feature_path, run_name="__main__")
+
+    folder_bench = "{0}/{1}".format(args.out, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    os.makedirs(folder_bench)
+
+    ## ground truth: random normalized geometry parameters
+    rng = np.random.RandomState(args.seed)
+    params01_vec_refs = [rng.random_sample(len(FurParam.ParamsGeom)) for n in range(args.samples)]
+
+    ############################################################
+    ## run each engine on each sample with the largest budget
+    ############################################################
+    results = []
+    for num_sample, params01_vec_ref in enumerate(params01_vec_refs):
+        for engine in engines:
+            folder_run = "{0}/sample{1:02d}_{2}".format(folder_bench, num_sample, engine)
+            for folder in [folder_run + "/bayesopt", folder_run + "/grad", folder_run + "/step"]:
+                os.makedirs(folder)
+
+            ## reference by the same renderer
+            renderer = FakeFur.FakeFurRenderer()
+            renderer.SetImageFormat(imageW_px, imageH_px)
+            img_ref_cv2, _, _ = renderer.RenderFur(convert_param_func(params01_vec_ref), None)
+            cv2.imwrite(folder_run + "/_ref_image.{0}".format(image_ext), img_ref_cv2)
+            renderer.ResetTimings()
+
+            progress = BudgetProgress(renderer, budgets[-1])
+            t_start = datetime.now()
+            best_params_dict = Engines[engine](folder_run, renderer, features, budgets[-1], progress)
+            t_elapsed = (datetime.now() - t_start).total_seconds()
+            num_renders = renderer.num_renders
+
+            ## cost & parameter error of the returned best point
+            img_best_cv2, _, _ = renderer.RenderFur(best_params_dict, None)
+            G_ref , _ = features["vgg_max_gray_gram"](img_ref_cv2)
+            G_best, _ = features["vgg_max_gray_gram"](img_best_cv2)
+            param_error = np.abs(np.array(invert_param_func(best_params_dict)) - params01_vec_ref)
+
+            result = {
+                "engine"        : engine,
+                "sample"        : num_sample,
+                "renders"       : num_renders,
+                "wall_time_s"   : t_elapsed,
+                "renders_per_s" : num_renders / t_elapsed if t_elapsed > 0 else None,
+                "render_time_s" : renderer.t_render_elapsed.total_seconds(),
+                "best_cost"     : float(features["calc_cost_func"](G_ref, G_best)),
+                "cost_at_budget": {str(budget): progress.CostAt(budget) for budget in budgets},
+                "param_error"   : float(np.mean(param_error)),
+                "param_error_per_key": {key: float(param_error[cnt]) for cnt, key in enumerate(FurParam.ParamsGeom)},
+                "curve"         : progress.curve, ## [renders, wall time [s], best cost so far]
+            }
+            results.append(result)
+            print("sample {0} {1}: cost {2:.6g}, param error {3:.4f}, {4} renders, {5:.1f} s".format(
+                num_sample, engine, result["best_cost"], result["param_error"], num_renders, t_elapsed))
+
+    ############################################################
+    ## report
+    ############################################################
+    with open(folder_bench + "/bench_SearchEngines.json", "w+") as f:
+        json.dump({
+            "settings": {"engines": engines, "samples": args.samples, "seed": args.seed, "budgets": budgets,
+                         "size": [imageW_px, imageH_px], "feature": os.path.abspath(init_feature_path)},
+            "results" : results,
+        }, f, indent=2)
+
+    with open(folder_bench + "/bench_SearchEngines.txt", "w+") as txt:
+
+        ## mean over samples
+        txt.write("{0:<12}".format("engine") + "".join(["  cost@{0:<6d}".format(budget) for budget in budgets]) +
+                  "  param error  renders/s\n")
+        for engine in engines:
+            runs = [result for result in results if result["engine"] == engine]
+            costs = []
+            for budget in budgets:
+                values = [run["cost_at_budget"][str(budget)] for run in runs if run["cost_at_budget"][str(budget)] is not None]
+                costs.append("  {0:>11.4g}".format(np.mean(values)) if len(values) > 0 else "  {0:>11}".format("-"))
+            txt.write("{0:<12}{1}  {2:11.4f}  {3:9.2f}\n".format(
+                engine, "".join(costs),
+                np.mean([run["param_error"] for run in runs]),
+                np.mean([run["renders_per_s"] for run in runs])))
+
+        ## parameter error per key
+        txt.write("\n{0:<28}".format("parameter error") + "".join(["  {0:>11}".format(engine) for engine in engines]) + "\n")
+        for key in FurParam.ParamsGeom:
+            txt.write("{0:<28}".format(key) + "".join(["  {0:11.4f}".format(
+                np.mean([run["param_error_per_key"][key] for run in results if run["engine"] == engine])) for engine in engines]) + "\n")
+
+    with open(folder_bench + "/bench_SearchEngines.txt") as txt:
+        print(txt.read())
@@ -6,6 +6,9 @@ import numpy as np
 from datetime import datetime
 
 from stNoh import vgg19
+from stNoh import Gram
+from stNoh import FeatureCost
+from stNoh import Timing
 from keras import backend as K
 import cv2
 
@@ -14,18 +17,31 @@ import cv2
 ###############################################################################
 if "__main__" == __name__:
 
-    ## prepare normalized VGG19 with max pooling layers
-    model_max = vgg19.VGG19(avgPooling=False)
-    #model_avg = vgg19.VGG19(avgPooling=True)
-
     ############################################################
     ## every 2nd conv. layer in each block: "style feature"
     ############################################################
     feature_layers_max = ['block1_conv2', 'block2_conv2', 'block3_conv2', 'block4_conv2', 'block5_conv2']
     weight_layers_max  = [1e2, 1e2, 1e2, 1e2, 1e2]
+
+    ## prepare normalized VGG19 with max pooling layers (up to the deepest feature layer)
+    model_max = vgg19.VGG19(avgPooling=False, feature_layers=feature_layers_max)
+    #model_avg = vgg19.VGG19(avgPooling=True, feature_layers=feature_layers_max)
     func_layer_max     = K.function([model_max.input],
                                     [model_max.get_layer(layer).output[:,:,:,:] if K.backend()=='cntk' else
                                      model_max.get_layer(layer).output[0,:,:,:] for layer in feature_layers_max])
+    func_layer_max_batch = K.function([model_max.input],
+                                      [model_max.get_layer(layer).output for layer in feature_layers_max])
+
+    ## Gram matrices: float32 upper triangles of all feature layers in one buffer (Gram.PackedGram)
+    gram_engine_max = Gram.GramEngine(weight_layers_max, K.image_data_format())
+
+    ## the same network on gray images: 1-channel input, block1_conv1 folded (weights shared by copy)
+    model_gray = vgg19.VGG19(avgPooling=False, feature_layers=feature_layers_max, grayscale=True, weights_from=model_max)
+    func_layer_gray     = K.function([model_gray.input],
+                                     [model_gray.get_layer(layer).output[:,:,:,:] if K.backend()=='cntk' else
+                                      model_gray.get_layer(layer).output[0,:,:,:] for layer in feature_layers_max])
+    func_layer_gray_batch = K.function([model_gray.input],
+                                       [model_gray.get_layer(layer).output for layer in feature_layers_max])
     '''
     func_layer_avg     = K.function([model_avg.input],
                                     [model_avg.get_layer(layer).output[:,:,:,:] if K.backend()=='cntk' else
@@ -34,55 +50,128 @@ if "__main__" == __name__:
 
     def vgg_max_gray_gram(img_cv2):
 
-        ## convert BGR->GRAY->BGR to cancel color effect
-        img_gray = cv2.cvtColor(img_cv2 , cv2.COLOR_BGR2GRAY)
-        img_BGR  = cv2.cvtColor(img_gray, cv2.COLOR_GRAY2BGR)
+        with Timing.Span("preprocess"):
+            ## convert BGR->GRAY to cancel color effect (gray input as it is)
+            img_gray = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2GRAY) if img_cv2.ndim == 3 else img_cv2
 
-        t_feature_start = datetime.now()
+            t_feature_start = datetime.now()
 
-        ## convert and feed image
-        img_keras = vgg19.preprocess_input(img_BGR)
-        outputs = func_layer_max([img_keras])
+            ## convert and feed image: 1 channel, equivalent to BGR of identical planes
+            img_keras = vgg19.preprocess_input_gray(img_gray)
+        with Timing.Span("forward"):
+            outputs = func_layer_gray([img_keras])
         
         ## get gram matrices at feature layers
-        G = []
-        for l, _ in enumerate(feature_layers_max):
-            G_l = vgg19.np_gram_matrix(outputs[l][0] if K.backend()=='cntk' else outputs[l]) * weight_layers_max[l]
-            G.append(G_l)
+        with Timing.Span("gram"):
+            G = gram_engine_max.Compute([outputs[l][0] if K.backend()=='cntk' else outputs[l] for l, _ in enumerate(feature_layers_max)])
 
         t_feature_end = datetime.now()
         t_feature_elapsed = t_feature_end - t_feature_start
 
         return G, t_feature_elapsed
 
+    ## central part of fur images, relative to image size (960x540: [160:420,320:640])
+    def crop_center(img_cv2):
+        H, W = img_cv2.shape[:2]
+        return img_cv2[H*16//54:H*42//54, W//3:W*2//3, :]
+
     def vgg_max_color_gram(img_cv2):
 
         t_feature_start = datetime.now()
 
         ## crop image for color-only evaluation ...
-        img_cv2 = img_cv2[160:420,320:640,:] ## [IMPORTANT] it only evaluates the central part of fur images
+        img_cv2 = crop_center(img_cv2) ## [IMPORTANT] it only evaluates the central part of fur images
 
         ## convert and feed image
-        img_keras = vgg19.preprocess_input(img_cv2)
-        outputs = func_layer_max([img_keras])
+        with Timing.Span("preprocess"):
+            img_keras = vgg19.preprocess_input(img_cv2)
+        with Timing.Span("forward"):
+            outputs = func_layer_max([img_keras])
         
         ## get gram matrices at feature layers
-        G = []
-        for l, _ in enumerate(feature_layers_max):
-            G_l = vgg19.np_gram_matrix(outputs[l][0] if K.backend()=='cntk' else outputs[l]) * weight_layers_max[l]
-            G.append(G_l)
+        with Timing.Span("gram"):
+            G = gram_engine_max.Compute([outputs[l][0] if K.backend()=='cntk' else outputs[l] for l, _ in enumerate(feature_layers_max)])
 
         t_feature_end = datetime.now()
         t_feature_elapsed = t_feature_end - t_feature_start
 
         return G, t_feature_elapsed 
 
+    ############################################################
+    ## batched feature extraction: N images in one forward pass
+    ############################################################
+    feature_batch_size = 8           ## max. number of images per forward pass
+    feature_mem_budget = 2 * 1024**3 ## [bytes] for activations of a forward pass
+
+    def vgg_max_gram_batch(imgs_keras, func_layer_batch=func_layer_max_batch):
+        """
+        imgs_keras: list of preprocessed images [1,H,W,C] (same size)
+        func_layer_batch: forward pass (func_layer_gray_batch for gray images)
+        Returns list of gram matrices for each image.
+        """
+
+        ## limit the batch size by memory budget
+        shape = imgs_keras[0].shape
+        H, W, C = (shape[1], shape[2], shape[3]) if K.image_data_format()=='channels_last' else (shape[2], shape[3], shape[1])
+        batch_size = min(feature_batch_size, feature_mem_budget // vgg19.activation_bytes(H, W, feature_layers_max, grayscale=C==1))
+        batch_size = max(batch_size, 1)
+
+        G_batch = []
+        for n in range(0, len(imgs_keras), batch_size):
+            batch = np.concatenate(imgs_keras[n:n+batch_size], axis=0)
+            with Timing.Span("forward"):
+                outputs = func_layer_batch([batch])
+
+            ## gram matrices at feature layers: one buffer for the batch
+            with Timing.Span("gram"):
+                G_batch += gram_engine_max.ComputeBatch(outputs)
+
+        return G_batch
+
+    def vgg_max_gray_gram_batch(imgs_cv2):
+
+        t_feature_start = datetime.now()
+
+        imgs_keras = []
+        with Timing.Span("preprocess"):
+            for img_cv2 in imgs_cv2:
+                img_gray = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2GRAY) if img_cv2.ndim == 3 else img_cv2
+                imgs_keras.append(vgg19.preprocess_input_gray(img_gray))
+        G_batch = vgg_max_gram_batch(imgs_keras, func_layer_gray_batch)
+
+        t_feature_end = datetime.now()
+        t_feature_elapsed = t_feature_end - t_feature_start
+
+        return G_batch, t_feature_elapsed
+
+    def vgg_max_color_gram_batch(imgs_cv2):
+
+        t_feature_start = datetime.now()
+
+        with Timing.Span("preprocess"):
+            imgs_keras = [vgg19.preprocess_input(crop_center(img_cv2)) for img_cv2 in imgs_cv2]
+        G_batch = vgg_max_gram_batch(imgs_keras)
+
+        t_feature_end = datetime.now()
+        t_feature_elapsed = t_feature_end - t_feature_start
+
+        return G_batch, t_feature_elapsed
+
+    ## batched version of each feature function
+    vgg_max_gray_gram.batch  = vgg_max_gray_gram_batch
+    vgg_max_color_gram.batch = vgg_max_color_gram_batch
+
+    ## identifiers of feature functions for stored features (layers + weights)
+    _feature_id_max = "{0}|{1}".format(",".join(feature_layers_max), ",".join([repr(w) for w in weight_layers_max]))
+    vgg_max_gray_gram.feature_id  = "vgg_max_gray_gram|"  + _feature_id_max
+    vgg_max_color_gram.feature_id = "vgg_max_color_gram|" + _feature_id_max
+
     ############################################################
     ## define the cost function
     ############################################################
     def calc_cost_func(G_ref, G_dst):
-        G_ref_vec   = np.concatenate([G_l.flatten() for G_l in G_ref])
-        G_dst_vec   = np.concatenate([G_l.flatten() for G_l in G_dst])
-        G_diff = (G_ref_vec - G_dst_vec).reshape(-1)
+        ## packed upper triangles: the same value as the full matrices, without concatenation
+        return Gram.Cost(G_ref, G_dst)
 
-        return np.sum(G_diff ** 2)
+    ## evaluator against a fixed reference (see stNoh/FeatureCost.py): used by the search modules
+    calc_cost_func.evaluator = FeatureCost.CostEvaluator
@@ -0,0 +1,72 @@
+###############################################################################
+## precompute perceptual features of reference images
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import argparse
+import runpy
+
+import cv2
+
+from stNoh import RefFeature
+
+
+###############################################################################
+# main routine
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    parser = argparse.ArgumentParser(description="Stores Gram matrices of reference images as .npz files.")
+    parser.add_argument("folder", nargs="?", default="C:/FurImages/Experiment1-CGSamples/_References_960x540",
+                        help="folder of reference images")
+    parser.add_argument("--ext", default="jpg", help="file extension of reference images")
+    parser.add_argument("--features", default="vgg_max_gray_gram,vgg_max_color_gram",
+                        help="comma-separated feature functions defined in init_feature.py")
+    args = parser.parse_args()
+
+    ############################################################
+    ## load VGG19 & feature functions only once
+    ############################################################
+    init_feature_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_feature.py")
+    features = runpy.run_path(init_feature_path, run_name="__main__")
+    feature_funcs = [features[name] for name in args.features.split(",")]
+
+    ## pick reference image files from folder
+    fileList = next(os.walk(args.folder))[2]
+    fileList = [imgFile for imgFile in fileList if ".{0}".format(args.ext)==os.path.splitext(imgFile)[1]]
+
+    ############################################################
+    ## compute & store features of all references (batched)
+    ############################################################
+    for get_feature_func in feature_funcs:
+        get_feature_batch = getattr(get_feature_func, "batch", None)
+
+        ## references without stored features
+        jobs = []
+        for imgFile in fileList:
+            img_ref_path = "{0}/{1}".format(args.folder, imgFile)
+            img_ref_cv2  = cv2.imread(img_ref_path)
+            store_path   = RefFeature.StorePath(img_ref_path, img_ref_cv2, get_feature_func)
+            if not os.path.isfile(store_path):
+                jobs.append( (store_path, img_ref_cv2) )
+
+        if len(jobs) == 0:
+            continue
+
+        ## one batched pass per image size (fallback: one by one)
+        if get_feature_batch is not None:
+            shapes = sorted(set([img.shape for _, img in jobs]))
+            for shape in shapes:
+                jobs_shape = [job for job in jobs if job[1].shape == shape]
+                G_batch, t_feature = get_feature_batch([img for _, img in jobs_shape])
+                for (store_path, _), G_ref in zip(jobs_shape, G_batch):
+                    RefFeature.SaveGram(store_path, G_ref)
+                print("{0} references of {1} ({2})".format(len(jobs_shape), shape, t_feature))
+        else:
+            for store_path, img_ref_cv2 in jobs:
+                G_ref, t_feature = get_feature_func(img_ref_cv2)
+                RefFeature.SaveGram(store_path, G_ref)
+                print("{0} ({1})".format(store_path, t_feature))
@@ -0,0 +1,71 @@
+###############################################################################
+## headless render worker: serves renders of a prepared scene over local IPC
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import argparse
+
+from stNoh import RenderWorker
+
+
+###############################################################################
+## backend factory: per-worker scene load
+###############################################################################
+def MayaFurRenderer(scene_file, framebuffer=True, archive=True):
+    """
+    Opens the scene in this mayapy process and returns its Misc.FurRenderer.
+    It is the backend_factory of stNoh.RenderPool for Maya, e.g.
+        RenderPool.RenderPool(render_worker.MayaFurRenderer, (scene_file,), renderer=furRenderer)
+    (run under mayapy: worker processes are started with the same interpreter).
+    """
+    import maya.standalone
+    maya.standalone.initialize(name="python")
+    import maya.cmds as cmds
+    cmds.file(scene_file, open=True, force=True)
+
+    import Misc
+    backend = Misc.FurRenderer()
+    backend.SetFramebufferMode(framebuffer, archive=archive) ## lossless frames, images archived in background
+    return backend
+
+
+###############################################################################
+# main routine
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    parser = argparse.ArgumentParser(description="Render worker: mayapy render_worker.py --scene <scene.mb>")
+    parser.add_argument("--scene", default=None, help="prepared Maya scene (see init_scene.py)")
+    parser.add_argument("--host", default="localhost", help="host to listen on")
+    parser.add_argument("--port", type=int, default=0, help="port to listen on (0: free port)")
+    parser.add_argument("--authkey", default=RenderWorker.DEFAULT_AUTHKEY.decode(), help="authentication key")
+    parser.add_argument("--fake", action="store_true",
+                        help="offline renderer (stNoh/FakeFur.py) instead of Maya, e.g. for testing without Maya")
+    parser.add_argument("--no-archive", action="store_true", help="do not write per-iteration images/CSV files")
+    args = parser.parse_args()
+
+    ############################################################
+    ## render backend
+    ############################################################
+    if args.fake:
+        from stNoh import FakeFur
+        backend = FakeFur.FakeFurRenderer()
+        if args.no_archive:
+            backend.exportCSV = False
+    else:
+        backend = MayaFurRenderer(args.scene, archive=not args.no_archive)
+
+    ############################################################
+    ## serve until shutdown
+    ############################################################
+    server = RenderWorker.RenderServer(backend, (args.host, args.port), args.authkey.encode())
+    print("render worker listening on {0}:{1}".format(*server.address), flush=True)
+
+    server.Serve()
+
+    if not args.fake:
+        import maya.standalone
+        backend.Flush()
+        maya.standalone.uninitialize()
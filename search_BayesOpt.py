@@ -2,9 +2,8 @@
 ## Fur parameter search by Bayesian Optimization
 ## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
 ###############################################################################
-import maya.cmds as cmds
-
 import traceback
+import threading
 import shutil, os
 from datetime import datetime
 from collections import OrderedDict
@@ -12,9 +11,70 @@ from collections import OrderedDict
 import numpy as np
 import cv2
 from skopt import Optimizer ## Bayesian optimization
+from skopt.acquisition import gaussian_ei
 
+from stNoh import Checkpoint
+from stNoh import FeatureCost
 from stNoh import FurParam
-import Misc
+from stNoh import Progress
+from stNoh import RefFeature
+from stNoh import RenderPool
+from stNoh import Timing
+
+
+###############################################################################
+## subroutine: ask points for concurrent evaluation
+###############################################################################
+def AskPoints(opt, n_points, pending_x, strategy="cl_min"):
+    """
+    Asks n_points to be evaluated concurrently.
+    Points without results (pending_x and the points of this batch) are told
+    to a copy of the optimizer with lies, so that the next point differs.
+    opt      : skopt.Optimizer
+    pending_x: points under evaluation (list)
+    strategy : "cl_min", "cl_mean", "cl_max" (constant liar) or "kb" (Kriging believer)
+    """
+
+    ## serial: the same as opt.ask()
+    if len(pending_x) == 0 and n_points == 1:
+        return [opt.ask()]
+
+    ## random points until the GP model is fitted
+    if len(opt.models) == 0:
+        return [opt.ask() for n in range(n_points)]
+
+    opt_lie = opt.copy(random_state=opt.rng)
+    lie_x   = list(pending_x)
+    points  = []
+    for n in range(n_points):
+        if len(lie_x) > 0:
+            if "kb" == strategy:
+                lie_y = [float(y) for y in opt_lie.models[-1].predict(opt_lie.space.transform(lie_x))]
+            else:
+                lie_y = [float({"cl_min": np.min, "cl_mean": np.mean, "cl_max": np.max}[strategy](opt_lie.yi))] * len(lie_x)
+            opt_lie.tell(lie_x, lie_y)
+
+        points.append(opt_lie.ask())
+        lie_x = [points[-1]]
+
+    return points
+
+def RankedPoint(opt, exclude_x, n_candidates=1000, min_dist=0.1):
+    """
+    Returns the best point of the acquisition (EI) among random candidates
+    at least min_dist away from exclude_x (e.g. the 2nd-best after the top pick).
+    A random point is returned until the GP model is fitted.
+    """
+    if len(opt.models) == 0:
+        return opt.space.rvs(random_state=opt.rng)[0]
+
+    candidates = opt.space.rvs(n_samples=n_candidates, random_state=opt.rng)
+    acq = gaussian_ei(opt.space.transform(candidates), opt.models[-1], y_opt=np.min(opt.yi))
+
+    for ind in np.argsort(-acq):
+        if all([opt.space.distance(candidates[ind], x) >= min_dist for x in exclude_x]):
+            return candidates[ind]
+    return candidates[np.argmax(acq)]
 
 
 ###############################################################################
@@ -23,8 +83,13 @@ import Misc
 def BayesOpt(
         get_feature_func, calc_cost_func, render_and_load,
         convert_param_func, params01_vec_dst,
-        folder_path, image_ext, opt_params_dict={},
+        folder_path, image_ext, opt_params_dict={}, resume_from=None,
     ):
+    """
+    resume_from: checkpoint file (e.g. "<folder>/_checkpoint_bayesopt.pkl"), or
+                 sample folder whose "bayesopt/iter_*.csv" (+ images) are told
+                 without rendering again. Evaluations done count toward max_iter.
+    """
 
     ############################################################
     ## prepara optimization routine
@@ -32,35 +97,136 @@ def BayesOpt(
 
     ## set constants for optimization in advance
     max_iter = 80  if opt_params_dict.get('max_iter') is None else opt_params_dict['max_iter'] ## 50: ~5-min / 100: ~10-min
+    archive  = opt_params_dict.get('archive') ## ArchiveWriter of all files, closed by the caller (None: renderer writes files)
+    progress = Progress.Default() if opt_params_dict.get('progress') is None else opt_params_dict['progress'] ## see stNoh/Progress.py
+    timer    = Timing.Timer()     if opt_params_dict.get('timer')    is None else opt_params_dict['timer']    ## see stNoh/Timing.py
+
+    ## early abort: cost evaluation stops once the partial cost exceeds early_abort x best cost;
+    ##              the GP is told that lower bound (capped cost) of clearly worse candidates (None: exact costs)
+    early_abort = FeatureCost.AbortFactor(opt_params_dict.get('early_abort')) ## ValueError below 1
+
+    ## batch mode: up to 'batch_size' renders run concurrently on 'render_pool',
+    ##             and each result is told as soon as it arrives (asynchronous)
+    batch_size  = 1        if opt_params_dict.get('batch_size') is None else opt_params_dict['batch_size']
+    strategy    = 'cl_min' if opt_params_dict.get('strategy')   is None else opt_params_dict['strategy'] ## see AskPoints()
+    render_pool = opt_params_dict.get('render_pool') ## RenderPool(..., renderer=) of the renderer of render_and_load (None: render_and_load in this process)
+
+    ## pipelined mode: the GP refits in background while a speculative candidate
+    ##                 (2nd-best of the previous acquisition) is rendered
+    pipeline = False if opt_params_dict.get('pipeline') is None else opt_params_dict['pipeline']
 
     ## prepare reference image
     path_img_ref = folder_path + "/_ref_image.{0}".format(image_ext)
-    img_ref_cv2  = cv2.imread(path_img_ref)
-    G_ref, _     = get_feature_func(img_ref_cv2)
+    G_ref, img_ref_cv2 = RefFeature.LoadReferenceGram(path_img_ref, get_feature_func) ## stored next to reference
+    cost_ref = FeatureCost.ForReference(calc_cost_func, G_ref)
     
-    Misc.show_text_on_image_cv2(img_ref_cv2, "", "reference")
+    progress.Show("reference", img_ref_cv2)
+
+    ## initialize elapsed time (busy time of each component)
+    global t_render_elapsed
+    global t_feature_elapsed
+    global t_fit_elapsed
+    t_render_elapsed  = datetime.min - datetime.min
+    t_feature_elapsed = datetime.min - datetime.min
+    t_fit_elapsed     = datetime.min - datetime.min
+
+    ## initial cost = Infinity (Unknown)
+    global Cost_best, params_01_vec_best
+    Cost_best  = np.inf
+    params_01_vec_best = params01_vec_dst[:]
 
     ## wrapping evaluation function
-    def eval_cost(x, num_iter):
+    def eval_path(num_iter):
+        return '{0}/bayesopt/iter_{1:04d}'.format(folder_path, num_iter)
+
+    ## filepath given to the renderer (None: files are written by the archive only)
+    def render_path(num_iter):
+        return eval_path(num_iter) if archive is None else None
+
+    def eval_params(x):
         x = np.clip(np.array(x), 0.0, 1.0)
+        return convert_param_func(x)
+
+    def eval_cost(x, params_dict, result, num_done, G_dst=None):
+        global Cost_best, params_01_vec_best
+        global t_render_elapsed, t_feature_elapsed
 
-        params_dict = convert_param_func(x)
+        num_iter, img_dst_cv2, t_render, t_imageio = result
+        t_render_elapsed += t_render + t_imageio
 
-        path_dst          = '{0}/bayesopt/iter_{1:04d}'.format(folder_path, num_iter)
-        img_dst_cv2, _, _ = render_and_load(params_dict, path_dst)
-        G_dst, _          = get_feature_func(img_dst_cv2)
+        path_dst = eval_path(num_iter)
+        if G_dst is None:
+            with timer.Span("feature"):
+                G_dst, t_feature = get_feature_func(img_dst_cv2)
+            t_feature_elapsed += t_feature
 
-        Cost = calc_cost_func(G_ref, G_dst)
+        with timer.Span("cost"):
+            Cost = cost_ref.Cost(G_dst, FeatureCost.AbortBound(early_abort, Cost_best))
+
+        if archive is not None:
+            archive.Submit(img_dst_cv2, params_dict, path_dst, Cost)
 
         img_text = "Cost: {0}\n#iter {1}".format(Cost, num_iter)
-        Misc.show_text_on_image_cv2(img_dst_cv2, img_text, "find_step")
+        progress.Show("find_step", img_dst_cv2, img_text)
+
+        ## change the best result
+        if  Cost < Cost_best:
+            Cost_best = Cost
+            params_01_vec_best = x[:]
 
-        ## show the progress bar here
-        cmds.progressWindow(edit=True, progress=num_iter)
-        if cmds.progressWindow(query=1, isCancelled=1):
+            ## show the tentative solution (kept in memory: no re-read from disk)
+            progress.Show("target", img_dst_cv2, img_text)
+
+        ## show the progress here
+        progress.Step(num_done + 1, Cost, img_text)
+        if progress.IsCancelled():
             raise StopIteration
 
         return Cost
+
+    ## features of several results: one batched call if available
+    get_feature_batch = getattr(get_feature_func, "batch", None)
+    def eval_features(results):
+        global t_feature_elapsed
+        if get_feature_batch is None or len(results) < 2:
+            return [None] * len(results) ## by eval_cost()
+
+        with timer.Span("feature"):
+            G_batch, t_feature = get_feature_batch([img_cv2 for _, img_cv2, _, _ in results])
+        t_feature_elapsed += t_feature
+        return G_batch
+
+    ## state after every evaluation (X/y include points not told yet)
+    checkpoint_path = folder_path + "/_checkpoint_bayesopt.pkl"
+    def save_checkpoint(num_done, X_new=[], Y_new=[]):
+        Checkpoint.Save(checkpoint_path, {
+            "X"                 : list(opt.Xi) + list(X_new),
+            "y"                 : list(opt.yi) + list(Y_new),
+            "num_done"          : num_done,
+            "Cost_best"         : Cost_best,
+            "params_01_vec_best": params_01_vec_best,
+            "random_state"      : Checkpoint.GetRandomState(opt.rng),
+        })
+        return None
+
+    ## GP fitting (+ acquisition) of new observations
+    ## errors  : exceptions raised in a fit thread (re-raised after join)
+    ## num_iter: iteration of the spans of a fit thread (the main thread moves on)
+    def tell(X, Y, errors=None, num_iter=None):
+        global t_fit_elapsed
+        if num_iter is not None:
+            timer.SetIteration(num_iter, this_thread=True)
+        t_fit_start = datetime.now()
+        try:
+            with timer.Span("optimizer"):
+                if len(X) > 0:
+                    opt.tell(X, Y)
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.append(e)
+        t_fit_elapsed += datetime.now() - t_fit_start
+        return None
     
     
     ############################################################
@@ -68,14 +234,12 @@ def BayesOpt(
     ############################################################
     success = True
 
-    ## initial cost = Infinity (Unknown)
-    Cost_best  = np.inf
-    params_01_vec_best = params01_vec_dst[:]
-
     ## start the progress bar here
     maxValue = max_iter+1
-    cmds.progressWindow(isInterruptable=1, minValue=0, maxValue=maxValue)
+    progress.Begin(maxValue, "BayesOpt")
 
+    timer_prev = Timing.Activate(timer) ## spans of renderer & feature functions
+    t_total_start = datetime.now()
     try:
         bound = [(0.0, 1.0)] * len(params01_vec_dst)
 
@@ -83,32 +247,161 @@ def BayesOpt(
                acq_func_kwargs={'kappa':1.96} ## exploit based on 95% estimation
                )
 
-        ## run until criterion is matched (or reaches max iteration)
-        for num_iter in range(max_iter):
-            next_x = opt.ask()
-            Cost_this = eval_cost(next_x, num_iter)
-            opt.tell(next_x, Cost_this)
-
-            ## change the best result
-            if  Cost_this < Cost_best:
-                Cost_best = Cost_this
-                params_01_vec_best = next_x[:]
-
-                ## show the tentative solution
-                path_dst = '{0}/bayesopt/iter_{1:04d}_tmp.{2}'.format(folder_path, num_iter, image_ext)
-                img_dst_cv2 = cv2.imread(path_dst)
-                img_text = "Cost: {0}\n#iter {1}".format(Cost_this, num_iter)
-                Misc.show_text_on_image_cv2(img_dst_cv2, img_text, "target")
+        if render_pool is None:
+            render_pool = RenderPool.SerialPool(render_and_load)
+
+        ########################################
+        ## resume from checkpoint, or from evaluated points of a sample folder
+        ########################################
+        num_start = 0
+        if resume_from is not None and os.path.isdir(resume_from):
+            keys = Checkpoint.ParamKeys(convert_param_func, len(params01_vec_dst))
+            X_seed, Y_seed = [], []
+            for x, img_path, num_iter in Checkpoint.EvaluatedPoints(resume_from + "/bayesopt", keys):
+                G_dst, _ = get_feature_func(cv2.imread(img_path))
+                X_seed.append(x)
+                Y_seed.append(cost_ref.Cost(G_dst))
+                num_start = max(num_start, num_iter + 1)
+
+                if  Y_seed[-1] < Cost_best:
+                    Cost_best = Y_seed[-1]
+                    params_01_vec_best = x[:]
+            tell(X_seed, Y_seed)
+
+        elif resume_from is not None:
+            state = Checkpoint.Load(resume_from)
+            tell(state["X"], state["y"])
+            num_start          = state["num_done"]
+            Cost_best          = state["Cost_best"]
+            params_01_vec_best = state["params_01_vec_best"]
+            Checkpoint.SetRandomState(state["random_state"], opt.rng)
+
+        if pipeline:
+            ########################################
+            ## pipelined: [fit on new observations || render speculative point], then render top pick
+            ########################################
+            X_new, Y_new = [], []
+            num_done = num_start
+            while num_done < max_iter:
+
+                ## speculative point: 2nd-best of the model which picked the last top point
+                timer.SetIteration(num_done)
+                with timer.Span("optimizer"):
+                    x_spec = RankedPoint(opt, X_new)
+                params_spec = eval_params(x_spec)
+                render_pool.Submit(num_done, params_spec, render_path(num_done))
+
+                fit_errors = []
+                fit_thread = threading.Thread(target=tell, args=(X_new, Y_new, fit_errors, num_done))
+                fit_thread.start()
+                try:
+                    result = render_pool.NextResult()
+                finally:
+                    fit_thread.join()
+
+                ## the GP was not told: stop instead of asking a stale model
+                if len(fit_errors) > 0:
+                    raise fit_errors[0]
+
+                ## speculative result is kept in observations (told with the next fit)
+                X_new = [x_spec]
+                Y_new = [eval_cost(x_spec, params_spec, result, num_done)]
+                num_done += 1
+                save_checkpoint(num_done, X_new, Y_new)
+                if num_done >= max_iter:
+                    break
+
+                ## top pick of the refitted model (away from the speculative point)
+                timer.SetIteration(num_done)
+                t_fit_start = datetime.now()
+                with timer.Span("optimizer"):
+                    x_top = opt.ask()
+                    if opt.space.distance(x_top, x_spec) < 1e-8:
+                        x_top = RankedPoint(opt, [x_spec])
+                t_fit_elapsed += datetime.now() - t_fit_start
+
+                params_top = eval_params(x_top)
+                render_pool.Submit(num_done, params_top, render_path(num_done))
+                result = render_pool.NextResult()
+
+                X_new.append(x_top)
+                Y_new.append(eval_cost(x_top, params_top, result, num_done))
+                num_done += 1
+                save_checkpoint(num_done, X_new, Y_new)
+
+        else:
+            ########################################
+            ## serial / batch (asynchronous)
+            ########################################
+
+            ## iteration -> (point, parameters) under evaluation
+            pending   = OrderedDict()
+            num_asked = num_start
+
+            ## run until criterion is matched (or reaches max iteration)
+            num_done = num_start
+            while num_done < max_iter:
+                timer.SetIteration(num_done)
+
+                ## fill free slots of the pool (serial: one point at a time)
+                num_ask = min(batch_size - len(pending), max_iter - num_asked)
+                if num_ask > 0:
+                    t_fit_start = datetime.now()
+                    with timer.Span("optimizer"):
+                        next_xs = AskPoints(opt, num_ask, [x for x, _ in pending.values()], strategy)
+                    t_fit_elapsed += datetime.now() - t_fit_start
+
+                    for next_x in next_xs:
+                        params_dict = eval_params(next_x)
+                        render_pool.Submit(num_asked, params_dict, render_path(num_asked))
+                        pending[num_asked] = (next_x, params_dict)
+                        num_asked += 1
+
+                ## tell the finished ones (features in one batched call)
+                results = render_pool.NextResults()
+                for result, G_dst in zip(results, eval_features(results)):
+                    timer.SetIteration(num_done)
+                    next_x, params_dict = pending.pop(result[0])
+                    Cost_this = eval_cost(next_x, params_dict, result, num_done, G_dst)
+                    tell(next_x, Cost_this)
+                    num_done += 1
+                    save_checkpoint(num_done)
         
+    except StopIteration:
+        success = False ## cancelled
+        pass
+
     except Exception as e:
         traceback.print_exc()
         success = False
         pass
+
+    finally:
+        Timing.Activate(timer_prev) ## also on errors not caught above (e.g. KeyboardInterrupt)
+
+    if render_pool is not None:
+        render_pool.Cancel() ## renders of aborted iterations
+
+    ## export busy/idle time of each component
+    t_total_elapsed = datetime.now() - t_total_start
+    num_workers = 1 if render_pool is None else render_pool.num_workers
+    with open(folder_path + "/elapsed_bayesopt.txt", "w+") as txt:
+        txt.write("elapsed time    = {0}\n".format(t_total_elapsed) )
+        txt.write("rendering time  = {0} (idle {1}, {2} worker(s))\n".format(t_render_elapsed, t_total_elapsed * num_workers - t_render_elapsed, num_workers) )
+        txt.write("GP fitting time = {0} (idle {1})\n".format(t_fit_elapsed, t_total_elapsed - t_fit_elapsed) )
+        txt.write("feature extraction time = {0}\n".format(t_feature_elapsed) )
+
+    ## per-iteration spans & percentiles
+    timer.ExportJSONL(folder_path + "/timing_bayesopt.jsonl")
+    timer.WriteSummary(folder_path + "/timing_bayesopt.txt")
     
     ## best parameter until the last iteration ...
     best_params_dict = convert_param_func(params_01_vec_best)
 
-    cmds.progressWindow(endProgress=1)
+    if archive is not None:
+        archive.Flush()
+
+    progress.End()
     return success, best_params_dict
 
 
@@ -116,6 +409,7 @@ def BayesOpt(
 ## example of usage
 ###############################################################################
 if "__main__" == __name__:
+    import Misc ## FurRenderer (Maya)
 
     ############################################################
     ## user specified parameters
@@ -163,6 +457,7 @@ if "__main__" == __name__:
             )
             os.makedirs(folder_root) # root folder to preserve optimization progress
             shutil.copy2(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt))
+            RefFeature.CopyStore(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt)) ## precomputed features
 
             furRenderer.Init(folder_root)
 
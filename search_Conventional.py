@@ -2,8 +2,6 @@
 ## Fur parameter search by Feature Space Gradient Descent
 ## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
 ###############################################################################
-import maya.cmds as cmds
-
 import traceback
 import shutil, os
 from datetime import datetime
@@ -13,15 +11,25 @@ import numpy as np
 import cv2
 from scipy import optimize
 
+from stNoh import Checkpoint
+from stNoh import FeatureCost
 from stNoh import FurParam
-import Misc
+from stNoh import Progress
+from stNoh import RefFeature
+from stNoh import Timing
 
 
 def LocalSearch(
         get_feature_func, calc_cost_func, render_and_load,
         convert_param_func, params01_vec_dst,
-        folder_path, image_ext, opt_params_dict={},
+        folder_path, image_ext, opt_params_dict={}, resume_from=None,
     ):
+    """
+    resume_from: checkpoint file of an interrupted run
+                 (e.g. "<folder>/_checkpoint_localsearch.pkl"):
+                 the search restarts from the best point, and points
+                 evaluated before are not rendered again.
+    """
 
     ############################################################
     ## prepare optimization routine
@@ -30,13 +38,20 @@ def LocalSearch(
     ## set constants for optimization in advance
     max_iter = 600  if opt_params_dict.get('max_iter') is None else opt_params_dict['max_iter']
     delta    = 0.10 if opt_params_dict.get('delta')    is None else opt_params_dict['delta']
+    archive  = opt_params_dict.get('archive') ## ArchiveWriter of all files, closed by the caller (None: renderer writes files)
+    progress = Progress.Default() if opt_params_dict.get('progress') is None else opt_params_dict['progress'] ## see stNoh/Progress.py
+    timer    = Timing.Timer()     if opt_params_dict.get('timer')    is None else opt_params_dict['timer']    ## see stNoh/Timing.py
+
+    ## early abort: cost evaluation stops once the partial cost exceeds early_abort x best cost
+    ##              (None: exact costs; finite differences near clearly worse points see the lower bound)
+    early_abort = FeatureCost.AbortFactor(opt_params_dict.get('early_abort')) ## ValueError below 1
 
     ## prepare reference image & get perceptual feature
     path_img_ref = folder_path + "/_ref_image.{0}".format(image_ext)
-    img_ref_cv2  = cv2.imread(path_img_ref)
-    G_ref, _     = get_feature_func(img_ref_cv2)
+    G_ref, img_ref_cv2 = RefFeature.LoadReferenceGram(path_img_ref, get_feature_func) ## stored next to reference
+    cost_ref = FeatureCost.ForReference(calc_cost_func, G_ref)
 
-    Misc.show_text_on_image_cv2(img_ref_cv2, "", "reference")
+    progress.Show("reference", img_ref_cv2)
 
 
     ############################################################
@@ -54,31 +69,74 @@ def LocalSearch(
     global params_01_vec_best
     params_01_vec_best = params01_vec_dst[:]
 
+    ## evaluated points: normalized vector (tuple) -> cost
+    global evaluated
+    evaluated = {}
+
+    ## resume: continue from the best point of an interrupted run
+    state = Checkpoint.Load(resume_from)
+    if state is not None:
+        num_iter           = state["num_iter"]
+        Cost_best          = state["Cost_best"]
+        params_01_vec_best = state["params_01_vec_best"]
+        evaluated          = state["evaluated"]
+        params01_vec_dst   = params_01_vec_best[:]
+        Checkpoint.SetRandomState(state["random_state"])
+
+    checkpoint_path = folder_path + "/_checkpoint_localsearch.pkl"
+
     ## wrapping evaluation function
     def eval_cost(params01_vec_dst):
         global Cost_best, params_01_vec_best
         global num_iter, success
+        global evaluated
+
+        ## evaluated before (e.g. resumed run)
+        key = tuple([float(val01) for val01 in params01_vec_dst])
+        if key in evaluated:
+            return evaluated[key]
+
+        ## SLSQP may catch StopIteration of its gradient step: stop here again
+        if progress.IsCancelled():
+            raise StopIteration
+
         num_iter += 1
+        timer.SetIteration(num_iter)
 
         params_dict = convert_param_func(params01_vec_dst)
 
         path_dst          = '{0}/iter_{1:04d}'.format(folder_path, num_iter)
-        img_dst_cv2, _, _ = render_and_load(params_dict, path_dst)
-        G_dst, _          = get_feature_func(img_dst_cv2)
-        Cost_this         = calc_cost_func(G_ref, G_dst)
+        img_dst_cv2, _, _ = render_and_load(params_dict, path_dst if archive is None else None) ## archive writes the files
+        with timer.Span("feature"):
+            G_dst, _      = get_feature_func(img_dst_cv2)
+        with timer.Span("cost"):
+            Cost_this     = cost_ref.Cost(G_dst, FeatureCost.AbortBound(early_abort, Cost_best))
+
+        if archive is not None:
+            archive.Submit(img_dst_cv2, params_dict, path_dst, Cost_this)
 
         img_text = "Cost: {0}\n#iter {1}".format(Cost_this, num_iter)
-        Misc.show_text_on_image_cv2(img_dst_cv2, img_text, "find_step")
+        progress.Show("find_step", img_dst_cv2, img_text)
 
         ## change the best result
         if  Cost_this < Cost_best:
             Cost_best = Cost_this
             params_01_vec_best = params01_vec_dst[:]
+
+        ## checkpoint after every evaluation
+        evaluated[key] = Cost_this
+        Checkpoint.Save(checkpoint_path, {
+            "num_iter"          : num_iter,
+            "Cost_best"         : Cost_best,
+            "params_01_vec_best": params_01_vec_best,
+            "evaluated"         : evaluated,
+            "random_state"      : Checkpoint.GetRandomState(),
+        })
     
-        ## show the progress bar here
+        ## show the progress here
         prog = num_iter + 1
-        cmds.progressWindow(edit=True, progress=prog)
-        if cmds.progressWindow(query=1, isCancelled=1):
+        progress.Step(prog, Cost_this, img_text)
+        if progress.IsCancelled():
             success = False ## [ABORT]
             raise StopIteration
 
@@ -90,30 +148,47 @@ def LocalSearch(
 
     ## start the progress bar here
     maxValue = max_iter+1
-    cmds.progressWindow(isInterruptable=1, minValue=0, maxValue=maxValue)
+    progress.Begin(maxValue, "LocalSearch")
 
+    timer_prev = Timing.Activate(timer) ## spans of renderer & feature functions
     try:
         bounds = [(0.0, 1.0)] * len(params01_vec_dst)
 
         ## minimize with "bounds": SLSQP, trust-constr, L-BFGS-B, TNC
-        opt = optimize.minimize( eval_cost, params01_vec_dst, 
-                method='SLSQP',
-                bounds=bounds,
-                options={'eps':delta, 'maxiter':max_iter}
-                )
+        ## (self time of "optimizer" span: SLSQP without evaluations)
+        with timer.Span("optimizer"):
+            opt = optimize.minimize( eval_cost, params01_vec_dst, 
+                    method='SLSQP',
+                    bounds=bounds,
+                    options={'eps':delta, 'maxiter':max_iter}
+                    )
 
         best_params_dict = convert_param_func(opt.x)
         success = True
     
+    except StopIteration:
+        success = False ## [ABORT] cancelled
+        pass
+
     except Exception as e:
         traceback.print_exc()
         success = False
         pass
 
+    finally:
+        Timing.Activate(timer_prev) ## also on errors not caught above (e.g. KeyboardInterrupt)
+
     ## best parameter until the last iteration ...
     best_params_dict = convert_param_func(params_01_vec_best)
+
+    if archive is not None:
+        archive.Flush()
+
+    ## per-iteration spans & percentiles
+    timer.ExportJSONL(folder_path + "/timing_localsearch.jsonl")
+    timer.WriteSummary(folder_path + "/timing_localsearch.txt")
     
-    cmds.progressWindow(endProgress=1)
+    progress.End()
     return success, best_params_dict
 
 
@@ -121,6 +196,7 @@ def LocalSearch(
 ## example of usage
 ###############################################################################
 if "__main__" == __name__:
+    import Misc ## FurRenderer (Maya)
 
     ############################################################
     ## user specified parameters
@@ -168,6 +244,7 @@ if "__main__" == __name__:
             )
             os.makedirs(folder_root) # root folder to preserve optimization progress
             shutil.copy2(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt))
+            RefFeature.CopyStore(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt)) ## precomputed features
 
             furRenderer.Init(folder_root)
 
@@ -2,8 +2,6 @@
 ## Fur parameter search by Feature Space Gradient Descent
 ## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
 ###############################################################################
-import maya.cmds as cmds
-
 import traceback
 import shutil, os
 from datetime import datetime
@@ -13,8 +11,14 @@ import numpy as np
 import cv2
 from scipy import optimize ## minimize_scalar (line search)
 
+from stNoh import Checkpoint
+from stNoh import FeatureCost
 from stNoh import FurParam
-import Misc
+from stNoh import Gram
+from stNoh import Progress
+from stNoh import RefFeature
+from stNoh import RenderCache
+from stNoh import Timing
 
 
 ###############################################################################
@@ -23,25 +27,69 @@ import Misc
 def GradientDescent(
         get_feature_func, calc_cost_func, render_and_load,
         convert_param_func, params01_vec_dst,
-        folder_path, image_ext, opt_params_dict={},
+        folder_path, image_ext, opt_params_dict={}, resume_from=None,
     ):
+    """
+    resume_from: checkpoint file of an interrupted run
+                 (e.g. "<folder>/_checkpoint_featuregrad.pkl")
+    """
 
     ############################################################
     ## prepara optimization routine
     ############################################################
 
     ## set constants for optimization in advance
-    max_iter   = 20    if opt_params_dict.get('max_iter') is None else opt_params_dict['max_iter']
-    max_step   = 15    if opt_params_dict.get('max_step') is None else opt_params_dict['max_step']
-    delta      = 0.075 if opt_params_dict.get('delta')    is None else opt_params_dict['delta']
+    max_iter    = 20    if opt_params_dict.get('max_iter') is None else opt_params_dict['max_iter']
+    max_step    = 15    if opt_params_dict.get('max_step') is None else opt_params_dict['max_step']
+    delta       = 0.075 if opt_params_dict.get('delta')    is None else opt_params_dict['delta']
+    archive     = opt_params_dict.get('archive')     ## ArchiveWriter of all files, closed by the caller (None: renderer writes files)
+    render_pool = opt_params_dict.get('render_pool') ## RenderPool(..., renderer=) for Jacobian (None: serial rendering)
+    progress    = Progress.Default() if opt_params_dict.get('progress') is None else opt_params_dict['progress'] ## see stNoh/Progress.py
+    timer       = Timing.Timer()     if opt_params_dict.get('timer')    is None else opt_params_dict['timer']    ## see stNoh/Timing.py
+
+    ## Jacobian update: 'fd' = finite differences at every iteration,
+    ##                  'broyden' = rank-one updates from line search, refreshed by finite differences
+    jacobian      = 'fd' if opt_params_dict.get('jacobian')      is None else opt_params_dict['jacobian']
+    refresh_every = 5    if opt_params_dict.get('refresh_every') is None else opt_params_dict['refresh_every']
+
+    ## FeatureCompressor for A, b & cost (None: full Gram vectors)
+    feature_compress = opt_params_dict.get('feature_compress')
+
+    ## early abort of line search steps: cost evaluation stops once the partial cost
+    ## exceeds early_abort x best cost (None: exact costs; full Gram vectors only)
+    early_abort = FeatureCost.AbortFactor(opt_params_dict.get('early_abort')) ## ValueError below 1
+
+    ## feature vector & its cost: full or compressed
+    def feature_vec(G):
+        if feature_compress is None:
+            return Gram.Vector(G) ## packed upper triangles: no concatenation
+        feature_compress.Observe(G) ## PCA: collect renders until the basis is fitted
+        return feature_compress.Compress(G)
+
+    def feature_cost(G, G_vec, bound=None):
+        if feature_compress is None:
+            return cost_ref.Cost(G, bound)
+        return feature_compress.Cost(G_ref_vec, G_vec)
+
+    ## features of the Jacobian probes: one batched call per Jacobian if available
+    get_feature_batch = getattr(get_feature_func, "batch", None)
+    def feature_batch(imgs_cv2):
+        if get_feature_batch is not None:
+            return get_feature_batch(imgs_cv2)
+        G_batch, t_feature = [], datetime.min - datetime.min
+        for img_cv2 in imgs_cv2:
+            G, t = get_feature_func(img_cv2)
+            G_batch.append(G)
+            t_feature += t
+        return G_batch, t_feature
 
     ## prepare reference image & get perceptual feature
     path_img_ref = folder_path + "/_ref_image.{0}".format(image_ext)
-    img_ref_cv2  = cv2.imread(path_img_ref)
-    G_ref, _     = get_feature_func(img_ref_cv2)
-    G_ref_vec    = np.concatenate([G_ref_l.flatten() for G_ref_l in G_ref])
+    G_ref, img_ref_cv2 = RefFeature.LoadReferenceGram(path_img_ref, get_feature_func) ## stored next to reference
+    G_ref_vec = Gram.Vector(G_ref)
+    cost_ref  = FeatureCost.ForReference(calc_cost_func, G_ref)
 
-    Misc.show_text_on_image_cv2(img_ref_cv2, "", "reference")
+    progress.Show("reference", img_ref_cv2)
     
     ## initialize elapsed time
     global t_render_elapsed
@@ -51,6 +99,12 @@ def GradientDescent(
     t_imageio_elapsed = datetime.min - datetime.min
     t_feature_elapsed = datetime.min - datetime.min
 
+    ## initialize render count
+    global num_renders
+    global num_renders_iter
+    num_renders      = 0
+    num_renders_iter = []
+
     ############################################################
     ## run optimization loop
     ############################################################
@@ -65,182 +119,370 @@ def GradientDescent(
     Res_prev   = np.inf
     num_params = len(params01_vec_dst)
 
+    ## Jacobian state
+    A = None
+    refresh      = True
+    iter_refresh = 0
+
+    ## resume: state at the beginning of an iteration
+    num_start = 0
+    state = Checkpoint.Load(resume_from)
+    if state is not None:
+        num_start          = state["num_iter"]
+        params01_vec_dst   = state["params01_vec_dst"]
+        params_01_vec_best = state["params_01_vec_best"]
+        Cost_best          = state["Cost_best"]
+        Res_prev           = state["Res_prev"]
+        A                  = state["A"]
+        refresh            = state["refresh"]
+        iter_refresh       = state["iter_refresh"]
+        Checkpoint.SetRandomState(state["random_state"])
+
+    checkpoint_path = folder_path + "/_checkpoint_featuregrad.pkl"
+
     ## start the progress bar here
     maxValue = (max_iter+1) * (num_params + max_step)
-    cmds.progressWindow(isInterruptable=1, minValue=0, maxValue=maxValue)
-
-    for num_iter in range(max_iter):
-        params_dict = convert_param_func(params01_vec_dst)
-
-        ############################################################
-        ## 0) current parameter image & get perceptual feature
-        ############################################################
-        path_dst = '{0}/iter_{1:04d}'.format(folder_path, num_iter)
-        img_dst_cv2, t_render, t_imageio = render_and_load(params_dict, path_dst)
-        G_dst, t_feature = get_feature_func(img_dst_cv2)
-        G_dst_vec = np.concatenate([G_l.flatten() for G_l in G_dst])
-
-        Cost_prev = calc_cost_func(G_ref, G_dst)
-
-        ## get elapsed time
-        t_render_elapsed  += t_render
-        t_imageio_elapsed += t_imageio
-        t_feature_elapsed += t_feature
-
-        ## show information on the image
-        img_text = "Cost: {0}\n#iter {1}".format(Cost_prev, num_iter)
-        Misc.show_text_on_image_cv2(img_dst_cv2, img_text, "target")
-
-        ## change the best result
-        if  Cost_prev < Cost_best:
-            Cost_best = Cost_prev
-            params_01_vec_best = params01_vec_dst[:]
-
-        ############################################################
-        ## 1) construct matrix A = (N x 15) from numerical gradients
-        ############################################################
-        A = np.zeros(( len(G_ref_vec) , num_params))
-
-        for ind_param in range(num_params):
-
-            ## select sign for delta increment
-            params01_vec_d = []
-            params01_vec_d[:] = params01_vec_dst
-            increment = +delta if params01_vec_dst[ind_param] < 0.5 else -delta
-
-            ## increment/decrement small delta
-            params01_vec_d[ind_param] += increment
-            params_d_dict = convert_param_func(params01_vec_d)
-
-            ########################################
-            ## move to a single direction & render
-            ########################################
-            path_dst_d = '{0}/grad/iter_{1:04d}_{2:02d}'.format(folder_path, num_iter, ind_param)
-            img_dst_d_cv2, t_render, t_imageio = render_and_load(params_d_dict, path_dst_d)
-            G_dst_d, t_feature = get_feature_func(img_dst_d_cv2)
-            G_dst_d_vec = np.concatenate([G_l.flatten() for G_l in G_dst_d])
-
-            Cost_this = calc_cost_func(G_ref, G_dst_d)
-
-            ## get elapsed time
-            t_render_elapsed  += t_render
-            t_imageio_elapsed += t_imageio
-            t_feature_elapsed += t_feature
-
-            ## show information on the image
-            img_text = "Cost: {0}\nParameter #{1:02d}".format(Cost_this, ind_param+1)
-            Misc.show_text_on_image_cv2(img_dst_d_cv2, img_text, "find_step")
-
-            ## accumulate to matrix A
-            Gram_mat_diff = (G_dst_d_vec - G_dst_vec).reshape(-1)
-            A[:, ind_param] = Gram_mat_diff / increment ## original
-            ind_param += 1
-
-            ## show the progress bar (1)
-            prog = num_iter * (num_params + max_step) + ind_param
-            cmds.progressWindow(edit=True, progress=prog)
-            if cmds.progressWindow(query=1, isCancelled=1):
-                success = False
-                raise StopIteration
-
-        if success==False: break ## [CHECK ABORT]
-
-        ############################################################
-        ## 2) get the gradient descent direction by linear algebra
-        ############################################################
-        At = np.transpose(A) # At = (15 x N)
-        b = ( G_ref_vec - G_dst_vec ).reshape(-1)  # (N x 1), DESCENT direction (feature space)
-        Atb = np.dot(At, b) # (15 x N ) x (N x 1) = (15 x 1), DESCENT direction (parameter space)
+    progress.Begin(maxValue, "FeatureGrad")
+
+    ## approximation error of compressed cost (closed on any exit of the loop)
+    compress_log = None
+    if feature_compress is not None:
+        compress_log = open(folder_path + "/compress.txt", "w+")
+        compress_log.write("iter,method,version,dim,full_cost,compressed_cost,relative_error\n")
+
+    ## version of the compressed space in which A and Res_prev are given
+    ## (e.g. the random projection is set up by the first compression)
+    compress_version = None
+    if feature_compress is not None:
+        G_ref_vec = feature_compress.Compress(G_ref)
+        compress_version = feature_compress.version
+
+    timer_prev = Timing.Activate(timer) ## spans of renderer & feature functions
+    try:
+        num_iter = num_start
+        retry    = False ## Broyden update rejected: the same iteration again with fresh A
+        while num_iter < max_iter:
+            timer.SetIteration(num_iter)
+            params_dict = convert_param_func(params01_vec_dst)
+
+            ## compressed space may have changed (e.g. PCA basis fitted): rebuild A,
+            ## and the residual of the previous space is not comparable
+            if feature_compress is not None:
+                G_ref_vec = feature_compress.Compress(G_ref)
+                if feature_compress.version != compress_version or (A is not None and A.shape[0] != len(G_ref_vec)):
+                    compress_version = feature_compress.version
+                    A        = None
+                    Res_prev = np.inf
+
+            ############################################################
+            ## 0) current parameter image & get perceptual feature
+            ##    (retry: the image & feature of the same point are kept)
+            ############################################################
+            if retry:
+                retry = False
+                if feature_compress is not None:
+                    G_dst_vec = feature_compress.Compress(G_dst)
+                    Cost_prev = feature_compress.Cost(G_ref_vec, G_dst_vec)
+            else:
+                num_renders_start = num_renders
+                path_dst = '{0}/iter_{1:04d}'.format(folder_path, num_iter)
+                img_dst_cv2, t_render, t_imageio = render_and_load(params_dict, path_dst if archive is None else None) ## archive writes the files
+                num_renders += 1
+                with timer.Span("feature"):
+                    G_dst, t_feature = get_feature_func(img_dst_cv2)
+                    G_dst_vec = feature_vec(G_dst)
+
+                with timer.Span("cost"):
+                    Cost_prev = cost_ref.Cost(G_dst) ## full cost
+
+                ## compare with compressed cost (used by the line search)
+                if feature_compress is not None:
+                    Cost_full = Cost_prev
+                    Cost_prev = feature_compress.Cost(G_ref_vec, G_dst_vec)
+                    compress_log.write("{0},{1},{2},{3},{4},{5},{6}\n".format(
+                        num_iter, feature_compress.method, compress_version, len(G_ref_vec),
+                        Cost_full, Cost_prev, abs(Cost_prev - Cost_full) / max(Cost_full, 1e-30)))
+
+                if archive is not None:
+                    archive.Submit(img_dst_cv2, params_dict, path_dst, Cost_prev)
+
+                ## get elapsed time
+                t_render_elapsed  += t_render
+                t_imageio_elapsed += t_imageio
+                t_feature_elapsed += t_feature
+
+                ## show information on the image
+                img_text = "Cost: {0}\n#iter {1}".format(Cost_prev, num_iter)
+                progress.Show("target", img_dst_cv2, img_text)
+
+                ## change the best result (by full cost)
+                Cost_this = Cost_prev if feature_compress is None else Cost_full
+                if  Cost_this < Cost_best:
+                    Cost_best = Cost_this
+                    params_01_vec_best = params01_vec_dst[:]
+
+            ############################################################
+            ## 1) construct matrix A = (N x 15) from numerical gradients
+            ############################################################
+            ## full refresh: first iteration, every k iterations, or when residual stopped decreasing
+            if jacobian == 'fd' or A is None or refresh or refresh_every <= num_iter - iter_refresh:
+                refresh      = False
+                iter_refresh = num_iter
+                A = np.zeros(( len(G_ref_vec) , num_params))
+
+                jobs       = []
+                paths_d    = []
+                increments = []
+                for ind_param in range(num_params):
+
+                    ## select sign for delta increment
+                    params01_vec_d = []
+                    params01_vec_d[:] = params01_vec_dst
+                    increment = +delta if params01_vec_dst[ind_param] < 0.5 else -delta
+
+                    ## increment/decrement small delta
+                    params01_vec_d[ind_param] += increment
+                    params_d_dict = convert_param_func(params01_vec_d)
+
+                    path_dst_d = '{0}/grad/iter_{1:04d}_{2:02d}'.format(folder_path, num_iter, ind_param)
+                    jobs.append( (params_d_dict, path_dst_d if archive is None else None) )
+                    paths_d.append(path_dst_d)
+                    increments.append(increment)
+
+                ########################################
+                ## move to each direction & render:
+                ## serially, or by worker pool (results in any order)
+                ########################################
+                if render_pool is None:
+                    results = ((ind_param,) + tuple(render_and_load(*jobs[ind_param])) for ind_param in range(num_params))
+                else:
+                    results = render_pool.RenderAll(jobs)
+
+                imgs_d_cv2 = [None] * num_params
+                for ind_param, img_dst_d_cv2, t_render, t_imageio in results:
+                    ## e.g. render workers out of sync with the renderer
+                    if img_dst_d_cv2.shape != img_dst_cv2.shape:
+                        raise RuntimeError("Image of parameter #{0:02d} is {1}, but the current image is {2}".format(
+                            ind_param+1, img_dst_d_cv2.shape, img_dst_cv2.shape))
+
+                    ## image of the pool can be a shared frame, valid until the next result
+                    imgs_d_cv2[ind_param] = img_dst_d_cv2 if render_pool is None else img_dst_d_cv2.copy()
+                    num_renders += 1
+
+                    ## get elapsed time
+                    t_render_elapsed  += t_render
+                    t_imageio_elapsed += t_imageio
+
+                    progress.Show("find_step", img_dst_d_cv2, "Parameter #{0:02d}".format(ind_param+1))
+                    if progress.IsCancelled():
+                        success = False
+                        if render_pool is not None: render_pool.Cancel()
+                        break
+
+                if success==False: break ## [CHECK ABORT]
+
+                ########################################
+                ## features of all directions at once
+                ########################################
+                with timer.Span("feature"):
+                    G_batch, t_feature = feature_batch(imgs_d_cv2)
+                t_feature_elapsed += t_feature
+
+                for ind_param in range(num_params):
+                    img_dst_d_cv2, G_dst_d = imgs_d_cv2[ind_param], G_batch[ind_param]
+                    params_d_dict, path_dst_d = jobs[ind_param][0], paths_d[ind_param]
+                    increment = increments[ind_param]
+
+                    with timer.Span("feature"):
+                        G_dst_d_vec = feature_vec(G_dst_d)
+
+                    with timer.Span("cost"):
+                        Cost_this = feature_cost(G_dst_d, G_dst_d_vec)
+
+                    if archive is not None:
+                        archive.Submit(img_dst_d_cv2, params_d_dict, path_dst_d, Cost_this)
+
+                    ## accumulate to matrix A
+                    Gram_mat_diff = (G_dst_d_vec - G_dst_vec).reshape(-1)
+                    A[:, ind_param] = Gram_mat_diff / increment ## original
+
+                    ## show the progress (1)
+                    img_text = "Cost: {0}\nParameter #{1:02d}".format(Cost_this, ind_param+1)
+                    prog = num_iter * (num_params + max_step) + ind_param + 1
+                    progress.Step(prog, Cost_this, img_text)
+
+            if success==False: break ## [CHECK ABORT]
+
+            ############################################################
+            ## 2) get the gradient descent direction by linear algebra
+            ############################################################
+            with timer.Span("optimizer"):
+                At = np.transpose(A) # At = (15 x N)
+                b = ( G_ref_vec - G_dst_vec ).reshape(-1)  # (N x 1), DESCENT direction (feature space)
+                Atb = np.dot(At, b) # (15 x N ) x (N x 1) = (15 x 1), DESCENT direction (parameter space)
         
-        ############################################################
-        ## 3) compute GRADIENT direction
-        ############################################################
-
-        ## consider the length (?) projected solution x to get direction w
-        AtA = np.dot(At, A)  # At x A = (15 x N) x (N x 15) = (15 x 15)
-        try:
-            AtA_inv = np.linalg.inv(AtA) #  ( 15 x 15 )
-            x = np.dot( AtA_inv, Atb )
-            Res_this = calc_cost_func(np.dot(A,x), b)
-
-            beta = np.max(np.abs(x))
-            w = x / beta
-        except Exception as e:
-            ## make dump file
-            dump_file = folder_path + "/AtA_iter{0}.txt".format(num_iter)
-            np.savetxt(dump_file, AtA)
-            traceback.print_exc()
-            
-            ## exceptional case: STEEPEST GRADIENT (direction only)
-            w = Atb / np.max(np.abs(Atb))
-            beta = np.linalg.norm( b ) / np.linalg.norm( np.dot( A, w ) )
+            ############################################################
+            ## 3) compute GRADIENT direction
+            ############################################################
+            with timer.Span("optimizer"):
+
+                ## consider the length (?) projected solution x to get direction w
+                AtA = np.dot(At, A)  # At x A = (15 x N) x (N x 15) = (15 x 15)
+                try:
+                    AtA_inv = np.linalg.inv(AtA) #  ( 15 x 15 )
+                    x = np.dot( AtA_inv, Atb )
+                    Res_this = calc_cost_func(np.dot(A,x), b) if feature_compress is None else feature_compress.Cost(np.dot(A,x), b)
+
+                    beta = np.max(np.abs(x))
+                    w = x / beta
+                except Exception as e:
+                    ## make dump file
+                    dump_file = folder_path + "/AtA_iter{0}.txt".format(num_iter)
+                    np.savetxt(dump_file, AtA)
+                    traceback.print_exc()
             
-        ############################################################
-        ## 4) determine alpha (=step size) to the next step
-        ############################################################
-        global step
-        step = 0
-        def SearchStep(alpha):
-            global step, success
-
-            global t_render_elapsed
-            global t_imageio_elapsed
-            global t_feature_elapsed
-
-            ## compute parameter from alpha
-            params01_vec = params01_vec_dst + alpha * w
-            params01_vec = np.clip(params01_vec, 0.0, 1.0)
-            params_dict  = convert_param_func(params01_vec)
+                    ## exceptional case: STEEPEST GRADIENT (direction only)
+                    w = Atb / np.max(np.abs(Atb))
+                    beta = np.linalg.norm( b ) / np.linalg.norm( np.dot( A, w ) )
             
             ############################################################
-            ## current parameter image
+            ## 4) determine alpha (=step size) to the next step
             ############################################################
-            path_dst_step = '{0}/step/iter_{1:04d}_{2:02d}'.format(folder_path, num_iter, step)
-            img_dst_step_cv2, t_render, t_imageio = render_and_load(params_dict, path_dst_step)
-            G_dst_step, t_feature = get_feature_func(img_dst_step_cv2)
-
-            Cost_step = calc_cost_func(G_ref, G_dst_step)
-
-            ########################################
-            ## get elapsed time
-            ########################################
-            t_render_elapsed  += t_render
-            t_imageio_elapsed += t_imageio
-            t_feature_elapsed += t_feature
-
-            ## show information on the image
-            img_text = "Cost: {0}\n#iter {1}, residual = {2}, #step {3}".format(Cost_step, num_iter, Res_this, step)
-            Misc.show_text_on_image_cv2(img_dst_step_cv2, img_text, "find_step")
-
-            ## show the progress bar (2)
-            prog = num_iter * (num_params + max_step) + num_params + step
-            cmds.progressWindow(edit=True, progress=prog)
-            if cmds.progressWindow(query=1, isCancelled=1):
-                success = False ## [ABORT]
-                raise StopIteration
-
-            step += 1
-            return Cost_step
-
-        opt = optimize.minimize_scalar(SearchStep, bounds=(0.0, beta), method='bounded', options={'maxiter':max_step})
-
-        if success==False: break ## [CHECK ABORT]
+            global step, step_best
+            step = 0
+            step_best = (np.inf, None, None) ## (cost, parameters, feature) of the best step
+            def SearchStep(alpha):
+                global step, step_best, success
+                global num_renders
+
+                global t_render_elapsed
+                global t_imageio_elapsed
+                global t_feature_elapsed
+
+                ## compute parameter from alpha
+                params01_vec = params01_vec_dst + alpha * w
+                params01_vec = np.clip(params01_vec, 0.0, 1.0)
+                params_dict  = convert_param_func(params01_vec)
+            
+                ############################################################
+                ## current parameter image
+                ############################################################
+                path_dst_step = '{0}/step/iter_{1:04d}_{2:02d}'.format(folder_path, num_iter, step)
+                img_dst_step_cv2, t_render, t_imageio = render_and_load(params_dict, path_dst_step if archive is None else None)
+                num_renders += 1
+                with timer.Span("feature"):
+                    G_dst_step, t_feature = get_feature_func(img_dst_step_cv2)
+                    G_dst_step_vec = feature_vec(G_dst_step) if feature_compress is not None or jacobian == 'broyden' else None
+
+                with timer.Span("cost"):
+                    Cost_step = feature_cost(G_dst_step, G_dst_step_vec, FeatureCost.AbortBound(early_abort, Cost_best))
+
+                ## keep the best step for Broyden update
+                if jacobian == 'broyden' and Cost_step < step_best[0]:
+                    step_best = (Cost_step, params01_vec, G_dst_step_vec)
+
+                if archive is not None:
+                    archive.Submit(img_dst_step_cv2, params_dict, path_dst_step, Cost_step)
+
+                ########################################
+                ## get elapsed time
+                ########################################
+                t_render_elapsed  += t_render
+                t_imageio_elapsed += t_imageio
+                t_feature_elapsed += t_feature
+
+                ## show information on the image
+                img_text = "Cost: {0}\n#iter {1}, residual = {2}, #step {3}".format(Cost_step, num_iter, Res_this, step)
+                progress.Show("find_step", img_dst_step_cv2, img_text)
+
+                ## show the progress (2)
+                prog = num_iter * (num_params + max_step) + num_params + step
+                progress.Step(prog, Cost_step, img_text)
+                if progress.IsCancelled():
+                    success = False ## [ABORT]
+                    if archive is not None: archive.Flush()
+                    raise StopIteration
+
+                step += 1
+                return Cost_step
+
+            try:
+                opt = optimize.minimize_scalar(SearchStep, bounds=(0.0, beta), method='bounded', options={'maxiter':max_step})
+            except StopIteration:
+                pass ## cancelled during line search
+
+            if success==False: break ## [CHECK ABORT]
+
+            num_renders_iter.append(num_renders - num_renders_start)
+
+            ## PCA: fit the basis from renders of the first iteration
+            if feature_compress is not None and not feature_compress.IsFitted():
+                feature_compress.Fit()
 
-        ## abort the iteration when there was no improvement neither Cost nor Residual.
-        Cost_this = opt.fun
-        if Cost_prev < Cost_this and Res_prev < Res_this:
-            break
+            ############################################################
+            ## 5) Broyden (rank-one) update of A from the best step
+            ############################################################
+            with timer.Span("optimizer"):
+                A_updated = jacobian == 'broyden' and iter_refresh != num_iter
+                if jacobian == 'broyden' and step_best[1] is not None:
+                    dp = step_best[1] - np.array(params01_vec_dst) # parameter space
+                    dG = step_best[2] - G_dst_vec                  # feature space
+                    dp_norm2 = np.dot(dp, dp)
+                    if dp_norm2 > 0.0:
+                        A += np.outer(dG - np.dot(A, dp), dp / dp_norm2)
+
+                    ## refresh when the residual stopped decreasing
+                    if not Res_this < Res_prev:
+                        refresh = True
+
+            ## abort the iteration when there was no improvement neither Cost nor Residual.
+            Cost_this = opt.fun
+            if Cost_prev < Cost_this and Res_prev < Res_this:
+                ## updated (not refreshed) A may be stale: retry with fresh A
+                if A_updated:
+                    refresh = True
+                    retry   = True
+                    num_renders_iter.pop() ## counted with the retry
+                    continue
+                break
         
-        ## proceed to the next step
-        Res_prev = Res_this
-        alpha = opt.x
-        params01_vec_dst = alpha * w + params01_vec_dst
-        params01_vec_dst = np.clip(params01_vec_dst, 0.0, 1.0)
+            ## proceed to the next step
+            Res_prev = Res_this
+            alpha = opt.x
+            params01_vec_dst = alpha * w + params01_vec_dst
+            params01_vec_dst = np.clip(params01_vec_dst, 0.0, 1.0)
+
+            ## checkpoint of the next iteration (A is kept for Broyden updates)
+            Checkpoint.Save(checkpoint_path, {
+                "num_iter"          : num_iter + 1,
+                "params01_vec_dst"  : params01_vec_dst,
+                "params_01_vec_best": params_01_vec_best,
+                "Cost_best"         : Cost_best,
+                "Res_prev"          : Res_prev,
+                "A"                 : A if jacobian == 'broyden' else None,
+                "refresh"           : refresh,
+                "iter_refresh"      : iter_refresh,
+                "random_state"      : Checkpoint.GetRandomState(),
+            })
+            num_iter += 1
+    finally:
+        Timing.Activate(timer_prev)
+        if render_pool is not None:
+            render_pool.Cancel() ## renders of an aborted Jacobian (the pool may be reused)
+        if compress_log is not None:
+            compress_log.close()
     
     ## best parameter until the last iteration ...
     best_params_dict = convert_param_func(params_01_vec_best)
+
+    if archive is not None:
+        archive.Flush()
+
+    ## per-iteration spans & percentiles
+    timer.ExportJSONL(folder_path + "/timing_featuregrad.jsonl")
+    timer.WriteSummary(folder_path + "/timing_featuregrad.txt")
     
-    cmds.progressWindow(endProgress=1)
+    progress.End()
     return success, best_params_dict
 
 
@@ -248,6 +490,7 @@ def GradientDescent(
 ## example of usage
 ###############################################################################
 if "__main__" == __name__:
+    import Misc ## FurRenderer (Maya)
 
     ############################################################
     ## user-specified values & paths
@@ -271,6 +514,10 @@ if "__main__" == __name__:
     ## pick reference image files from folder
     fileList = next(os.walk(folder_reference))[2]
     fileList = [imgFile for imgFile in fileList if ".{0}".format(imgFileExt)==os.path.splitext(imgFile)[1]]
+
+    ## render/feature cache shared by all runs
+    cache = RenderCache.RenderCache(folder_temp_root + "/_cache")
+    get_feature_func = RenderCache.CachedFeature(vgg_max_gray_gram, cache)
     
     ############################################################
     ## iteration:
@@ -282,6 +529,7 @@ if "__main__" == __name__:
 
             ## initialize renderer wrapper
             furRenderer = Misc.FurRenderer()
+            furRenderer.cache = cache
 
             ############################################################
             ## create temporary folder and copy image file to the folder
@@ -295,6 +543,7 @@ if "__main__" == __name__:
             )
             os.makedirs(folder_root) # root folder to preserve optimization progress
             shutil.copy2(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt))
+            RefFeature.CopyStore(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt)) ## precomputed features
 
             furRenderer.Init(folder_root)
 
@@ -348,7 +597,7 @@ if "__main__" == __name__:
 
             ## run optimization on GEOMETRY parameters
             succeeded, shape_param_dict = GradientDescent(
-                vgg_max_gray_gram, calc_cost_func, furRenderer.RenderFur,
+                get_feature_func, calc_cost_func, furRenderer.RenderFur,
                 convert_param_func, params01_vec_dst,
                 folder_root, imgFileExt
             )
@@ -364,6 +613,8 @@ if "__main__" == __name__:
                 txt.write("imageio time   = {0}\n".format(t_imageio_elapsed) )
                 txt.write("feature extraction time = {0}\n".format(t_feature_elapsed) )
                 txt.write("et cetera time = {0}\n".format(t_etc_elapsed) )
+                txt.write("renders per iteration = {0} (total {1})\n".format(num_renders_iter, num_renders) )
+                cache.WriteStats(txt)
 
             ## render the best result
             furRenderer.RenderFur(shape_param_dict, folder_root+"/_best_shape")
@@ -2,8 +2,6 @@
 ## Fur parameter search by Feature Space Gradient Descent
 ## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
 ###############################################################################
-import maya.cmds as cmds
-
 import traceback
 import shutil, os
 from datetime import datetime
@@ -13,7 +11,9 @@ import cv2
 from scipy import optimize ## minimize_scalar (line search)
 
 from stNoh import FurParam
-import Misc
+from stNoh import RefFeature
+from stNoh import RenderCache
+from stNoh import Resolution
 
 ## optimization routine
 import search_BayesOpt
@@ -39,6 +39,8 @@ def getBackgroundColor(img_cv2):
 ## example of usage
 ###############################################################################
 if "__main__" == __name__:
+    import maya.cmds as cmds
+    import Misc ## FurRenderer (Maya)
 
     ############################################################
     ## user-specified values & paths
@@ -51,6 +53,9 @@ if "__main__" == __name__:
     ## camera background color setting
     Camera_name = "RenderCamShape2"
 
+    ## BayesOpt at reduced resolution (e.g. 0.5: 480x270), FeatureGrad at full resolution (None: full only)
+    coarse_scale = 0.5
+
     ########################################
     ## parameter normalization [0.0:1.0]
     ########################################
@@ -89,6 +94,11 @@ if "__main__" == __name__:
     ## pick reference image files from folder
     fileList = next(os.walk(folder_reference))[2]
     fileList = [imgFile for imgFile in fileList if ".{0}".format(imgFileExt)==os.path.splitext(imgFile)[1]]
+
+    ## render/feature cache: BayesOpt and FeatureGrad search the same space
+    cache = RenderCache.RenderCache(folder_temp_root + "/_cache")
+    get_gray_feature_func  = RenderCache.CachedFeature(vgg_max_gray_gram , cache)
+    get_color_feature_func = RenderCache.CachedFeature(vgg_max_color_gram, cache)
     
     ############################################################
     ## iteration:
@@ -102,6 +112,8 @@ if "__main__" == __name__:
             ## preparation before optimization
             ############################################################
             furRenderer = Misc.FurRenderer()
+            furRenderer.SetFramebufferMode(True, archive=True) ## lossless frames in memory, images archived in background
+            furRenderer.cache = cache
 
             img_ref_path = "{0}/{1}".format(folder_reference, imgFile)
 
@@ -120,6 +132,7 @@ if "__main__" == __name__:
             )
             os.makedirs(folder_root) # root folder to preserve optimization progress
             shutil.copy2(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt))
+            RefFeature.CopyStore(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt)) ## precomputed features
 
             furRenderer.Init(folder_root)
 
@@ -133,24 +146,36 @@ if "__main__" == __name__:
             params01_vec_dst = [0.5]*15 ## dummy for consistency
 
             ## 1) global geometry optimization by BayesOpt
-            succeeded, param_geom_dict = search_BayesOpt.BayesOpt(
-                vgg_max_gray_gram, calc_cost_func, furRenderer.RenderFur,
-                convert_param_geom_func, params01_vec_dst,
-                folder_root, imgFileExt, {"max_iter":100}
-            )
+            if coarse_scale is None:
+                succeeded, param_geom_dict = search_BayesOpt.BayesOpt(
+                    get_gray_feature_func, calc_cost_func, furRenderer.RenderFur,
+                    convert_param_geom_func, params01_vec_dst,
+                    folder_root, imgFileExt, {"max_iter":100}
+                )
+            else:
+                schedule = Resolution.CoarseToFine(furRenderer, coarse_scale)
+                succeeded, param_geom_dict = schedule.Run(
+                    search_BayesOpt.BayesOpt,
+                    get_gray_feature_func, calc_cost_func, convert_param_geom_func, params01_vec_dst,
+                    folder_root, img_ref_path, {"max_iter":100}
+                )
+                schedule.WriteReport(folder_root)
 
             ## convert dictionary to vector
             params01_vec_dst = invert_geom_func(param_geom_dict)
 
             ## 2) local geometry optimization by FeatureGrad
             succeeded, param_geom_dict = search_FeatureGrad.GradientDescent(
-                vgg_max_gray_gram, calc_cost_func, furRenderer.RenderFur,
+                get_gray_feature_func, calc_cost_func, furRenderer.RenderFur,
                 convert_param_geom_func, params01_vec_dst,
                 folder_root, imgFileExt, {"max_iter":20,"max_step":15,"delta":0.1}
             )
 
             ## render the best result
             furRenderer.RenderFur(param_geom_dict, folder_root+"/_best_geom")
+
+            with open(folder_root+"/elapsed.txt", "a+") as txt:
+                cache.WriteStats(txt)
             
             ############################################################
             ## create temporary folder and copy image file to the folder
@@ -162,6 +187,7 @@ if "__main__" == __name__:
             )
             os.makedirs(folder_root) # root folder to preserve optimization progress
             shutil.copy2(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt))
+            RefFeature.CopyStore(img_ref_path, folder_root+"/_ref_image.{0}".format(imgFileExt)) ## precomputed features
 
             furRenderer.Init(folder_root)
             furRenderer.RenderFur(init_params_dict, folder_root+"/temp", False) ## test rendering ...
@@ -172,24 +198,37 @@ if "__main__" == __name__:
             params01_vec_dst = [0.5]*10 ## dummy for consistency
 
             ## 3) global color optimization by BayesOpt
-            succeeded, param_color_dict = search_BayesOpt.BayesOpt(
-                vgg_max_color_gram, calc_cost_func, furRenderer.RenderFur,
-                convert_param_color_func, params01_vec_dst,
-                folder_root, imgFileExt, {"max_iter":50}
-            )
+            if coarse_scale is None:
+                succeeded, param_color_dict = search_BayesOpt.BayesOpt(
+                    get_color_feature_func, calc_cost_func, furRenderer.RenderFur,
+                    convert_param_color_func, params01_vec_dst,
+                    folder_root, imgFileExt, {"max_iter":50}
+                )
+            else:
+                schedule = Resolution.CoarseToFine(furRenderer, coarse_scale)
+                succeeded, param_color_dict = schedule.Run(
+                    search_BayesOpt.BayesOpt,
+                    get_color_feature_func, calc_cost_func, convert_param_color_func, params01_vec_dst,
+                    folder_root, img_ref_path, {"max_iter":50}
+                )
+                schedule.WriteReport(folder_root)
 
             ## convert dictionary to vector
             params01_vec_dst = invert_color_func(param_color_dict)
 
             ## 4) local color optimization by FeatureGrad
             succeeded, param_color_dict = search_FeatureGrad.GradientDescent(
-                vgg_max_color_gram, calc_cost_func, furRenderer.RenderFur,
+                get_color_feature_func, calc_cost_func, furRenderer.RenderFur,
                 convert_param_color_func, params01_vec_dst,
                 folder_root, imgFileExt, {"max_iter":20,"max_step":10,"delta":0.075}
             )
 
             ## render the best result
             furRenderer.RenderFur(param_color_dict, folder_root+"/_best_color")
+            furRenderer.Close() ## all archival images are written
+
+            with open(folder_root+"/elapsed.txt", "a+") as txt:
+                cache.WriteStats(txt)
             
             if False==succeeded:
                 abort = True
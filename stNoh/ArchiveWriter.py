@@ -0,0 +1,166 @@
+###############################################################################
+## background writer for per-iteration images and parameters
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import threading
+import heapq
+import queue
+
+import numpy as np
+
+from stNoh import FurParam
+
+
+###############################################################################
+## asynchronous archival writer
+###############################################################################
+class ArchiveWriter:
+    """
+    Persists rendered images (+ parameter CSV) on a background thread.
+    policy    : "all"       keeps every submitted iterate
+                "best"      keeps only the best N iterates (by cost)
+                "improving" keeps only iterates improving the best cost so far
+    keep_best : N for "best" policy
+    max_queue : bound of the queue; Submit() blocks when it is full
+    image_ext : file extension of archived images
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, policy="all", keep_best=10, max_queue=16, image_ext="jpg"):
+
+        if policy not in {"all", "best", "improving"}:
+            raise ValueError('Invalid archive policy:', policy)
+
+        self.policy    = policy
+        self.keep_best = keep_best
+        self.image_ext = image_ext
+
+        ## improving policy: best cost at submission
+        self.cost_best = np.inf
+
+        ## best policy: max-heap of (-cost, path) for kept iterates
+        self.kept = []
+
+        ## statistics
+        self.bytes_written   = 0
+        self.num_written     = 0
+        self.num_skipped     = 0
+        self.num_removed     = 0
+        self.max_queue_depth = 0
+
+        self.queue  = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._Run, name="ArchiveWriter")
+        self.thread.daemon = True
+        self.thread.start()
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def Submit(self, img_cv2, params_dict, path, cost=None):
+        """
+        Queues an iterate to be persisted as "<path>_tmp.<ext>" and "<path>.csv".
+        img_cv2    : rendered image (BGR), copied before queueing (or None)
+        params_dict: fur parameters (or None)
+        path       : filepath without extension (string)
+        cost       : cost of the iterate (needed by "best"/"improving")
+        Returns True when the iterate is queued.
+        """
+
+        if self.policy == "improving":
+            if cost is None or not cost < self.cost_best:
+                self.num_skipped += 1
+                return False
+            self.cost_best = cost
+
+        img_copy = None if img_cv2 is None else img_cv2.copy() ## caller may draw on it
+        self.queue.put( (img_copy, params_dict, path, cost) )
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+
+    ## wait until all queued iterates are written
+    def Flush(self):
+        self.queue.join()
+        return None
+
+    ## flush and stop the writer thread (on completion or abort)
+    def Close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        return None
+
+    def Stats(self):
+        return {
+            "queue_depth"    : self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "bytes_written"  : self.bytes_written,
+            "written"        : self.num_written,
+            "skipped"        : self.num_skipped,
+            "removed"        : self.num_removed,
+        }
+
+    ############################################################
+    ## writer thread
+    ############################################################
+    def _Files(self, path):
+        return [path + "_tmp." + self.image_ext, path + ".csv"]
+
+    def _Write(self, img_cv2, params_dict, path):
+        import cv2
+
+        img_file, csv_file = self._Files(path)
+
+        folder = os.path.dirname(path)
+        if folder != "" and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        if img_cv2 is not None:
+            cv2.imwrite(img_file, img_cv2)
+            self.bytes_written += os.path.getsize(img_file)
+
+        if params_dict is not None:
+            FurParam.dict2csv(params_dict, csv_file)
+            self.bytes_written += os.path.getsize(csv_file)
+
+        self.num_written += 1
+        return None
+
+    def _Remove(self, path):
+        for file in self._Files(path):
+            if os.path.isfile(file):
+                os.remove(file)
+        self.num_removed += 1
+        return None
+
+    def _Run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+
+                img_cv2, params_dict, path, cost = item
+
+                ## best-N: skip (or evict) iterates out of the ranking
+                if self.policy == "best" and cost is not None:
+                    if len(self.kept) >= self.keep_best and not cost < -self.kept[0][0]:
+                        self.num_skipped += 1
+                        continue
+                    self._Write(img_cv2, params_dict, path)
+                    heapq.heappush(self.kept, (-cost, path))
+                    if len(self.kept) > self.keep_best:
+                        _, path_worst = heapq.heappop(self.kept)
+                        self._Remove(path_worst)
+                else:
+                    self._Write(img_cv2, params_dict, path)
+
+            except Exception:
+                import traceback
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,108 @@
+###############################################################################
+## checkpoint of optimizer state (resumable optimization)
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import glob
+import pickle
+import random
+
+import numpy as np
+
+from stNoh import FurParam
+
+
+###############################################################################
+## save / load
+###############################################################################
+def Save(path, state):
+    """
+    Pickles state (dictionary) atomically: a crash while writing keeps
+    the previous checkpoint intact.
+    """
+    path_tmp = path + ".tmp"
+    with open(path_tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=2)
+    os.replace(path_tmp, path)
+    return None
+
+def Load(path):
+    """
+    Returns state (dictionary) of the checkpoint, or None when it does not exist.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+###############################################################################
+## random state
+###############################################################################
+def GetRandomState(rng=None):
+    """
+    Returns states of global random generators (and of rng, e.g. optimizer's).
+    """
+    return {
+        "numpy" : np.random.get_state(),
+        "python": random.getstate(),
+        "rng"   : None if rng is None else rng.get_state(),
+    }
+
+def SetRandomState(state, rng=None):
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+    if rng is not None and state.get("rng") is not None:
+        rng.set_state(state["rng"])
+    return None
+
+
+###############################################################################
+## evaluated points in a sample folder
+###############################################################################
+def ParamKeys(convert_param_func, num_params):
+    """
+    Returns parameter names in the order of normalized vector,
+    by probing convert_param_func one dimension at a time.
+    """
+    params_base = convert_param_func([0.0] * num_params)
+
+    keys = []
+    for ind in range(num_params):
+        params01_vec = [0.0] * num_params
+        params01_vec[ind] = 1.0
+        params_dict = convert_param_func(params01_vec)
+        keys += [key for key in params_dict if params_dict[key] != params_base[key]]
+    return keys
+
+## image formats of archived renders (lossless first)
+IMAGE_EXTS = ["png", "bmp", "tif", "tiff", "jpg", "jpeg"]
+
+def EvaluatedPoints(folder, keys):
+    """
+    Returns [(normalized vector, image path, iteration)] of evaluated points
+    ("<folder>/iter_XXXX.csv" with "<folder>/iter_XXXX_tmp.<ext>" of any IMAGE_EXTS,
+    e.g. renders archived as jpg for a png reference).
+    Points without image (e.g. not archived) are skipped.
+    """
+    points = []
+    for csv_path in sorted(glob.glob(glob.escape(folder) + "/iter_*.csv")):
+        stem = os.path.splitext(csv_path)[0]
+        img_paths = ["{0}_tmp.{1}".format(stem, ext) for ext in IMAGE_EXTS]
+        img_paths = [img_path for img_path in img_paths if os.path.isfile(img_path)]
+        if len(img_paths) == 0:
+            continue
+        img_path = img_paths[0]
+
+        try:
+            num_iter = int(os.path.basename(stem)[len("iter_"):])
+        except ValueError:
+            continue ## e.g. "iter_0001_00" of other search modules
+
+        params_dict = FurParam.csv2dict(csv_path)
+        if not all([key in params_dict for key in keys]):
+            continue
+
+        params01_vec = [FurParam.ConvertFurParam(key, params_dict[key]) for key in keys]
+        points.append( (params01_vec, img_path, num_iter) )
+    return points
@@ -0,0 +1,154 @@
+###############################################################################
+## procedural "fake fur" renderer: offline stand-in for MayaFur
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import numpy as np
+
+from stNoh import FurParam
+from stNoh import RenderBackend
+
+
+###############################################################################
+## subroutine: smooth value noise on a periodic lattice
+###############################################################################
+def _ValueNoise(lattice, u, v, freq):
+    """
+    Returns bilinear value noise in [0.0:1.0] with smoothstep interpolation.
+    lattice: periodic random lattice (NxN)
+    u, v   : coordinates (np array)
+    freq   : number of lattice cells per unit length
+    """
+    N = lattice.shape[0]
+
+    X = u * freq
+    Y = v * freq
+    x0 = np.floor(X)
+    y0 = np.floor(Y)
+    fx = X - x0
+    fy = Y - y0
+    fx = fx * fx * (3.0 - 2.0 * fx)
+    fy = fy * fy * (3.0 - 2.0 * fy)
+
+    i0 = x0.astype(np.int64) % N
+    j0 = y0.astype(np.int64) % N
+    i1 = (i0 + 1) % N
+    j1 = (j0 + 1) % N
+
+    n0 = lattice[j0, i0] * (1.0 - fx) + lattice[j0, i1] * fx
+    n1 = lattice[j1, i0] * (1.0 - fx) + lattice[j1, i1] * fx
+    return n0 * (1.0 - fy) + n1 * fy
+
+
+###############################################################################
+## offline renderer
+###############################################################################
+class FakeFurRenderer(RenderBackend.RenderBackend):
+    """
+    Pure-NumPy procedural fur image generator.
+    It is NOT physically based: it only maps the 25 parameters of
+    FurParam.ParamsGeom/ParamsColor to a deterministic strand-like pattern,
+    so that optimizers and feature extractors can run without Maya.
+    seed: seed of the random lattices (the same seed gives the same image)
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, seed=0):
+        RenderBackend.RenderBackend.__init__(self)
+
+        ## current parameters: start from the default values
+        self.params = {}
+        self.params.update(FurParam.ParamsGeom)
+        self.params.update(FurParam.ParamsColor)
+
+        ## deterministic random lattices
+        rng = np.random.RandomState(seed)
+        self.lattice_polar    = rng.random_sample((64, 64)).astype(np.float32)
+        self.lattice_scraggle = rng.random_sample((64, 64)).astype(np.float32)
+        self.lattice_clump    = rng.random_sample((64, 64)).astype(np.float32)
+        self.strand_offset    = rng.random_sample(4096).astype(np.float32)
+
+        ## pixel coordinates (cached per image size)
+        self._grid_size = None
+        self._u = None
+        self._v = None
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def SetParams(self, params_dict):
+        for key in params_dict:
+            self.params[key] = float(params_dict[key])
+        return None
+
+    def _Grid(self):
+        if self._grid_size != (self.imageW_px, self.imageH_px):
+            ## normalized by image height: unit length = image height
+            y, x = np.mgrid[0:self.imageH_px, 0:self.imageW_px].astype(np.float32)
+            self._u = x / float(self.imageH_px)
+            self._v = y / float(self.imageH_px)
+            self._grid_size = (self.imageW_px, self.imageH_px)
+        return self._u, self._v
+
+    def RenderImage(self):
+        u, v = self._Grid()
+
+        ## geometry parameters normalized to [0.0:1.0]
+        g = {}
+        for key in FurParam.ParamsGeom:
+            g[key] = np.clip(FurParam.ConvertFurParam(key, self.params[key]), 0.0, 1.0)
+
+        ## 1) strand direction: inclination + polar noise
+        theta = np.pi * (0.15 + 0.30 * g["Inclination"])
+        theta = theta + 1.5 * g["PolarNoise"] * (_ValueNoise(self.lattice_polar, u, v, 1.0 + 4.0 * g["PolarNoiseFreq"]) - 0.5)
+
+        cos_t = np.cos(theta)
+        sin_t = np.sin(theta)
+        across = u * cos_t + v * sin_t
+        along  = v * cos_t - u * sin_t
+
+        ## 2) scraggle: jitter across strands
+        scraggle = _ValueNoise(self.lattice_scraggle, u, v, 2.0 + 20.0 * g["ScraggleFrequency"]) - 0.5
+        across = across + 0.03 * g["Scraggle"] * (1.0 - 0.8 * g["ScraggleCorrelation"]) * scraggle
+
+        ## 3) clumping: pull strands toward clump centers
+        clump_freq = 1.0 + 10.0 * g["ClumpingFrequency"]
+        clump_pos  = across * clump_freq
+        clump_frac = clump_pos - np.floor(clump_pos) - 0.5
+        clump_pull = g["Clumping"] * np.abs(2.0 * clump_frac) ** (0.5 + 2.0 * g["ClumpShape"])
+        across = across - clump_pull * clump_frac / clump_freq
+
+        ## 4) single strands: density, length and curl
+        strand_freq = 20.0 + 60.0 * g["Density"]
+        strand_pos  = across * strand_freq
+        strand_id   = np.floor(strand_pos).astype(np.int64) % len(self.strand_offset)
+
+        t = along * (1.5 / (0.2 + g["Length"])) + self.strand_offset[strand_id]
+        t = t - np.floor(t) ## root (0.0) -> tip (1.0)
+
+        curl = (0.2 * g["BaseCurl"] * (1.0 - t) + 0.3 * g["TipCurl"] * t) * np.sin(2.0 * np.pi * 3.0 * t)
+        f = strand_pos + curl
+        f = np.abs(f - np.floor(f) - 0.5) ## distance from strand center [0.0:0.5]
+
+        ## 5) strand width from base to tip
+        half_width = 0.05 + 0.40 * (g["BaseWidth"] * (1.0 - t) + g["TipWidth"] * t)
+        mask = np.clip((half_width - f) / 0.05, 0.0, 1.0)
+
+        ## 6) shading: color interpolation + cylinder-like specular
+        shade = np.clip(1.0 - 2.0 * f, 0.0, 1.0)
+        sharpness = 1.0 + self.params["SpecularSharpness"] / 5.0
+        highlight = shade ** sharpness
+
+        img = np.zeros((self.imageH_px, self.imageW_px, 3), np.float32)
+        for c, ch in enumerate(["B", "G", "R"]): ## cv2 channel order
+            base = self.params["BaseColor" + ch]
+            tip  = self.params["TipColor"  + ch]
+            spec = self.params["SpecularColor" + ch]
+
+            strand = (base * (1.0 - t) + tip * t) * (0.4 + 0.6 * shade) + spec * highlight
+            img[:, :, c] = mask * strand + (1.0 - mask) * 0.3 * base
+
+        img = np.clip(img * 255.0 + 0.5, 0.0, 255.0).astype(np.uint8)
+        return img
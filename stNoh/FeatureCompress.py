@@ -0,0 +1,129 @@
+###############################################################################
+## compression of Gram features for Jacobian solves
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import numpy as np
+
+from stNoh import Gram
+
+
+###############################################################################
+## symmetric Gram matrix -> upper triangle vector
+###############################################################################
+_triu_indices = {} ## cache of (row, col) per number of channels
+
+def _TriuIndices(C):
+    if C not in _triu_indices:
+        _triu_indices[C] = np.triu_indices(C)
+    return _triu_indices[C]
+
+def GramUpperTriangle(G):
+    """
+    Concatenates upper triangles (with diagonal) of Gram matrices as a vector.
+    Off-diagonal entries are scaled by sqrt(2), so that squared distance
+    between two vectors is exactly the same as the full (flattened) one.
+    G: list of symmetric Gram matrices (or Gram.PackedGram: the same vector)
+    """
+    if isinstance(G, Gram.PackedGram):
+        return G.vec.astype(np.float64)
+
+    vecs = []
+    for G_l in G:
+        rows, cols = _TriuIndices(G_l.shape[0])
+        v = G_l[rows, cols]
+        v[rows != cols] *= np.sqrt(2.0)
+        vecs.append(v)
+    return np.concatenate(vecs)
+
+
+###############################################################################
+## compressor
+###############################################################################
+class FeatureCompressor:
+    """
+    Maps Gram matrices to a compact vector whose squared distance
+    approximates calc_cost_func (sum of squared Gram differences).
+    method: "triu"   exact: upper triangles only (half the size)
+            "random" fixed random projection to 'dim' (signed hashing, seeded)
+            "pca"    PCA basis of 'dim' learned from observed renders
+    dim   : dimension of compressed vector ("random" and "pca")
+    seed  : seed of random projection
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, method="triu", dim=4096, seed=0):
+
+        if method not in {"triu", "random", "pca"}:
+            raise ValueError('Invalid compression method:', method)
+
+        self.method = method
+        self.dim    = dim
+        self.seed   = seed
+
+        ## random projection: bucket & sign for each input dimension
+        self.buckets = None
+        self.signs   = None
+
+        ## PCA: observed vectors & basis (dim x N)
+        self.observed = []
+        self.basis    = None
+
+        ## incremented whenever the output space changes
+        self.version = 0
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def Compress(self, G):
+        v = GramUpperTriangle(G)
+
+        if self.method == "random":
+            if self.buckets is None or len(self.buckets) != len(v):
+                rng = np.random.RandomState(self.seed)
+                self.buckets = rng.randint(0, self.dim, len(v))
+                self.signs   = rng.randint(0, 2, len(v)) * 2.0 - 1.0
+                self.version += 1
+
+            ## sparse sign projection: unbiased for squared distance
+            return np.bincount(self.buckets, weights=self.signs * v, minlength=self.dim)
+
+        if self.method == "pca" and self.basis is not None:
+            return np.dot(self.basis, v)
+
+        return v
+
+    def Cost(self, c_ref, c_dst):
+        """
+        Approximation of calc_cost_func(G_ref, G_dst) by compressed vectors.
+        """
+        c_diff = c_ref - c_dst
+        return np.sum(c_diff ** 2)
+
+    ## PCA: collect renders (before Fit)
+    def Observe(self, G):
+        if self.method == "pca" and self.basis is None:
+            self.observed.append(GramUpperTriangle(G))
+        return None
+
+    def IsFitted(self):
+        return self.method != "pca" or self.basis is not None
+
+    def Fit(self):
+        """
+        Learns PCA basis from observed renders.
+        """
+        if self.method != "pca" or len(self.observed) < 2:
+            return None
+
+        X = np.array(self.observed)
+        X = X - np.mean(X, axis=0)
+        _, S, Vt = np.linalg.svd(X, full_matrices=False)
+
+        rank = int(np.sum(S > S[0] * 1e-6))
+        self.basis    = Vt[:min(self.dim, rank)]
+        self.observed = []
+        self.version += 1
+        return None
@@ -0,0 +1,133 @@
+###############################################################################
+## cost of Gram features against a fixed reference (with early abort)
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import numpy as np
+
+from stNoh import Gram
+
+
+###############################################################################
+## evaluator built once per reference
+###############################################################################
+class CostEvaluator:
+    """
+    Sum of squared differences of Gram matrices to one reference,
+    the same value as calc_cost_func(G_ref, G_dst) of init_feature.py.
+    The reference is packed & converted to float64 only once.
+    G_ref  : Gram features of the reference (Gram.PackedGram or list of matrices)
+    weights: weight of squared differences of each layer (None: 1.0)
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, G_ref, weights=None):
+        G_ref = Gram.Pack(G_ref)
+        self.offsets   = G_ref.layout.offsets
+        self.G_ref_vec = G_ref.vec.astype(np.float64)
+
+        num_layers = len(G_ref)
+        self.weights = np.ones(num_layers) if weights is None else np.array(weights, dtype=np.float64)
+
+        ## order of accumulation: layers of larger cost first (updated by complete evaluations)
+        self.order = list(range(num_layers))
+
+        ## statistics of early abort
+        self.num_evals      = 0
+        self.num_aborted    = 0
+        self.layers_skipped = 0
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def Layers(self, G_dst, bound=None):
+        """
+        Returns cost of each layer.
+        bound: stop once the partial sum exceeds it (e.g. current best);
+               layers not evaluated are None
+        """
+        G_dst_vec = Gram.Vector(G_dst)
+
+        costs = [None] * len(self.order)
+        total = 0.0
+        for l in self.order:
+            begin, end = self.offsets[l], self.offsets[l+1]
+            G_diff = self.G_ref_vec[begin:end] - G_dst_vec[begin:end]
+            costs[l] = float(self.weights[l] * np.dot(G_diff, G_diff))
+
+            total += costs[l]
+            if bound is not None and total > bound:
+                break
+
+        self.num_evals += 1
+        num_skipped = costs.count(None)
+        if num_skipped > 0:
+            self.num_aborted    += 1
+            self.layers_skipped += num_skipped
+        else:
+            self.order = sorted(self.order, key=lambda l: -costs[l])
+        return costs
+
+    def Cost(self, G_dst, bound=None):
+        """
+        Returns the cost, or the partial sum (> bound, i.e. a lower bound of the cost)
+        when it is aborted by bound.
+        """
+        return sum([cost for cost in self.Layers(G_dst, bound) if cost is not None])
+
+    def Stats(self):
+        return {"evals": self.num_evals, "aborted": self.num_aborted, "layers_skipped": self.layers_skipped}
+
+
+###############################################################################
+## cost function against a fixed reference
+###############################################################################
+class _CostFunc:
+    """
+    calc_cost_func(G_ref, G_dst) with the interface of CostEvaluator (bound ignored).
+    """
+
+    def __init__(self, calc_cost_func, G_ref):
+        self.calc_cost_func = calc_cost_func
+        self.G_ref = G_ref
+        self.num_evals = 0
+        pass
+
+    def Cost(self, G_dst, bound=None):
+        self.num_evals += 1
+        return self.calc_cost_func(self.G_ref, G_dst)
+
+    def Stats(self):
+        return {"evals": self.num_evals, "aborted": 0, "layers_skipped": 0}
+
+def ForReference(calc_cost_func, G_ref):
+    """
+    Returns an object with Cost(G_dst, bound=None) against G_ref:
+    CostEvaluator if calc_cost_func defines "evaluator" (see init_feature.py),
+    otherwise calc_cost_func itself (no early abort).
+    """
+    make_evaluator = getattr(calc_cost_func, "evaluator", None)
+    if make_evaluator is None:
+        return _CostFunc(calc_cost_func, G_ref)
+    return make_evaluator(G_ref)
+
+def AbortFactor(early_abort):
+    """
+    Returns early_abort (None: disabled) after checking it is a factor >= 1:
+    below 1, an aborted partial sum could be lower than the best cost,
+    and be taken as a new best.
+    """
+    if early_abort is not None and not early_abort >= 1.0:
+        raise ValueError('Invalid early_abort (factor >= 1):', early_abort)
+    return early_abort
+
+def AbortBound(early_abort, Cost_best):
+    """
+    Returns bound of early abort: early_abort (factor >= 1) times the best cost
+    (None: disabled, or no best cost yet).
+    """
+    if AbortFactor(early_abort) is None or not np.isfinite(Cost_best):
+        return None
+    return early_abort * Cost_best
@@ -0,0 +1,121 @@
+###############################################################################
+## diff-only attribute writer for fur description
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+
+
+###############################################################################
+## writer which remembers the last values sent to Maya
+###############################################################################
+class FurAttributeWriter:
+    """
+    Shadow-state writer for a single fur description (and its material).
+    Only the attributes which differ from the last written values are sent,
+    as a single MEL string (one mel.eval call per update).
+    fur_desc : name of fur description (string)
+    material : name of material to copy base color (string, optional)
+    cmds     : module compatible with maya.cmds (for off-Maya use, optional)
+    mel      : module compatible with maya.mel  (for off-Maya use, optional)
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, fur_desc, material=None, cmds=None, mel=None):
+
+        ## import Maya modules only when they are not given
+        if cmds is None:
+            import maya.cmds as cmds
+        if mel is None:
+            import maya.mel as mel
+
+        self.cmds = cmds
+        self.mel  = mel
+
+        self.fur_desc = fur_desc
+        self.material = material
+
+        ## last values written: {"node.attr": value}
+        self.shadow = {}
+
+        ## statistics
+        self.num_written = 0
+        self.num_skipped = 0
+        self.num_calls   = 0
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+
+    ## forget the shadow state (e.g. after InitFurDescription)
+    def Invalidate(self):
+        self.shadow = {}
+        return None
+
+    ## read-back of an attribute: use shadow state if possible
+    def GetAttr(self, node, attr):
+        plug = "{0}.{1}".format(node, attr)
+        if plug not in self.shadow:
+            self.shadow[plug] = float(self.cmds.getAttr(plug))
+        return self.shadow[plug]
+
+    ## send changed attributes only
+    def SetAttributes(self, node, params_dict):
+        """
+        Sets attributes of a node, skipping unchanged ones.
+        node       : name of node (string)
+        params_dict: attribute values (dictionary)
+        Returns the number of attributes actually written.
+        """
+
+        changed = []
+        for key in params_dict:
+            plug  = "{0}.{1}".format(node, key)
+            value = float(params_dict[key])
+
+            if self.shadow.get(plug) == value:
+                self.num_skipped += 1
+                continue
+            changed.append( (plug, value) )
+
+        if len(changed) == 0:
+            return 0
+
+        ## single MEL string for all changes, no undo chunk per attribute
+        mel_cmd = "".join(['setAttr "{0}" {1!r};'.format(plug, value) for plug, value in changed])
+        self.mel.eval(mel_cmd)
+        self.num_calls += 1
+
+        for plug, value in changed:
+            self.shadow[plug] = value
+        self.num_written += len(changed)
+
+        return len(changed)
+
+    ## counterpart of Fur.SetFurDescription (+ CopyFurBaseColor2Material)
+    def SetFurDescription(self, params_dict):
+        """
+        Sets fur attribute values, and copies base color to material if exists.
+        params_dict: fur parameter values (dictionary)
+        """
+
+        self.SetAttributes(self.fur_desc, params_dict)
+
+        if self.material is not None:
+            colors_dict = {
+                "colorR": self.GetAttr(self.fur_desc, "BaseColorR"),
+                "colorG": self.GetAttr(self.fur_desc, "BaseColorG"),
+                "colorB": self.GetAttr(self.fur_desc, "BaseColorB"),
+            }
+            self.SetAttributes(self.material, colors_dict)
+
+        return None
+
+    ## summary for logging
+    def Stats(self):
+        return {
+            "written": self.num_written,
+            "skipped": self.num_skipped,
+            "calls"  : self.num_calls,
+        }
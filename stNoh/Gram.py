@@ -0,0 +1,218 @@
+###############################################################################
+## Gram matrices of feature layers: float32 upper triangles in one buffer
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import numpy as np
+from scipy.linalg import blas
+
+
+###############################################################################
+## layout of packed upper triangles
+###############################################################################
+_layouts = {} ## cache of layout per (channels of each layer)
+
+class _Layout:
+    def __init__(self, channels):
+        self.channels = tuple(channels)
+        self.sizes    = [C * (C+1) // 2 for C in self.channels]
+        self.offsets  = np.concatenate([[0], np.cumsum(self.sizes)]).astype(np.int64)
+
+        ## per layer: upper triangle (with diagonal) in row-major order, as in np.triu_indices,
+        ## indices in a Fortran-ordered CxC matrix & scale of entries (off-diagonal: sqrt(2))
+        self.rows, self.cols, self.index_F, self.scale = [], [], [], []
+        for C in self.channels:
+            rows, cols = np.triu_indices(C)
+            self.rows.append(rows)
+            self.cols.append(cols)
+            self.index_F.append(rows + cols * C)
+            self.scale.append(np.where(rows == cols, 1.0, np.sqrt(2.0)).astype(np.float32))
+        pass
+
+def _GetLayout(channels):
+    channels = tuple(channels)
+    if channels not in _layouts:
+        _layouts[channels] = _Layout(channels)
+    return _layouts[channels]
+
+
+###############################################################################
+## packed Gram matrices
+###############################################################################
+class PackedGram:
+    """
+    Gram matrices of feature layers as one contiguous float32 vector:
+    upper triangles (with diagonal) of all layers, off-diagonal entries scaled
+    by sqrt(2), so that the squared distance between two vectors is exactly
+    the sum of squared differences of the full matrices (cf. FeatureCompress).
+    It also behaves as a list of full matrices (len, [l], iteration),
+    e.g. for RefFeature.SaveGram.
+    """
+
+    def __init__(self, vec, channels):
+        self.vec    = vec
+        self.layout = _GetLayout(channels)
+        pass
+
+    def Layer(self, l):
+        """
+        Returns packed upper triangle of layer l (view).
+        """
+        return self.vec[self.layout.offsets[l]:self.layout.offsets[l+1]]
+
+    def Matrix(self, l):
+        """
+        Returns full symmetric Gram matrix of layer l (new array).
+        """
+        C = self.layout.channels[l]
+        rows, cols = self.layout.rows[l], self.layout.cols[l]
+
+        G_l = np.empty((C, C), dtype=self.vec.dtype)
+        G_l[rows, cols] = self.Layer(l) / self.layout.scale[l]
+        G_l[cols, rows] = G_l[rows, cols]
+        return G_l
+
+    def __len__(self):
+        return len(self.layout.channels)
+
+    def __getitem__(self, l):
+        if l < 0: l += len(self)
+        if not 0 <= l < len(self):
+            raise IndexError('Gram layer out of range:', l)
+        return self.Matrix(l)
+
+    def __iter__(self):
+        for l in range(len(self)):
+            yield self.Matrix(l)
+
+
+def Pack(G, dtype=np.float32):
+    """
+    Packs a list of symmetric Gram matrices (e.g. loaded from .npz).
+    """
+    if isinstance(G, PackedGram):
+        return G
+
+    layout = _GetLayout([G_l.shape[0] for G_l in G])
+    vec = np.empty(layout.offsets[-1], dtype=dtype)
+    for l, G_l in enumerate(G):
+        v = vec[layout.offsets[l]:layout.offsets[l+1]]
+        v[:] = G_l[layout.rows[l], layout.cols[l]]
+        v *= layout.scale[l]
+    return PackedGram(vec, layout.channels)
+
+def Vector(G):
+    """
+    Returns a vector whose squared distance is the cost between Gram features:
+    PackedGram -> its buffer (no copy), list of matrices -> packed (see Pack),
+    array -> flattened as it is (e.g. rows of a Jacobian product).
+    """
+    if isinstance(G, PackedGram):
+        return G.vec
+    if isinstance(G, np.ndarray):
+        return G.reshape(-1)
+    return Pack(G).vec
+
+def Cost(G_ref, G_dst):
+    """
+    Sum of squared differences of Gram matrices (accumulated in float64).
+    """
+    G_diff = np.subtract(Vector(G_ref), Vector(G_dst), dtype=np.float64)
+    return np.dot(G_diff, G_diff)
+
+
+###############################################################################
+## engine
+###############################################################################
+class GramEngine:
+    """
+    Computes Gram matrices F^T F / (2NM) * weight of feature layers directly
+    from activations [H,W,C] (channels_last) or [C,H,W] (channels_first),
+    without transposed copy, into one float32 buffer (see PackedGram).
+    weights    : weight per layer (None: 1.0)
+    data_format: 'channels_last' or 'channels_first'
+    kernel     : "syrk" symmetric rank-k update (upper triangle only, half of FLOPs)
+                 "gemm" full matrix product (may be faster on some BLAS)
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, weights=None, data_format='channels_last', kernel="syrk"):
+
+        if data_format not in {'channels_first', 'channels_last'}:
+            raise ValueError('Invalid data_format:', data_format)
+        if kernel not in {"syrk", "gemm"}:
+            raise ValueError('Invalid Gram kernel:', kernel)
+
+        self.weights     = weights
+        self.data_format = data_format
+        self.kernel      = kernel
+
+        ## CxC output of syrk per number of channels (reused)
+        self.scratch = {}
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def _Flat(self, x):
+        """
+        Returns (A, trans) for blas.ssyrk: F^T F = A A^T (trans=0) or A^T A (trans=1),
+        where A is a Fortran-ordered view of the activations (no copy).
+        """
+        if self.data_format == 'channels_last':
+            F = x.reshape(-1, x.shape[-1]) ## [M,C], C-ordered
+            return F.T, 0                  ## [C,M], F-ordered
+        F = x.reshape(x.shape[0], -1)      ## [C,M], C-ordered
+        return F.T, 1                      ## [M,C], F-ordered
+
+    def _Gram(self, x, alpha):
+        A, trans = self._Flat(np.asarray(x, dtype=np.float32))
+        C = A.shape[0] if trans == 0 else A.shape[1]
+
+        if self.kernel == "gemm":
+            G = np.dot(A, A.T) if trans == 0 else np.dot(A.T, A)
+            G *= alpha
+            return G
+
+        if C not in self.scratch:
+            self.scratch[C] = np.zeros((C, C), dtype=np.float32, order='F')
+        return blas.ssyrk(alpha, A, trans=trans, c=self.scratch[C], overwrite_c=1) ## upper triangle
+
+    def _Channels(self, activations):
+        return [x.shape[-1] if self.data_format == 'channels_last' else x.shape[0] for x in activations]
+
+    def Compute(self, activations, out=None):
+        """
+        activations: activations of each feature layer of a single image
+        out        : float32 buffer to be filled (None: allocated once per call)
+        Returns PackedGram.
+        """
+        channels = self._Channels(activations)
+        layout = _GetLayout(channels)
+        vec = np.empty(layout.offsets[-1], dtype=np.float32) if out is None else out
+
+        for l, x in enumerate(activations):
+            C = channels[l]
+            M = x.size // C
+            weight = 1.0 if self.weights is None else self.weights[l]
+            G_l = self._Gram(x, weight / (2. * C * M))
+
+            ## upper triangle of the (Fortran-ordered) matrix into the buffer;
+            ## a full matrix of "gemm" is symmetric, so its memory order does not matter
+            v = vec[layout.offsets[l]:layout.offsets[l+1]]
+            np.take(G_l.ravel(order='K'), layout.index_F[l], out=v)
+            v *= layout.scale[l]
+
+        return PackedGram(vec, channels)
+
+    def ComputeBatch(self, activations_batch):
+        """
+        activations_batch: activations [B,...] of each feature layer
+        Returns list of PackedGram (one buffer for all images).
+        """
+        B = activations_batch[0].shape[0]
+        layout = _GetLayout(self._Channels([x[0] for x in activations_batch]))
+
+        buffer = np.empty((B, layout.offsets[-1]), dtype=np.float32)
+        return [self.Compute([x[b] for x in activations_batch], out=buffer[b]) for b in range(B)]
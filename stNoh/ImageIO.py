@@ -0,0 +1,80 @@
+###############################################################################
+## lossless image exchange with the renderer
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import tempfile
+
+import numpy as np
+
+
+###############################################################################
+## scratch location for rendered frames
+###############################################################################
+_scratch_dir = os.environ.get("FUR_SCRATCH_DIR") ## None: see GetScratchDir()
+
+def SetScratchDir(folder_path):
+    """
+    Sets the directory for temporary frames, e.g. a RAM disk on Windows ("R:/"),
+    used by renderers created afterwards (None: default).
+    """
+    global _scratch_dir
+    _scratch_dir = folder_path
+    return None
+
+def GetScratchDir():
+    """
+    Returns the directory for temporary frames:
+    SetScratchDir() or environment variable FUR_SCRATCH_DIR, otherwise
+    RAM-backed /dev/shm when it exists (Linux), otherwise the system temporary
+    directory. The latter is on disk (e.g. %TEMP% on Windows): every frame is
+    still written and read through the file system, only the lossy codec is avoided.
+    """
+    if _scratch_dir is not None:
+        if not os.path.isdir(_scratch_dir):
+            os.makedirs(_scratch_dir)
+        return _scratch_dir
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+###############################################################################
+## uncompressed BMP reader (memory-mapped)
+###############################################################################
+def ReadBMP(bmp_path):
+    """
+    Reads an uncompressed 24/32-bit BMP file as BGR uint8 image (HxWx3).
+    The pixels are taken from a memory map without any codec, so the result
+    is identical to the frame buffer of the renderer.
+    bmp_path: filepath of .bmp file (string)
+    """
+
+    data = np.memmap(bmp_path, dtype=np.uint8, mode='r')
+
+    if data[0] != ord('B') or data[1] != ord('M'):
+        raise ValueError('Not a BMP file:', bmp_path)
+
+    offset      = int(data[10:14].view('<u4')[0])
+    width       = int(data[18:22].view('<i4')[0])
+    height      = int(data[22:26].view('<i4')[0])
+    bpp         = int(data[28:30].view('<u2')[0])
+    compression = int(data[30:34].view('<u4')[0])
+
+    if bpp not in {24, 32} or compression not in {0, 3}:
+        raise ValueError('Unsupported BMP format (bpp={0}, compression={1})'.format(bpp, compression))
+
+    ## rows are padded to 4-byte boundary
+    channels  = bpp // 8
+    row_bytes = (width * channels + 3) & ~3
+    rows = np.ndarray((abs(height), row_bytes), np.uint8, data, offset)
+    img  = rows[:, :width * channels].reshape(abs(height), width, channels)[:, :, :3]
+
+    ## positive height means bottom-up rows
+    if height > 0:
+        img = img[::-1]
+
+    ## copy out from the map: the file is overwritten by the next render
+    img_cv2 = np.ascontiguousarray(img)
+    del rows, data
+    return img_cv2
@@ -0,0 +1,274 @@
+###############################################################################
+## progress & preview events of the search modules (GUI-free by default)
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import json
+import time
+import threading
+
+
+###############################################################################
+## interface (no-op)
+###############################################################################
+class NullProgress:
+    """
+    Receives progress events of an optimization loop and does nothing.
+    Events:
+      Begin(max_value, title)   : start of a loop
+      Step(value, cost, text)   : after an evaluation
+      Show(winTitle, img, text) : preview image (e.g. "reference", "find_step", "target")
+      End()                     : end of a loop
+    Cancellation is a flag (IsCancelled()), set by Cancel() from any thread
+    or by the sink itself; the loops check it after every evaluation.
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self):
+        self.cancelled = threading.Event()
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def Begin(self, max_value, title=""):
+        return None
+
+    def Step(self, value, cost=None, text=""):
+        return None
+
+    def Show(self, winTitle, img_cv2, text=""):
+        return None
+
+    def End(self):
+        return None
+
+    def Cancel(self):
+        self.cancelled.set()
+        return None
+
+    def IsCancelled(self):
+        return self.cancelled.is_set()
+
+
+###############################################################################
+## Maya progressWindow
+###############################################################################
+class MayaProgress(NullProgress):
+    """
+    Progress bar of Maya (interruptable by ESC).
+    The window is queried for cancellation at most every interval_s seconds.
+    interval_s: interval of progressWindow edit/query
+    """
+
+    def __init__(self, interval_s=0.5):
+        NullProgress.__init__(self)
+        import maya.cmds as cmds
+        self.cmds = cmds
+
+        self.interval_s = interval_s
+        self.t_last     = 0.0
+        pass
+
+    def Begin(self, max_value, title=""):
+        self.cancelled.clear()
+        self.cmds.progressWindow(isInterruptable=1, minValue=0, maxValue=max_value, title=title if title else "Progress")
+        self.t_last = time.perf_counter()
+        return None
+
+    def Step(self, value, cost=None, text=""):
+        t_now = time.perf_counter()
+        if t_now - self.t_last < self.interval_s:
+            return None
+        self.t_last = t_now
+
+        self.cmds.progressWindow(edit=True, progress=value)
+        if self.cmds.progressWindow(query=1, isCancelled=1):
+            self.cancelled.set()
+        return None
+
+    def End(self):
+        self.cmds.progressWindow(endProgress=1)
+        return None
+
+
+###############################################################################
+## OpenCV preview windows
+###############################################################################
+class PreviewProgress(NullProgress):
+    """
+    Shows images with text by cv2.highgui, at most max_fps per window.
+    An image skipped by throttling is kept and shown at the next chance
+    (or at End()), so that each window ends with its latest image.
+    max_fps: maximum number of redraws per second and window
+    """
+
+    def __init__(self, max_fps=10.0):
+        NullProgress.__init__(self)
+        import cv2
+        self.cv2 = cv2
+
+        self.interval_s = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.t_last     = {} ## winTitle -> time of last redraw
+        self.deferred   = {} ## winTitle -> (img_cv2, text) not shown yet
+        pass
+
+    def _Draw(self, winTitle, img_cv2, text):
+        img_cv2 = img_cv2.copy() ## do not draw text on the caller's image
+
+        y0, dy = 30, 30
+        for i, line in enumerate(text.split('\n')):
+            y = y0 + i * dy
+            self.cv2.putText(img_cv2, line, (10, y), self.cv2.FONT_HERSHEY_COMPLEX_SMALL, 1, (0,255,0), 2)
+
+        self.cv2.imshow(winTitle, img_cv2)
+        self.t_last[winTitle] = time.perf_counter()
+        return True
+
+    def _Flush(self, force=False):
+        drawn = False
+        t_now = time.perf_counter()
+        for winTitle in list(self.deferred.keys()):
+            if force or t_now - self.t_last.get(winTitle, 0.0) >= self.interval_s:
+                img_cv2, text = self.deferred.pop(winTitle)
+                drawn = self._Draw(winTitle, img_cv2, text) or drawn
+
+        if drawn:
+            self.cv2.waitKey(1)
+        return None
+
+    def Show(self, winTitle, img_cv2, text=""):
+        if time.perf_counter() - self.t_last.get(winTitle, 0.0) >= self.interval_s:
+            self.deferred.pop(winTitle, None)
+            self._Draw(winTitle, img_cv2, text)
+            self.cv2.waitKey(1)
+        else:
+            self.deferred[winTitle] = (img_cv2.copy(), text)
+        return None
+
+    def Step(self, value, cost=None, text=""):
+        self._Flush()
+        return None
+
+    def End(self):
+        self._Flush(force=True)
+        return None
+
+
+###############################################################################
+## log (JSON lines)
+###############################################################################
+class LogProgress(NullProgress):
+    """
+    Writes events as JSON lines (images are not written: only window title).
+    log_path   : filepath of JSON lines (None: print only)
+    echo       : print a line per event
+    cancel_path: the loop is cancelled when this file exists
+                 (checked at most every interval_s seconds), e.g. for headless runs
+    """
+
+    def __init__(self, log_path=None, echo=False, cancel_path=None, interval_s=1.0):
+        NullProgress.__init__(self)
+        self.log_path    = log_path
+        self.echo        = echo
+        self.cancel_path = cancel_path
+        self.interval_s  = interval_s
+
+        self.title     = ""
+        self.max_value = None
+        self.t_start   = time.perf_counter()
+        self.t_check   = 0.0
+        pass
+
+    def _Write(self, event, **fields):
+        record = {"t": round(time.perf_counter() - self.t_start, 6), "event": event, "title": self.title}
+        record.update(fields)
+
+        line = json.dumps(record)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as f:
+                f.write(line + "\n")
+        if self.echo:
+            print(line)
+        return None
+
+    def Begin(self, max_value, title=""):
+        self.cancelled.clear()
+        self.title     = title
+        self.max_value = max_value
+        self.t_start   = time.perf_counter()
+        return self._Write("begin", max_value=max_value)
+
+    def Step(self, value, cost=None, text=""):
+        self._Write("step", value=value, max_value=self.max_value,
+                    cost=None if cost is None else float(cost), text=text)
+
+        t_now = time.perf_counter()
+        if self.cancel_path is not None and t_now - self.t_check >= self.interval_s:
+            self.t_check = t_now
+            if os.path.isfile(self.cancel_path):
+                self.cancelled.set()
+        return None
+
+    def Show(self, winTitle, img_cv2, text=""):
+        return self._Write("show", window=winTitle, text=text)
+
+    def End(self):
+        return self._Write("end", cancelled=self.IsCancelled())
+
+
+###############################################################################
+## several sinks
+###############################################################################
+class CompositeProgress(NullProgress):
+    """
+    Forwards events to all sinks; cancelled when any of them is cancelled.
+    """
+
+    def __init__(self, sinks):
+        NullProgress.__init__(self)
+        self.sinks = list(sinks)
+        pass
+
+    def Begin(self, max_value, title=""):
+        self.cancelled.clear()
+        for sink in self.sinks:
+            sink.Begin(max_value, title)
+        return None
+
+    def Step(self, value, cost=None, text=""):
+        for sink in self.sinks:
+            sink.Step(value, cost, text)
+        return None
+
+    def Show(self, winTitle, img_cv2, text=""):
+        for sink in self.sinks:
+            sink.Show(winTitle, img_cv2, text)
+        return None
+
+    def End(self):
+        for sink in self.sinks:
+            sink.End()
+        return None
+
+    def IsCancelled(self):
+        return self.cancelled.is_set() or any([sink.IsCancelled() for sink in self.sinks])
+
+
+###############################################################################
+## default sink
+###############################################################################
+def Default():
+    """
+    Maya progress bar + preview windows in Maya GUI (the original behavior,
+    throttled), no-op otherwise (mayapy, plain Python).
+    """
+    try:
+        import maya.cmds as cmds
+        if not cmds.about(batch=True):
+            return CompositeProgress([MayaProgress(), PreviewProgress()])
+    except Exception:
+        pass
+    return NullProgress()
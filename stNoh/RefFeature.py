@@ -0,0 +1,82 @@
+###############################################################################
+## store of perceptual features for reference images
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import glob
+import shutil
+
+import numpy as np
+
+from stNoh import RenderCache
+from stNoh import Gram
+
+
+###############################################################################
+## identifier of feature function
+###############################################################################
+def FeatureId(get_feature_func):
+    """
+    Returns identifier of feature function.
+    Feature functions may define "feature_id" (e.g. name + layers + weights);
+    otherwise the function name is used.
+    """
+    return getattr(get_feature_func, "feature_id", getattr(get_feature_func, "__name__", "feature"))
+
+
+###############################################################################
+## .npz store next to the reference image
+###############################################################################
+def StorePath(img_ref_path, img_ref_cv2, get_feature_func):
+    """
+    Returns filepath of Gram matrices of the reference image:
+    "<reference>.gram_<hash>.npz", where the hash is made from image content
+    and feature function id.
+    """
+    key = RenderCache.HashString(RenderCache.HashImage(img_ref_cv2) + FeatureId(get_feature_func))
+    return "{0}.gram_{1}.npz".format(os.path.splitext(img_ref_path)[0], key[:16])
+
+def SaveGram(store_path, G):
+    with open(store_path, 'wb') as f:
+        np.savez(f, **dict([("G_{0}".format(l), G_l) for l, G_l in enumerate(G)]))
+    return None
+
+def LoadGram(store_path):
+    with np.load(store_path) as npz:
+        G = [npz["G_{0}".format(l)] for l in range(len(npz.files))]
+    return Gram.Pack(G) ## packed once: cost evaluation without concatenation
+
+def LoadReferenceGram(img_ref_path, get_feature_func):
+    """
+    Returns (Gram matrices, image) of the reference image.
+    The features are loaded from the store if exists, otherwise computed and saved.
+    img_ref_path    : filepath of the reference image (string)
+    get_feature_func: img_cv2 -> (list of Gram matrices, elapsed time)
+    """
+    import cv2
+
+    img_ref_cv2 = cv2.imread(img_ref_path)
+    store_path  = StorePath(img_ref_path, img_ref_cv2, get_feature_func)
+
+    if os.path.isfile(store_path):
+        try:
+            return LoadGram(store_path), img_ref_cv2
+        except (IOError, OSError, ValueError, KeyError):
+            pass ## broken store: compute again
+
+    G_ref, _ = get_feature_func(img_ref_cv2)
+    SaveGram(store_path, G_ref)
+    return G_ref, img_ref_cv2
+
+def CopyStore(img_src_path, img_dst_path):
+    """
+    Copies all stored features of a reference image along with the image
+    (e.g. to "_ref_image.jpg" in the working folder).
+    """
+    stem_src = os.path.splitext(img_src_path)[0]
+    stem_dst = os.path.splitext(img_dst_path)[0]
+
+    for store_src in glob.glob(glob.escape(stem_src) + ".gram_*.npz"):
+        store_dst = stem_dst + store_src[len(stem_src):]
+        shutil.copy2(store_src, store_dst)
+    return None
@@ -0,0 +1,200 @@
+###############################################################################
+## common interface for fur renderers (Maya or offline stand-in)
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+from datetime import datetime
+
+from stNoh import FurParam
+from stNoh import Timing
+
+
+###############################################################################
+## base class of render backend
+###############################################################################
+class RenderBackend:
+    """
+    Protocol for fur renderers used by the search routines.
+    A backend only has to implement SetParams() and RenderImage();
+    RenderFur() is the "render_and_load" callable given to the optimizers.
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self):
+
+        ## default image size as QHD
+        self.imageW_px  = 960
+        self.imageH_px  = 540
+        self.imgFileExt = "jpg" ## default file extension for rendered image
+
+        ## folder given to Init() (None: not initialized)
+        self.folder_path = None
+
+        ## False: CSV files are left to an ArchiveWriter
+        self.exportCSV = True
+
+        ## ArchiveWriter for images/CSV files (None: written synchronously)
+        self.archiver = None
+
+        ## RenderCache for rendered images (None: always render)
+        self.cache        = None
+        self.params_state = {} ## all parameters assigned so far
+
+        self.ResetTimings()
+        pass
+
+    ############################################################
+    ## interface: should be implemented by derived class
+    ############################################################
+
+    ## assign fur parameters (dictionary of attribute values)
+    def SetParams(self, params_dict):
+        raise NotImplementedError
+
+    ## render current parameters as image in memory (BGR, uint8, HxWx3)
+    def RenderImage(self):
+        raise NotImplementedError
+
+    ############################################################
+    ## member functions
+    ############################################################
+
+    ## change image size & extension
+    def SetImageFormat(self, imageW_px, imageH_px, imgFileExt="jpg"):
+        self.imageW_px  = imageW_px
+        self.imageH_px  = imageH_px
+        self.imgFileExt = imgFileExt
+        return None
+
+    ## initialize renderer setting
+    def Init(self, folder_path):
+        self.folder_path = folder_path
+        return None
+
+    ## write pending archival files and stop the ArchiveWriter
+    def Close(self):
+        if self.archiver is not None:
+            self.archiver.Close()
+            self.archiver = None
+        return None
+
+    ## hash of everything but fur parameters which changes the image
+    def SceneKey(self):
+        return "{0}_{1}x{2}".format(self.__class__.__name__, self.imageW_px, self.imageH_px)
+
+    ## state besides the parameters of a render (e.g. sent to render workers)
+    def State(self):
+        return {
+            "params_state": dict(self.params_state),
+            "image_format": (self.imageW_px, self.imageH_px, self.imgFileExt),
+            "folder_path" : self.folder_path,
+            "scene_key"   : self.SceneKey(),
+        }
+
+    ## take over the state of another renderer of the same scene
+    def SetState(self, state):
+        """
+        state: State() of the other renderer (e.g. of the main process)
+        Raises RuntimeError when the scene of this renderer differs.
+        """
+        image_format = (self.imageW_px, self.imageH_px, self.imgFileExt)
+        if image_format != state["image_format"]:
+            self.SetImageFormat(*state["image_format"])
+
+        ## only changed parameters (e.g. non-searched ones assigned by the caller)
+        params_dict = dict([(key, val) for key, val in state["params_state"].items() if self.params_state.get(key) != val])
+        if len(params_dict) > 0:
+            self.SetParams(params_dict)
+            self.params_state.update(params_dict)
+
+        ## render settings (and scene key) follow the image format
+        if state["folder_path"] is not None and (image_format != state["image_format"] or self.folder_path != state["folder_path"]):
+            self.Init(state["folder_path"])
+
+        if self.SceneKey() != state["scene_key"]:
+            raise RuntimeError("Scene of the renderer differs: {0} != {1}".format(self.SceneKey(), state["scene_key"]))
+        return None
+
+    ## wait until all archival files are written
+    def Flush(self):
+        if self.archiver is not None:
+            self.archiver.Flush()
+        return None
+
+    ## look up the render cache with the current parameter state
+    def LookupCache(self):
+        """
+        Returns (cache key, cached image or None).
+        """
+        if self.cache is None:
+            return None, None
+
+        cache_key = self.cache.RenderKey(self.params_state, self.SceneKey())
+        entry = self.cache.Get(cache_key)
+        return cache_key, (None if entry is None else entry["image"])
+
+    ## accumulated timings
+    def ResetTimings(self):
+        self.num_renders        = 0
+        self.t_setparam_elapsed = datetime.min - datetime.min
+        self.t_render_elapsed   = datetime.min - datetime.min
+        self.t_imageio_elapsed  = datetime.min - datetime.min
+        return None
+
+    def Timings(self):
+        return {
+            "renders" : self.num_renders,
+            "setparam": self.t_setparam_elapsed,
+            "render"  : self.t_render_elapsed,
+            "imageio" : self.t_imageio_elapsed,
+        }
+
+    ## render image & export (BGR format)
+    def RenderFur(self, params_dict, img_path, exportCSV=True):
+
+        t_setparam_start = datetime.now()
+        with Timing.Span("setparam"):
+            self.SetParams(params_dict)
+            self.params_state.update(params_dict)
+        self.t_setparam_elapsed += datetime.now() - t_setparam_start
+
+        t_render_start = datetime.now()
+        with Timing.Span("render"):
+            cache_key, img_cv2 = self.LookupCache()
+            if img_cv2 is None:
+                img_cv2 = self.RenderImage()
+                self.num_renders += 1
+                if cache_key is not None:
+                    self.cache.Put(cache_key, image=img_cv2)
+        t_render_elapsed = datetime.now() - t_render_start
+
+        t_imageio_start = datetime.now()
+
+        exportCSV = exportCSV and self.exportCSV
+
+        with Timing.Span("imageio"):
+            if img_path is None:
+                pass
+
+            ## archive in background
+            elif self.archiver is not None:
+                self.archiver.Submit(img_cv2, params_dict if exportCSV else None, img_path)
+
+            else:
+                ## export parameter as CSV file if needed
+                if exportCSV:
+                    csv_file = img_path + ".csv"
+                    FurParam.dict2csv(params_dict, csv_file)
+
+                ## keep the same file name as Maya's render window
+                import cv2
+                cv2.imwrite(img_path + "_tmp." + self.imgFileExt, img_cv2)
+
+        t_imageio_elapsed = datetime.now() - t_imageio_start
+
+        ## accumulate elapsed time
+        self.t_render_elapsed  += t_render_elapsed
+        self.t_imageio_elapsed += t_imageio_elapsed
+
+        return img_cv2, t_render_elapsed, t_imageio_elapsed
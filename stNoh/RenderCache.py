@@ -0,0 +1,264 @@
+###############################################################################
+## persistent cache of rendered images and perceptual features
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import json
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from stNoh import FurParam
+from stNoh import Gram
+
+
+###############################################################################
+## subroutine: content hash
+###############################################################################
+def HashString(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def HashImage(img_cv2):
+    h = hashlib.sha1()
+    h.update(str(img_cv2.shape).encode('utf-8'))
+    h.update(np.ascontiguousarray(img_cv2).data)
+    return h.hexdigest()
+
+def HashFile(file_path, chunk_bytes=1024**2):
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+###############################################################################
+## disk-backed LRU cache
+###############################################################################
+class RenderCache:
+    """
+    Content-addressed cache on disk (one .npz file per entry).
+    Least recently used entries are evicted when total size exceeds the cap.
+    cache_dir : folder of cache files (string)
+    resolution: quantization step of parameters in normalized space [0.0:1.0]
+    max_bytes : size cap of the cache folder
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, cache_dir, resolution=1e-4, max_bytes=2*1024**3):
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.cache_dir  = cache_dir
+        self.resolution = resolution
+        self.max_bytes  = max_bytes
+
+        ## index: key -> [size, last access]
+        self.index = {}
+        for file in os.listdir(cache_dir):
+            if ".npz" == os.path.splitext(file)[1]:
+                st = os.stat(os.path.join(cache_dir, file))
+                self.index[os.path.splitext(file)[0]] = [st.st_size, st.st_mtime]
+        self.total_bytes = sum([v[0] for v in self.index.values()])
+
+        ## statistics
+        self.hits      = {"render": 0, "feature": 0}
+        self.misses    = {"render": 0, "feature": 0}
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+        pass
+
+    ############################################################
+    ## keys
+    ############################################################
+    def RenderKey(self, params_dict, scene_key):
+        """
+        Returns cache key of a render.
+        params_dict: full fur parameters of the render (dictionary)
+        scene_key  : hash of scene/camera/render settings (string)
+        """
+        quantized = {}
+        for key in params_dict:
+            val01 = FurParam.ConvertFurParam(key, float(params_dict[key]))
+            quantized[key] = int(round(val01 / self.resolution))
+
+        text = json.dumps([scene_key, self.resolution, sorted(quantized.items())])
+        return "render_" + HashString(text)
+
+    def FeatureKey(self, img_cv2, feature_id):
+        return "feature_" + HashString(feature_id + HashImage(img_cv2))
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def _Path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def Get(self, key, kind="render"):
+        """
+        Returns dictionary of arrays for key, or None.
+        """
+        with self.lock:
+            if key not in self.index:
+                self.misses[kind] += 1
+                return None
+
+        try:
+            with np.load(self._Path(key)) as npz:
+                entry = dict([(name, npz[name]) for name in npz.files])
+        except (IOError, OSError, ValueError):
+            with self.lock:
+                self._Drop(key)
+                self.misses[kind] += 1
+            return None
+
+        ## touch for LRU
+        with self.lock:
+            self.hits[kind] += 1
+            if key in self.index:
+                self.index[key][1] = time.time()
+        try:
+            os.utime(self._Path(key), None)
+        except OSError:
+            pass
+
+        return entry
+
+    def Put(self, key, **arrays):
+        """
+        Stores arrays (keyword arguments) for key.
+        """
+        path = self._Path(key)
+        path_tmp = path + ".{0}.tmp".format(threading.current_thread().ident)
+
+        with open(path_tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path_tmp, path) ## atomic on the same volume
+
+        size = os.path.getsize(path)
+        with self.lock:
+            if key in self.index:
+                self.total_bytes -= self.index[key][0]
+            self.index[key] = [size, time.time()]
+            self.total_bytes += size
+            self._Evict()
+        return None
+
+    def _Drop(self, key):
+        size, _ = self.index.pop(key)
+        self.total_bytes -= size
+        try:
+            os.remove(self._Path(key))
+        except OSError:
+            pass
+        return None
+
+    def _Evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return None
+
+        for key, _ in sorted(self.index.items(), key=lambda kv: kv[1][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._Drop(key)
+            self.evictions += 1
+        return None
+
+    ############################################################
+    ## statistics
+    ############################################################
+    def Stats(self):
+        return {
+            "render_hits"   : self.hits["render"],
+            "render_misses" : self.misses["render"],
+            "feature_hits"  : self.hits["feature"],
+            "feature_misses": self.misses["feature"],
+            "evictions"     : self.evictions,
+            "entries"       : len(self.index),
+            "bytes"         : self.total_bytes,
+        }
+
+    def WriteStats(self, txt):
+        """
+        Writes hit/miss statistics to opened text file (e.g. elapsed.txt).
+        """
+        stats = self.Stats()
+        txt.write("render cache   = {0} hits / {1} misses\n".format(stats["render_hits"], stats["render_misses"]))
+        txt.write("feature cache  = {0} hits / {1} misses\n".format(stats["feature_hits"], stats["feature_misses"]))
+        txt.write("cache entries  = {0} ({1} bytes, {2} evicted)\n".format(stats["entries"], stats["bytes"], stats["evictions"]))
+        return None
+
+
+###############################################################################
+## wrapper of feature function
+###############################################################################
+def CachedFeature(get_feature_func, cache, feature_id=None):
+    """
+    Returns get_feature_func whose Gram matrices are cached by image content.
+    Gram.PackedGram is stored as its buffer & channels, and returned as it is;
+    entries of full matrices (list) are returned as a list.
+    get_feature_func.batch (if any) is wrapped too: only uncached images go through it.
+    get_feature_func: img_cv2 -> (Gram.PackedGram or list of Gram matrices, elapsed time)
+    cache           : RenderCache
+    feature_id      : identifier of the feature function (layers, weights, ...)
+    """
+    if feature_id is None:
+        feature_id = getattr(get_feature_func, "feature_id", getattr(get_feature_func, "__name__", "feature"))
+
+    def load_feature(entry):
+        if "vec" in entry:
+            return Gram.PackedGram(entry["vec"], [int(C) for C in entry["channels"]])
+        return [entry["G_{0}".format(l)] for l in range(len(entry))]
+
+    def store_feature(key, G):
+        if isinstance(G, Gram.PackedGram):
+            cache.Put(key, vec=G.vec, channels=np.array(G.layout.channels))
+        else:
+            cache.Put(key, **dict([("G_{0}".format(l), G_l) for l, G_l in enumerate(G)]))
+
+    def get_feature_cached(img_cv2):
+        t_feature_start = datetime.now()
+
+        key   = cache.FeatureKey(img_cv2, feature_id)
+        entry = cache.Get(key, "feature")
+        if entry is not None:
+            return load_feature(entry), datetime.now() - t_feature_start
+
+        G, t_feature = get_feature_func(img_cv2)
+        store_feature(key, G)
+        return G, t_feature
+
+    def get_feature_cached_batch(imgs_cv2):
+        t_feature_start = datetime.now()
+
+        ## cached images are loaded, the others go through one batched call
+        keys    = [cache.FeatureKey(img_cv2, feature_id) for img_cv2 in imgs_cv2]
+        G_batch = [None] * len(imgs_cv2)
+        missing = []
+        for n, key in enumerate(keys):
+            entry = cache.Get(key, "feature")
+            if entry is None:
+                missing.append(n)
+            else:
+                G_batch[n] = load_feature(entry)
+
+        if missing:
+            G_missing, _ = get_feature_func.batch([imgs_cv2[n] for n in missing])
+            for n, G in zip(missing, G_missing):
+                store_feature(keys[n], G)
+                G_batch[n] = G
+
+        return G_batch, datetime.now() - t_feature_start
+
+    get_feature_cached.__name__   = getattr(get_feature_func, "__name__", "feature")
+    get_feature_cached.feature_id = feature_id
+    if hasattr(get_feature_func, "batch"):
+        get_feature_cached.batch = get_feature_cached_batch
+    return get_feature_cached
@@ -0,0 +1,312 @@
+###############################################################################
+## pool of render worker processes
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from stNoh import Timing
+
+
+###############################################################################
+## worker process side
+###############################################################################
+_backend = None ## render backend of this worker process
+_frames  = None ## SharedFrames.FrameRing to return images (None: pickled)
+_state   = None ## renderer state applied last (see RenderBackend.State)
+
+def _InitWorker(backend_factory, factory_args, frames=None):
+    """
+    Creates the render backend once per worker (e.g. loads its own scene copy).
+    """
+    global _backend, _frames
+    _backend = backend_factory(*factory_args)
+    _frames  = frames
+    return None
+
+def _RenderJob(index, params_dict, img_path, state=None):
+    global _state
+
+    ## image format, folder & parameters of the main renderer
+    if state is not None and state != _state:
+        _backend.SetState(state)
+        _state = state
+
+    img_cv2, t_render, t_imageio = _backend.RenderFur(params_dict, img_path, img_path is not None)
+    if img_path is not None:
+        _backend.Flush() ## archival files are complete when the job is
+
+    ## return slot index of shared frame instead of pixels
+    if _frames is not None and img_cv2.shape == _frames.shape:
+        return index, _frames.Put(img_cv2, publish=False), t_render, t_imageio
+
+    return index, img_cv2, t_render, t_imageio
+
+
+###############################################################################
+## render worker pool
+###############################################################################
+class RenderPool:
+    """
+    Renders independent parameter sets on separate worker processes.
+    backend_factory: picklable callable returning a RenderBackend in each worker
+                     (e.g. stNoh.FakeFur.FakeFurRenderer)
+    factory_args   : arguments of backend_factory (tuple)
+    num_workers    : number of worker processes
+    max_retry      : number of retries of a failed job
+    frames         : SharedFrames.FrameRing (None: images are pickled);
+                     an image returned by NextResult() is a view of its slot,
+                     valid until the next call of NextResult();
+                     it needs more slots than num_workers
+    renderer       : RenderBackend of this process (None: workers keep their own state);
+                     its State() at Submit() is applied before the job, so that workers
+                     render with its image size, folder and non-searched parameters
+    """
+
+    ############################################################
+    ## ctor / dtor
+    ############################################################
+    def __init__(self, backend_factory, factory_args=(), num_workers=4, max_retry=2, frames=None, renderer=None):
+        self.backend_factory = backend_factory
+        self.factory_args    = factory_args
+        self.num_workers     = num_workers
+        self.max_retry       = max_retry
+        self.renderer        = renderer
+
+        ## shared frame ring & slot of the last result
+        self.frames    = frames
+        self.slot_held = None
+
+        self.num_jobs    = 0
+        self.num_retries = 0
+
+        ## future -> [index, params_dict, img_path, renderer state, retries]
+        self.pending  = {}
+        self.executor = None
+        self._Start()
+        pass
+
+    def __del__(self):
+        self.Close()
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def _Start(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            initializer=_InitWorker,
+            initargs=(self.backend_factory, self.factory_args, self.frames))
+        return None
+
+    ## image of the result: pixels, or view of shared frame slot
+    def _Result(self, result):
+        index, img_cv2, t_render, t_imageio = result
+
+        ## spans of worker process (not seen by the active timer)
+        Timing.Add("render" , t_render)
+        Timing.Add("imageio", t_imageio)
+
+        if isinstance(img_cv2, int):
+            self._ReleaseSlot()
+            self.slot_held = img_cv2
+            img_cv2 = self.frames.Frame(img_cv2)
+        return index, img_cv2, t_render, t_imageio
+
+    def _ReleaseSlot(self):
+        if self.slot_held is not None:
+            self.frames.Release(self.slot_held)
+            self.slot_held = None
+        return None
+
+    def Close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        return None
+
+    def Submit(self, index, params_dict, img_path):
+        """
+        Queues a single job; its result is returned by NextResult().
+        index      : identifier of the job (e.g. iteration number)
+        params_dict: fur parameters (dictionary)
+        img_path   : filepath to save the image (None: no file)
+        """
+        state  = None if self.renderer is None else self.renderer.State()
+        future = self.executor.submit(_RenderJob, index, params_dict, img_path, state)
+        self.pending[future] = [index, params_dict, img_path, state, 0]
+        self.num_jobs += 1
+        return None
+
+    def NumPending(self):
+        return len(self.pending)
+
+    def NextResult(self):
+        """
+        Waits for the first finished job (retried when it failed).
+        returns: (index of job, img_cv2, t_render, t_imageio)
+        """
+        while len(self.pending) > 0:
+            done, _ = wait(list(self.pending.keys()), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                job = self.pending.pop(future)
+                try:
+                    return self._Result(future.result())
+                except Exception as e:
+                    if job[4] >= self.max_retry:
+                        raise
+                    traceback.print_exc()
+                    self.num_retries += 1
+                    job[4] += 1
+
+                    ## a crashed worker breaks the whole pool: restart & resubmit all pending jobs
+                    jobs = [job]
+                    if isinstance(e, BrokenProcessPool):
+                        jobs += list(self.pending.values())
+                        self.pending = {}
+                        self.executor.shutdown(wait=True)
+
+                        ## slots of the dead worker & of uncollected results never come back
+                        if self.frames is not None:
+                            self.frames.Reset([] if self.slot_held is None else [self.slot_held])
+                        self._Start()
+
+                    for job in jobs:
+                        self.pending[self.executor.submit(_RenderJob, *job[:4])] = job
+                    break
+
+        raise RuntimeError("No pending render job")
+
+    def NextResults(self):
+        """
+        Waits for the first finished job, and collects the others finished by then
+        (e.g. for batched feature extraction).
+        returns: list of (index of job, img_cv2, t_render, t_imageio)
+        """
+        results = [self.NextResult()]
+        while any([future.done() for future in self.pending]):
+            ## frame slot of the previous result is released by the next one
+            if self.frames is not None:
+                index, img_cv2, t_render, t_imageio = results[-1]
+                results[-1] = (index, img_cv2.copy(), t_render, t_imageio)
+            results.append(self.NextResult())
+        return results
+
+    ## drop pending jobs (e.g. on abort)
+    def Cancel(self):
+        for future in self.pending:
+            if future.cancel():
+                continue
+
+            ## running job: wait and free its frame slot
+            try:
+                index, img_cv2, _, _ = future.result()
+                if isinstance(img_cv2, int):
+                    self.frames.Release(img_cv2)
+            except Exception:
+                pass
+        self.pending = {}
+        if self.frames is not None:
+            self._ReleaseSlot()
+        return None
+
+    def RenderAll(self, jobs):
+        """
+        Renders all jobs and yields results in order of completion.
+        jobs   : list of (params_dict, img_path); img_path can be None
+        yields : (index of job, img_cv2, t_render, t_imageio)
+        Jobs not collected when the generator is closed (e.g. the consumer raised)
+        are cancelled, so that their indices do not collide with the next call.
+        """
+        for index, (params_dict, img_path) in enumerate(jobs):
+            self.Submit(index, params_dict, img_path)
+
+        try:
+            for _ in range(len(jobs)):
+                yield self.NextResult()
+        finally:
+            if len(self.pending) > 0:
+                self.Cancel()
+        return
+
+    def Stats(self):
+        return {
+            "workers": self.num_workers,
+            "jobs"   : self.num_jobs,
+            "retries": self.num_retries,
+        }
+
+
+###############################################################################
+## in-process fallback
+###############################################################################
+class SerialPool:
+    """
+    Same interface as RenderPool, but renders one job at a time in this process
+    (e.g. by Misc.FurRenderer.RenderFur of the running Maya session).
+    render_and_load: (params_dict, img_path) -> (img_cv2, t_render, t_imageio)
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, render_and_load):
+        self.render_and_load = render_and_load
+        self.num_workers     = 1
+
+        self.num_jobs    = 0
+        self.num_retries = 0
+
+        self.pending = [] ## [index, params_dict, img_path]
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def Close(self):
+        return None
+
+    def Submit(self, index, params_dict, img_path):
+        self.pending.append( [index, params_dict, img_path] )
+        self.num_jobs += 1
+        return None
+
+    def NumPending(self):
+        return len(self.pending)
+
+    ## renders the oldest job
+    def NextResult(self):
+        if len(self.pending) == 0:
+            raise RuntimeError("No pending render job")
+
+        index, params_dict, img_path = self.pending.pop(0)
+        img_cv2, t_render, t_imageio = self.render_and_load(params_dict, img_path)
+        return index, img_cv2, t_render, t_imageio
+
+    def NextResults(self):
+        return [self.NextResult()]
+
+    def Cancel(self):
+        self.pending = []
+        return None
+
+    def RenderAll(self, jobs):
+        for index, (params_dict, img_path) in enumerate(jobs):
+            self.Submit(index, params_dict, img_path)
+
+        try:
+            for _ in range(len(jobs)):
+                yield self.NextResult()
+        finally:
+            self.Cancel()
+        return
+
+    def Stats(self):
+        return {
+            "workers": self.num_workers,
+            "jobs"   : self.num_jobs,
+            "retries": self.num_retries,
+        }
@@ -0,0 +1,294 @@
+###############################################################################
+## render worker: serves a render backend over local IPC
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import threading
+import traceback
+import queue
+from datetime import datetime
+from multiprocessing.connection import Listener, Client
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from stNoh import RenderBackend
+from stNoh import SharedFrames
+from stNoh import Timing
+
+
+###############################################################################
+## protocol
+###############################################################################
+## request (tuple, pickled by multiprocessing.connection):
+##   ("render", params_dict, img_path, exportCSV) -> (shm_name, shape, dtype, t_render, t_imageio, rendered)
+##   ("params", params_dict)                      -> None
+##   ("init", folder_path)                        -> None
+##   ("format", imageW_px, imageH_px, imgFileExt) -> None
+##   ("scene_key",)                               -> scene key (string)
+##   ("ping",)                                    -> "pong"
+##   ("close",)    : closes this connection
+##   ("shutdown",) : stops the worker
+## reply: ("ok", result) or ("error", traceback)
+##
+## pixels are not pickled: they are written into a shared memory block of
+## the connection, which the client maps once and reads after each reply.
+
+DEFAULT_AUTHKEY = b"MayaFurParameter"
+
+
+###############################################################################
+## server (worker process side)
+###############################################################################
+class RenderServer:
+    """
+    Renders requests of local clients with a single backend.
+    Connections are received on background threads and queued, and all
+    requests are handled on the thread calling Serve() (Maya's main thread).
+    backend: RenderBackend (e.g. Misc.FurRenderer in mayapy, FakeFur.FakeFurRenderer)
+    address: (host, port) of listener; port 0 picks a free port
+    authkey: authentication key of connections (bytes)
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, backend, address=("localhost", 0), authkey=DEFAULT_AUTHKEY):
+        self.backend  = backend
+        self.listener = Listener(address, authkey=authkey)
+        self.address  = self.listener.address
+
+        self.requests = queue.Queue() ## (connection, request)
+        self.shms     = {}            ## connection -> SharedMemory
+
+        ## statistics
+        self.num_requests    = 0
+        self.max_queue_depth = 0
+        pass
+
+    ############################################################
+    ## receiver threads
+    ############################################################
+    def _Accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError):
+                return ## listener closed
+            except Exception:
+                traceback.print_exc() ## e.g. authentication failure
+                continue
+
+            thread = threading.Thread(target=self._Receive, args=(conn,), name="RenderServer.Receive")
+            thread.daemon = True
+            thread.start()
+
+    def _Receive(self, conn):
+        while True:
+            try:
+                request = conn.recv()
+            except (OSError, EOFError):
+                request = ("close",)
+
+            self.requests.put( (conn, request) )
+            self.max_queue_depth = max(self.max_queue_depth, self.requests.qsize())
+            if request[0] in {"close", "shutdown"}:
+                return
+
+    ############################################################
+    ## request handling
+    ############################################################
+    def _Frame(self, conn, img_cv2):
+        shm = self.shms.get(conn)
+        if shm is None or shm.size < img_cv2.nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = shared_memory.SharedMemory(create=True, size=img_cv2.nbytes)
+            self.shms[conn] = shm
+
+        frame = np.ndarray(img_cv2.shape, dtype=img_cv2.dtype, buffer=shm.buf)
+        frame[...] = img_cv2
+        return shm.name
+
+    def _Close(self, conn):
+        shm = self.shms.pop(conn, None)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        conn.close()
+        return None
+
+    def _Handle(self, conn, request):
+        command = request[0]
+
+        if "render" == command:
+            _, params_dict, img_path, exportCSV = request
+            num_renders = self.backend.num_renders
+            img_cv2, t_render, t_imageio = self.backend.RenderFur(params_dict, img_path, exportCSV)
+            shm_name = self._Frame(conn, img_cv2)
+            return (shm_name, img_cv2.shape, str(img_cv2.dtype), t_render, t_imageio, self.backend.num_renders > num_renders)
+
+        if "params" == command:
+            self.backend.SetParams(request[1])
+            self.backend.params_state.update(request[1])
+            return None
+
+        if "init" == command:
+            return self.backend.Init(request[1])
+
+        if "format" == command:
+            return self.backend.SetImageFormat(*request[1:])
+
+        if "scene_key" == command:
+            return self.backend.SceneKey()
+
+        if "ping" == command:
+            return "pong"
+
+        raise ValueError("Unknown request: {0}".format(command))
+
+    def Serve(self):
+        """
+        Handles requests until "shutdown" is received.
+        """
+        thread = threading.Thread(target=self._Accept, name="RenderServer.Accept")
+        thread.daemon = True
+        thread.start()
+
+        while True:
+            conn, request = self.requests.get()
+            command = request[0]
+
+            if "close" == command:
+                self._Close(conn)
+                continue
+
+            if "shutdown" == command:
+                break
+
+            self.num_requests += 1
+            try:
+                reply = ("ok", self._Handle(conn, request))
+            except Exception:
+                reply = ("error", traceback.format_exc())
+
+            try:
+                conn.send(reply)
+            except (OSError, EOFError):
+                self._Close(conn)
+
+        self.Close()
+        return None
+
+    def Close(self):
+        for conn in list(self.shms.keys()):
+            self._Close(conn)
+        self.listener.close()
+        return None
+
+
+###############################################################################
+## client (optimizer side)
+###############################################################################
+class RemoteRenderer(RenderBackend.RenderBackend):
+    """
+    RenderBackend whose renders are done by a render worker (render_worker.py).
+    Files (images/CSV) are written by the worker; images are returned
+    through shared memory.
+    address: (host, port) of the worker
+    authkey: authentication key (bytes)
+    """
+
+    ############################################################
+    ## ctor / dtor
+    ############################################################
+    def __init__(self, address, authkey=DEFAULT_AUTHKEY):
+        RenderBackend.RenderBackend.__init__(self)
+
+        self.address = tuple(address)
+        self.conn    = Client(self.address, authkey=authkey)
+        self.shm     = None
+        pass
+
+    def __del__(self):
+        self.Close()
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def _Call(self, *request):
+        self.conn.send(request)
+        status, result = self.conn.recv()
+        if "error" == status:
+            raise RuntimeError("render worker {0}:\n{1}".format(self.address, result))
+        return result
+
+    def Close(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(("close",))
+            except (OSError, EOFError):
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+        return None
+
+    ## stops the worker process
+    def Shutdown(self):
+        self.conn.send(("shutdown",))
+        self.conn.close()
+        self.conn = None
+        return self.Close()
+
+    def Ping(self):
+        return self._Call("ping")
+
+    def Init(self, folder_path):
+        self.folder_path = folder_path
+        return self._Call("init", folder_path)
+
+    def SetImageFormat(self, imageW_px, imageH_px, imgFileExt="jpg"):
+        RenderBackend.RenderBackend.SetImageFormat(self, imageW_px, imageH_px, imgFileExt)
+        return self._Call("format", imageW_px, imageH_px, imgFileExt)
+
+    def SceneKey(self):
+        return self._Call("scene_key")
+
+    ## RenderBackend interface
+    def SetParams(self, params_dict):
+        return self._Call("params", params_dict)
+
+    def RenderImage(self):
+        img_cv2, _, _ = self.RenderFur({}, None, False)
+        return img_cv2
+
+    def RenderFur(self, params_dict, img_path, exportCSV=True):
+        t_call_start = datetime.now()
+        shm_name, shape, dtype, t_render, t_imageio, rendered = self._Call(
+            "render", params_dict, img_path, exportCSV and self.exportCSV)
+        self.params_state.update(params_dict)
+
+        ## map the frame of this connection (once)
+        if self.shm is None or self.shm.name != shm_name:
+            if self.shm is not None:
+                self.shm.close()
+            self.shm = SharedFrames.AttachSharedMemory(shm_name)
+
+        ## copy: the block is overwritten by the next render
+        img_cv2 = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf).copy()
+
+        ## transport (request, reply & copy) counts as image I/O
+        t_imageio = (datetime.now() - t_call_start) - t_render
+
+        Timing.Add("render" , t_render)
+        Timing.Add("imageio", t_imageio)
+
+        if rendered:
+            self.num_renders += 1
+        self.t_render_elapsed  += t_render
+        self.t_imageio_elapsed += t_imageio
+        return img_cv2, t_render, t_imageio
@@ -0,0 +1,238 @@
+###############################################################################
+## coarse-to-fine resolution schedule of search pipelines
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os, shutil
+import json
+from datetime import datetime
+
+import numpy as np
+import cv2
+
+from stNoh import Checkpoint
+from stNoh import FurParam
+from stNoh import RefFeature
+from stNoh import Timing
+
+
+###############################################################################
+## downsampled references
+###############################################################################
+def ScaledSize(imageW_px, imageH_px, scale):
+    return int(round(imageW_px * scale)), int(round(imageH_px * scale))
+
+def ScaledReference(img_ref_path, imageW_px, imageH_px, get_feature_funcs=[]):
+    """
+    Returns filepath of the reference downsampled to imageW_px x imageH_px:
+    "<reference>.<W>x<H>.png" next to the reference (lossless, made once),
+    with its Gram features stored for each feature function (see RefFeature),
+    so that they are computed once per scale.
+    """
+    img_scaled_path = "{0}.{1}x{2}.png".format(os.path.splitext(img_ref_path)[0], imageW_px, imageH_px)
+    if not os.path.isfile(img_scaled_path):
+        img_ref_cv2 = cv2.imread(img_ref_path)
+        cv2.imwrite(img_scaled_path, cv2.resize(img_ref_cv2, (imageW_px, imageH_px), interpolation=cv2.INTER_AREA))
+
+    for get_feature_func in get_feature_funcs:
+        RefFeature.LoadReferenceGram(img_scaled_path, get_feature_func)
+    return img_scaled_path
+
+
+###############################################################################
+## schedule: global search at reduced resolution, refinement at full resolution
+###############################################################################
+def _SpanTotal(summary, names):
+    return sum([summary[name]["total_ms"] for name in names if name in summary]) * 1e-3
+
+def _Ranks(values):
+    return np.argsort(np.argsort(values)).astype(np.float64)
+
+class CoarseToFine:
+    """
+    Runs a global search (e.g. search_BayesOpt.BayesOpt) at reduced resolution
+    in "<folder>/_<W>x<H>", then restores the full resolution of the renderer
+    for the local refinement (e.g. search_FeatureGrad.GradientDescent).
+    Afterwards, num_check evaluated points (best to worst coarse cost) are
+    rendered at full resolution to report cost agreement and time saved.
+    renderer  : RenderBackend (SetImageFormat/Init/RenderFur)
+    scale     : image scale of the global search (0.5: 960x540 -> 480x270)
+    num_check : number of points rendered again at full resolution (0: no check)
+    checkpoint: checkpoint file of search_func in its folder, whose "X"/"y"
+                are the evaluated points & their coarse costs
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, renderer, scale=0.5, num_check=5, checkpoint="_checkpoint_bayesopt.pkl"):
+        self.renderer   = renderer
+        self.scale      = scale
+        self.num_check  = num_check
+        self.checkpoint = checkpoint
+
+        self.size_full   = (renderer.imageW_px, renderer.imageH_px)
+        self.size_coarse = ScaledSize(renderer.imageW_px, renderer.imageH_px, scale)
+
+        self.stages = [] ## report of each Run()
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def _SetSize(self, size, folder_path):
+        self.renderer.SetImageFormat(size[0], size[1], self.renderer.imgFileExt)
+        self.renderer.Init(folder_path)
+        return None
+
+    def Run(self, search_func,
+            get_feature_func, calc_cost_func, convert_param_func, params01_vec_dst,
+            folder_root, img_ref_path, opt_params_dict={}):
+        """
+        Runs search_func at reduced resolution; the renderer is back at full
+        resolution (initialized with folder_root) on return.
+        img_ref_path: full-resolution reference (downsampled next to it)
+        Returns (succeeded, parameters) of search_func.
+        """
+        W, H = self.size_coarse
+        folder_coarse = "{0}/_{1}x{2}".format(folder_root, W, H)
+        for folder in [folder_coarse + "/bayesopt", folder_coarse + "/grad", folder_coarse + "/step"]:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+        ## downsampled reference (lossless) & its stored features
+        img_scaled_path = ScaledReference(img_ref_path, W, H, [get_feature_func])
+        shutil.copy2(img_scaled_path, folder_coarse + "/_ref_image.png")
+        RefFeature.CopyStore(img_scaled_path, folder_coarse + "/_ref_image.png")
+
+        ############################################################
+        ## global search at reduced resolution
+        ############################################################
+        timer = Timing.Timer() if opt_params_dict.get('timer') is None else opt_params_dict['timer'] ## see stNoh/Timing.py
+        self._SetSize(self.size_coarse, folder_coarse)
+
+        t_start = datetime.now()
+        try:
+            succeeded, params_dict = search_func(
+                get_feature_func, calc_cost_func, self.renderer.RenderFur,
+                convert_param_func, params01_vec_dst,
+                folder_coarse, "png", dict(opt_params_dict, timer=timer)
+            )
+        finally:
+            self._SetSize(self.size_full, folder_root)
+        t_elapsed = (datetime.now() - t_start).total_seconds()
+
+        ## time per evaluation (render, image I/O, feature, cost)
+        summary = timer.Summary()
+        num_evals = summary["feature"]["count"] if "feature" in summary else 0
+        t_eval_coarse = _SpanTotal(summary, ["render", "imageio", "feature", "cost"]) / max(num_evals, 1)
+
+        stage = {
+            "folder"        : folder_coarse,
+            "size_coarse"   : list(self.size_coarse),
+            "size_full"     : list(self.size_full),
+            "succeeded"     : succeeded,
+            "evaluations"   : num_evals,
+            "wall_time_s"   : t_elapsed,
+            "eval_coarse_s" : t_eval_coarse,
+        }
+
+        ############################################################
+        ## cost agreement: evaluated points again at full resolution
+        ############################################################
+        if succeeded and self.num_check > 0:
+            t_check_start = datetime.now()
+            stage.update(self.Check(get_feature_func, calc_cost_func, convert_param_func,
+                                    params01_vec_dst, params_dict, folder_coarse, folder_root))
+            stage["check_s"] = (datetime.now() - t_check_start).total_seconds()
+
+            ## estimated time saved by the reduced resolution (minus the check itself)
+            stage["saved_s"] = num_evals * (stage["eval_full_s"] - t_eval_coarse) - stage["check_s"]
+
+        self.stages.append(stage)
+        return succeeded, params_dict
+
+    def Check(self, get_feature_func, calc_cost_func, convert_param_func,
+              params01_vec_dst, params_dict, folder_coarse, folder_root):
+        """
+        Renders evaluated points of the coarse search at full resolution.
+        Coarse costs are the ones observed by the search (checkpoint "X"/"y"),
+        i.e. of the rendered frames, not of archived (lossy) image files.
+        Returns {"points", "spearman", "best_agrees", "eval_full_s"}.
+        """
+        keys = Checkpoint.ParamKeys(convert_param_func, len(params01_vec_dst))
+
+        ## coarse cost of evaluated points (+ the best point returned)
+        x_best = [FurParam.ConvertFurParam(key, params_dict[key]) for key in keys]
+        state  = Checkpoint.Load(folder_coarse + "/" + self.checkpoint)
+        points = [] if state is None else [(list(x), float(y)) for x, y in zip(state["X"], state["y"])]
+        points = sorted(points, key=lambda point: point[1])
+
+        ## best to worst coarse cost, evenly spaced in rank
+        picks = sorted(set(np.linspace(0, len(points)-1, self.num_check).round().astype(int))) if len(points) > 0 else []
+        points = [points[n] for n in picks]
+        if len(points) == 0 or not np.allclose(points[0][0], x_best, atol=1e-6):
+            points = [(x_best, None)] + points[:self.num_check-1]
+
+        ## full resolution: reference copied to folder_root by the caller
+        image_ext = self.renderer.imgFileExt
+        G_ref_full, _ = RefFeature.LoadReferenceGram(folder_root + "/_ref_image.{0}".format(image_ext), get_feature_func)
+        folder_check = folder_root + "/_scale_check"
+        if not os.path.isdir(folder_check):
+            os.makedirs(folder_check)
+
+        timer = Timing.Timer()
+        timer_prev = Timing.Activate(timer)
+        results = []
+        try:
+            for num_check, (x, cost_coarse) in enumerate(points):
+                img_cv2, _, _ = self.renderer.RenderFur(convert_param_func(x), "{0}/check_{1:02d}".format(folder_check, num_check))
+                with timer.Span("feature"):
+                    G_dst, _ = get_feature_func(img_cv2)
+                with timer.Span("cost"):
+                    cost_full = calc_cost_func(G_ref_full, G_dst)
+                results.append({"x": [float(val01) for val01 in x],
+                                "cost_coarse": None if cost_coarse is None else float(cost_coarse),
+                                "cost_full": float(cost_full)})
+        finally:
+            Timing.Activate(timer_prev)
+
+        ## rank correlation between scales (points with coarse cost)
+        pairs = [(result["cost_coarse"], result["cost_full"]) for result in results if result["cost_coarse"] is not None]
+        spearman = None
+        if len(pairs) >= 3:
+            rank_coarse, rank_full = _Ranks([pair[0] for pair in pairs]), _Ranks([pair[1] for pair in pairs])
+            spearman = float(np.corrcoef(rank_coarse, rank_full)[0,1])
+
+        summary = timer.Summary()
+        return {
+            "points"     : results,
+            "spearman"   : spearman,
+            "best_agrees": int(np.argmin([result["cost_full"] for result in results])) == 0,
+            "eval_full_s": _SpanTotal(summary, ["render", "imageio", "feature", "cost"]) / max(len(results), 1),
+        }
+
+    ############################################################
+    ## report
+    ############################################################
+    def WriteReport(self, folder_path):
+        with open(folder_path + "/resolution.json", "w+") as f:
+            json.dump({"scale": self.scale, "stages": self.stages}, f, indent=2)
+
+        with open(folder_path + "/resolution.txt", "w+") as txt:
+            for stage in self.stages:
+                txt.write("{0}: {1}x{2} -> {3}x{4}, {5} evaluations in {6:.1f} s ({7:.3f} s/eval)\n".format(
+                    os.path.basename(stage["folder"]), stage["size_coarse"][0], stage["size_coarse"][1],
+                    stage["size_full"][0], stage["size_full"][1],
+                    stage["evaluations"], stage["wall_time_s"], stage["eval_coarse_s"]))
+                if "points" not in stage:
+                    continue
+
+                txt.write("  full resolution: {0:.3f} s/eval, estimated time saved {1:.1f} s (check {2:.1f} s included)\n".format(
+                    stage["eval_full_s"], stage["saved_s"], stage["check_s"]))
+                txt.write("  cost agreement: spearman {0}, coarse best is best at full resolution: {1}\n".format(
+                    "-" if stage["spearman"] is None else "{0:.3f}".format(stage["spearman"]), stage["best_agrees"]))
+                txt.write("  {0:>14} {1:>14}\n".format("cost coarse", "cost full"))
+                for result in stage["points"]:
+                    txt.write("  {0:>14} {1:14.6g}\n".format(
+                        "-" if result["cost_coarse"] is None else "{0:.6g}".format(result["cost_coarse"]), result["cost_full"]))
+        return None
@@ -0,0 +1,106 @@
+###############################################################################
+## per-sample job status of batch optimization
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os
+import json
+import threading
+from collections import OrderedDict
+
+
+###############################################################################
+## job queue with status
+###############################################################################
+class SampleQueue:
+    """
+    Keeps status of per-sample jobs and saves it as JSON at every change,
+    so that the progress of a batch run can be watched from outside.
+    Skipped samples keep cost, wall time and render count of the previous run
+    (read from the existing JSON).
+    status: "pending", "running", "done", "skipped" or "failed"
+    status_path: filepath of JSON (string)
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self, status_path):
+        self.status_path = status_path
+        self.jobs = OrderedDict() ## sample -> fields
+        self.lock = threading.Lock()
+
+        ## fields of the previous run: sample -> fields
+        self.previous = {}
+        if os.path.isfile(status_path):
+            try:
+                with open(status_path) as f:
+                    self.previous = dict([(job["sample"], job) for job in json.load(f)])
+            except (ValueError, KeyError, TypeError):
+                pass
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def Add(self, sample, img_ref_path, folder_sample, status="pending"):
+        with self.lock:
+            self.jobs[sample] = OrderedDict([
+                ("sample"       , sample),
+                ("status"       , status),
+                ("reference"    , img_ref_path),
+                ("folder"       , folder_sample),
+                ("cost"         , None),
+                ("wall_time_s"  , None),
+                ("renders"      , None),
+                ("error"        , None),
+            ])
+
+            ## results of the run which finished the sample
+            if "skipped" == status:
+                previous = self.previous.get(sample, {})
+                for key in ["cost", "wall_time_s", "renders"]:
+                    self.jobs[sample][key] = previous.get(key)
+        self.Save()
+        return None
+
+    def Set(self, sample, **fields):
+        with self.lock:
+            self.jobs[sample].update(fields)
+        self.Save()
+        return None
+
+    def Samples(self, status):
+        return [sample for sample in self.jobs if self.jobs[sample]["status"] == status]
+
+    def Save(self):
+        with self.lock:
+            text = json.dumps(list(self.jobs.values()), indent=2)
+
+        path_tmp = self.status_path + ".tmp"
+        with open(path_tmp, "w") as f:
+            f.write(text)
+        os.replace(path_tmp, self.status_path)
+        return None
+
+    def WriteSummary(self, txt_path):
+        """
+        Writes a table of cost, wall time and render count per sample.
+        """
+        fmt_num = lambda value, fmt: "-" if value is None else fmt.format(value)
+
+        with open(txt_path, "w+") as txt:
+            txt.write("{0:<32} {1:<8} {2:>12} {3:>12} {4:>8}\n".format("sample", "status", "cost", "wall time[s]", "renders"))
+            for job in self.jobs.values():
+                txt.write("{0:<32} {1:<8} {2:>12} {3:>12} {4:>8}\n".format(
+                    job["sample"], job["status"],
+                    fmt_num(job["cost"], "{0:.6g}"),
+                    fmt_num(job["wall_time_s"], "{0:.1f}"),
+                    fmt_num(job["renders"], "{0:d}")))
+
+            done = [job for job in self.jobs.values() if job["status"] == "done"]
+            txt.write("\n{0} done, {1} skipped, {2} failed / {3} samples\n".format(
+                len(done), len(self.Samples("skipped")), len(self.Samples("failed")), len(self.jobs)))
+            if len(done) > 0:
+                txt.write("total wall time = {0:.1f} s, total renders = {1}\n".format(
+                    sum([job["wall_time_s"] for job in done]), sum([job["renders"] for job in done])))
+        return None
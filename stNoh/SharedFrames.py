@@ -0,0 +1,178 @@
+###############################################################################
+## ring buffer of rendered frames in shared memory
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+###############################################################################
+## subroutine: attach shared memory of another process
+###############################################################################
+def AttachSharedMemory(name):
+    """
+    Attaches an existing shared memory block without taking its ownership
+    (the resource tracker would otherwise unlink it when this process exits).
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) ## Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+###############################################################################
+## ring buffer
+###############################################################################
+class FrameRing:
+    """
+    Fixed number of frame slots (H x W x 3, uint8) in one shared memory block.
+    Slot indices circulate through two queues:
+      free : producer Acquire()s a slot, writes the frame and Publish()es it;
+             it blocks while all slots are in use (backpressure)
+      ready: consumer takes Next() slot, reads Frame(slot) as zero-copy view,
+             and Release()s the slot when done
+    The ring is passed to other processes as argument (e.g. initargs of a pool);
+    they attach the same block.
+    imageW_px, imageH_px: frame size (e.g. FurRenderer.imageW_px x imageH_px)
+    num_slots           : number of slots
+    """
+
+    ############################################################
+    ## ctor / dtor
+    ############################################################
+    def __init__(self, imageW_px=960, imageH_px=540, num_slots=8):
+        self.shape      = (imageH_px, imageW_px, 3)
+        self.num_slots  = num_slots
+        self.slot_bytes = imageH_px * imageW_px * 3
+
+        self.shm   = shared_memory.SharedMemory(create=True, size=self.slot_bytes * num_slots)
+        self.owner = True
+
+        self.free  = multiprocessing.Queue()
+        self.ready = multiprocessing.Queue()
+        for slot in range(num_slots):
+            self.free.put(slot)
+
+        ## statistics (per process)
+        self.num_frames = 0
+        self.num_waits  = 0 ## Acquire() found no free slot
+        pass
+
+    def __del__(self):
+        self.Close()
+        pass
+
+    ## pickling: attach the same block & queues in the other process
+    def __getstate__(self):
+        return {
+            "name"     : self.shm.name,
+            "shape"    : self.shape,
+            "num_slots": self.num_slots,
+            "free"     : self.free,
+            "ready"    : self.ready,
+        }
+
+    def __setstate__(self, state):
+        self.shape      = state["shape"]
+        self.num_slots  = state["num_slots"]
+        self.slot_bytes = self.shape[0] * self.shape[1] * self.shape[2]
+
+        self.shm   = AttachSharedMemory(state["name"])
+        self.owner = False
+
+        self.free  = state["free"]
+        self.ready = state["ready"]
+
+        self.num_frames = 0
+        self.num_waits  = 0
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def Frame(self, slot):
+        """
+        Returns zero-copy view of the slot (valid until the slot is released).
+        """
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    ## producer side
+    def Acquire(self, timeout=None):
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            self.num_waits += 1
+            return self.free.get(timeout=timeout) ## queue.Empty on timeout
+
+    def Publish(self, slot, meta=None):
+        self.ready.put( (slot, meta) )
+        return None
+
+    def Put(self, img_cv2, meta=None, publish=True, timeout=None):
+        """
+        Copies a frame into a free slot and returns the slot index.
+        publish: False when the slot index is passed by other means
+                 (e.g. as the return value of a pool job)
+        """
+        if img_cv2.shape != self.shape:
+            raise ValueError("Frame size {0} does not match the ring {1}".format(img_cv2.shape, self.shape))
+
+        slot = self.Acquire(timeout)
+        self.Frame(slot)[...] = img_cv2
+        self.num_frames += 1
+
+        if publish:
+            self.Publish(slot, meta)
+        return slot
+
+    ## consumer side
+    def Next(self, timeout=None):
+        """
+        Returns (slot, meta) of the oldest published frame.
+        """
+        return self.ready.get(timeout=timeout)
+
+    def Release(self, slot):
+        self.free.put(slot)
+        return None
+
+    def Reset(self, keep=[]):
+        """
+        Returns all slots but keep (e.g. held by the consumer) to the free queue,
+        and drops published frames: slots taken by a dead process are reclaimed.
+        Only while no other process uses the ring (e.g. between two worker pools):
+        new queues are created, attached by processes started afterwards.
+        """
+        self.free  = multiprocessing.Queue()
+        self.ready = multiprocessing.Queue()
+        for slot in range(self.num_slots):
+            if slot not in keep:
+                self.free.put(slot)
+        return None
+
+    def Close(self):
+        if getattr(self, "shm", None) is not None:
+            try:
+                self.shm.close()
+            except BufferError:
+                pass ## views of frames are still alive: closed when they are freed
+            if self.owner:
+                self.shm.unlink()
+            self.shm = None
+        return None
+
+    def Stats(self):
+        return {
+            "slots" : self.num_slots,
+            "frames": self.num_frames,
+            "waits" : self.num_waits,
+        }
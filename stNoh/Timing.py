@@ -0,0 +1,240 @@
+###############################################################################
+## timing instrumentation: nested spans of the render/feature/cost pipeline
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+###############################################################################
+## span names used by the search modules and renderers
+###############################################################################
+## setparam  : fur attributes assigned to the scene
+## render    : rendering (worker process time for RenderPool/RemoteRenderer)
+## imageio   : image read/write (and transport from worker)
+## feature   : feature extraction, with nested
+##   preprocess: color conversion & input preparation
+##   forward   : VGG forward pass
+##   gram      : Gram matrices
+## cost      : cost function
+## optimizer : overhead of optimizer (GP fit/ask, linear algebra, ...);
+##             its self time excludes evaluations nested in it
+
+
+###############################################################################
+## span (context manager)
+###############################################################################
+class _Span:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name  = name
+        pass
+
+    def __enter__(self):
+        stack = self.timer._Stack()
+        stack.append([self.name, 0]) ## [name, duration of children]
+        self.iteration = self.timer._Iteration() ## at the start (may change while the span runs)
+        self.t_start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.perf_counter_ns() - self.t_start
+        stack = self.timer._Stack()
+        path = "/".join([frame[0] for frame in stack])
+        _, children = stack.pop()
+        if len(stack) > 0:
+            stack[-1][1] += duration
+
+        self.timer._Record(self.iteration, path, self.name, self.t_start, duration, duration - children)
+        return False
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_null_span = _NullSpan()
+
+
+###############################################################################
+## timer
+###############################################################################
+class Timer:
+    """
+    Collects spans measured by time.perf_counter_ns().
+    Spans can be nested (per thread); each record keeps its iteration,
+    path (e.g. "feature/forward"), duration and self time (without children).
+    """
+
+    ############################################################
+    ## ctor
+    ############################################################
+    def __init__(self):
+        self.records   = [] ## (iteration, path, name, start_ns, duration_ns, self_ns)
+        self.iteration = None
+        self.lock      = threading.Lock()
+        self.local     = threading.local()
+        pass
+
+    ############################################################
+    ## member functions
+    ############################################################
+    def _Stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _Iteration(self):
+        return getattr(self.local, "iteration", self.iteration)
+
+    def _Record(self, iteration, path, name, t_start, duration, self_ns):
+        with self.lock:
+            self.records.append( (iteration, path, name, t_start, duration, self_ns) )
+        return None
+
+    def Span(self, name):
+        return _Span(self, name)
+
+    def Add(self, name, duration):
+        """
+        Adds a span measured elsewhere (e.g. in a worker process),
+        nested in the current span of this thread.
+        duration: timedelta or nanoseconds (int)
+        """
+        if not isinstance(duration, int):
+            duration = int(round(duration.total_seconds() * 1e9))
+
+        stack = self._Stack()
+        path = "/".join([frame[0] for frame in stack] + [name])
+        if len(stack) > 0:
+            stack[-1][1] += duration
+
+        self._Record(self._Iteration(), path, name, time.perf_counter_ns() - duration, duration, duration)
+        return None
+
+    ## iteration of the spans started from now on (e.g. number of evaluation)
+    ## this_thread: only for spans of the calling thread (e.g. a fit thread),
+    ##              which then ignores later changes by other threads
+    def SetIteration(self, iteration, this_thread=False):
+        if this_thread:
+            self.local.iteration = iteration
+        else:
+            self.iteration = iteration
+        return None
+
+    def Reset(self):
+        with self.lock:
+            self.records = []
+        return None
+
+    ############################################################
+    ## statistics
+    ############################################################
+    def Summary(self):
+        """
+        Returns {name: statistics [ms]} over all spans of the same name
+        (count, total, self, mean, p50, p90, p99, max).
+        """
+        with self.lock:
+            records = list(self.records)
+
+        durations = OrderedDict()
+        self_time = OrderedDict()
+        for _, _, name, _, duration, self_ns in records:
+            durations.setdefault(name, []).append(duration)
+            self_time[name] = self_time.get(name, 0) + self_ns
+
+        summary = OrderedDict()
+        for name, values in durations.items():
+            values_ms = np.array(values, dtype=np.float64) * 1e-6
+            p50, p90, p99 = np.percentile(values_ms, [50, 90, 99])
+            summary[name] = OrderedDict([
+                ("count"   , len(values)),
+                ("total_ms", float(np.sum(values_ms))),
+                ("self_ms" , self_time[name] * 1e-6),
+                ("mean_ms" , float(np.mean(values_ms))),
+                ("p50_ms"  , float(p50)),
+                ("p90_ms"  , float(p90)),
+                ("p99_ms"  , float(p99)),
+                ("max_ms"  , float(np.max(values_ms))),
+            ])
+        return summary
+
+    def PerIteration(self):
+        """
+        Returns [{"iter", "total_ms": {name: ms}, "self_ms": {name: ms}, "count": {name: n}}]
+        in order of iteration.
+        """
+        with self.lock:
+            records = list(self.records)
+
+        iterations = OrderedDict()
+        for iteration, _, name, _, duration, self_ns in records:
+            entry = iterations.setdefault(iteration, {"iter": iteration, "total_ms": OrderedDict(), "self_ms": OrderedDict(), "count": OrderedDict()})
+            entry["total_ms"][name] = entry["total_ms"].get(name, 0.0) + duration * 1e-6
+            entry["self_ms" ][name] = entry["self_ms" ].get(name, 0.0) + self_ns  * 1e-6
+            entry["count"   ][name] = entry["count"   ].get(name, 0) + 1
+
+        return sorted(iterations.values(), key=lambda entry: -1 if entry["iter"] is None else entry["iter"])
+
+    ############################################################
+    ## export
+    ############################################################
+    def ExportJSONL(self, jsonl_path):
+        """
+        Writes one JSON line per iteration (see PerIteration()).
+        """
+        with open(jsonl_path, "w+") as f:
+            for entry in self.PerIteration():
+                for key in ["total_ms", "self_ms"]:
+                    entry[key] = OrderedDict([(name, round(ms, 3)) for name, ms in entry[key].items()])
+                f.write(json.dumps(entry) + "\n")
+        return None
+
+    def WriteSummary(self, txt_path):
+        with open(txt_path, "w+") as txt:
+            txt.write("{0:<12} {1:>7} {2:>12} {3:>12} {4:>10} {5:>10} {6:>10} {7:>10}\n".format(
+                "span", "count", "total[ms]", "self[ms]", "p50[ms]", "p90[ms]", "p99[ms]", "max[ms]"))
+            for name, stat in self.Summary().items():
+                txt.write("{0:<12} {1:>7d} {2:>12.1f} {3:>12.1f} {4:>10.2f} {5:>10.2f} {6:>10.2f} {7:>10.2f}\n".format(
+                    name, stat["count"], stat["total_ms"], stat["self_ms"],
+                    stat["p50_ms"], stat["p90_ms"], stat["p99_ms"], stat["max_ms"]))
+        return None
+
+
+###############################################################################
+## active timer: spans of renderers & feature functions go to it
+###############################################################################
+_active = None
+
+def Activate(timer):
+    """
+    Sets the timer receiving Span()/Add() of this module (None: disabled).
+    Returns the previous one, to be restored by the caller.
+    """
+    global _active
+    timer_prev, _active = _active, timer
+    return timer_prev
+
+def Active():
+    return _active
+
+def Span(name):
+    """
+    with Timing.Span("render"): ...  (no-op without active timer)
+    """
+    if _active is None:
+        return _null_span
+    return _active.Span(name)
+
+def Add(name, duration):
+    if _active is not None:
+        _active.Add(name, duration)
+    return None
@@ -5,18 +5,25 @@ from keras import backend as K
 ###############################################################################
 ## VGG-19 network
 ###############################################################################
-def VGG19(input_tensor=None, input_shape=None, avgPooling=False):
+def VGG19(input_tensor=None, input_shape=None, avgPooling=False, feature_layers=None, grayscale=False, weights_from=None):
     """
     Creates VGG19 structure and loads weights of pretrained data.
+    feature_layers: names of layers to be read (e.g. ['block1_conv2', ...]);
+                    layers after the deepest one are not built (None: all layers)
+    grayscale     : 1-channel input of gray values (see preprocess_input_gray),
+                    equivalent to the 3-channel input of identical planes
+    weights_from  : (grayscale) BGR model to copy the weights from (None: load file)
     """
 
-    # input shape: if it is not specified, then undefined size with 3 channels
-    if input_shape==None:
-        data_format = K.image_data_format()
-        if data_format not in {'channels_first', 'channels_last'}:
-            raise ValueError('Invalid data_format:', data_format)
+    # check tensor format
+    data_format = K.image_data_format()
+    if data_format not in {'channels_first', 'channels_last'}:
+        raise ValueError('Invalid data_format:', data_format)
 
-        input_shape = (None, None, 3) if data_format=='channels_last' else (3, None, None)
+    # input shape: if it is not specified, then undefined size with 3 channels (or 1 channel)
+    if input_shape==None:
+        channels = 1 if grayscale else 3
+        input_shape = (None, None, channels) if data_format=='channels_last' else (channels, None, None)
 
     ############################################################
     # define input layer
@@ -32,46 +39,54 @@ def VGG19(input_tensor=None, input_shape=None, avgPooling=False):
             img_input = input_tensor
 
     ############################################################
-    # construct VGG19 structure
+    # construct VGG19 structure (up to the deepest feature layer)
     ############################################################
     from keras.layers import MaxPooling2D     # Default VGG
     from keras.layers import AveragePooling2D # Following [Gatys15]
 
-    # Block 1
-    x = Conv2D(64, (3, 3), activation='relu', padding='same', name='block1_conv1')(img_input)
-    x = Conv2D(64, (3, 3), activation='relu', padding='same', name='block1_conv2')(x)
-    x = MaxPooling2D((2, 2), strides=(2, 2), name='block1_pool')(x) if avgPooling is False else AveragePooling2D((2, 2), strides=(2, 2), name='block1_pool')(x)
-    
-    # Block 2
-    x = Conv2D(128, (3, 3), activation='relu', padding='same', name='block2_conv1')(x)
-    x = Conv2D(128, (3, 3), activation='relu', padding='same', name='block2_conv2')(x)
-    x = MaxPooling2D((2, 2), strides=(2, 2), name='block2_pool')(x) if avgPooling is False else AveragePooling2D((2, 2), strides=(2, 2), name='block2_pool')(x)
-    
-    # Block 3
-    x = Conv2D(256, (3, 3), activation='relu', padding='same', name='block3_conv1')(x)
-    x = Conv2D(256, (3, 3), activation='relu', padding='same', name='block3_conv2')(x)
-    x = Conv2D(256, (3, 3), activation='relu', padding='same', name='block3_conv3')(x)
-    x = Conv2D(256, (3, 3), activation='relu', padding='same', name='block3_conv4')(x)
-    x = MaxPooling2D((2, 2), strides=(2, 2), name='block3_pool')(x) if avgPooling is False else AveragePooling2D((2, 2), strides=(2, 2), name='block3_pool')(x)
-    
-    # Block 4
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block4_conv1')(x)
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block4_conv2')(x)
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block4_conv3')(x)
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block4_conv4')(x)
-    x = MaxPooling2D((2, 2), strides=(2, 2), name='block4_pool')(x) if avgPooling is False else AveragePooling2D((2, 2), strides=(2, 2), name='block4_pool')(x)
-    
-    # Block 5
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block5_conv1')(x)
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block5_conv2')(x)
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block5_conv3')(x)
-    x = Conv2D(512, (3, 3), activation='relu', padding='same', name='block5_conv4')(x)
-    x = MaxPooling2D((2, 2), strides=(2, 2), name='block5_pool')(x) if avgPooling is False else AveragePooling2D((2, 2), strides=(2, 2), name='block5_pool')(x)
+    names = layer_names()
+    if feature_layers is None:
+        last_layer = names[-1]
+    else:
+        unknown = [layer for layer in feature_layers if layer not in names]
+        if len(unknown) > 0:
+            raise ValueError('Unknown feature layers:', unknown)
+        last_layer = max(feature_layers, key=names.index)
+
+    x = img_input
+    if grayscale:
+        ## constant plane: carries the ImageNet mean offsets of block1_conv1 (see gray_conv1_weights)
+        from keras.layers import Lambda
+        channel_axis = -1 if data_format=='channels_last' else 1
+        x = Lambda(lambda t: K.concatenate([t, K.ones_like(t)], axis=channel_axis), name='gray_ones')(x)
+
+    for block, num_conv, channels in vgg19_channels:
+        for k in range(1, num_conv+1):
+            name = 'block{0}_conv{1}'.format(block, k)
+            x = Conv2D(channels, (3, 3), activation='relu', padding='same', name=name)(x)
+            if name == last_layer: break
+        if name == last_layer: break
+
+        name = 'block{0}_pool'.format(block)
+        x = MaxPooling2D((2, 2), strides=(2, 2), name=name)(x) if avgPooling is False else AveragePooling2D((2, 2), strides=(2, 2), name=name)(x)
+        if name == last_layer: break
 
     # Create model (no top)
     from keras.models import Model
     model = Model(img_input, x, name='vgg19')
 
+    # grayscale: copy weights from BGR model, block1_conv1 folded
+    if grayscale:
+        if weights_from is None:
+            weights_from = VGG19(avgPooling=avgPooling, feature_layers=feature_layers)
+
+        for layer in model.layers:
+            if layer.name == 'block1_conv1':
+                layer.set_weights(gray_conv1_weights(*weights_from.get_layer(layer.name).get_weights()))
+            elif len(layer.get_weights()) > 0:
+                layer.set_weights(weights_from.get_layer(layer.name).get_weights())
+        return model
+
     # load weights: if it is the first time, then download from url ...
     WEIGHTS_PATH = ('https://bitbucket.org/stnoh/Maya-PythonPackages/'
                     'raw/master/'
@@ -81,7 +96,7 @@ def VGG19(input_tensor=None, input_shape=None, avgPooling=False):
         WEIGHTS_PATH,
         cache_subdir='models',
         file_hash='27ece8fbdcc9ca117b0f8aea2839c30e')
-    model.load_weights(weights_path)
+    model.load_weights(weights_path, by_name=feature_layers is not None) ## truncated: weights of existing layers
 
     return model
 
@@ -119,6 +134,100 @@ def preprocess_input(img_BGR_uint8):
     return img_keras
 
 
+def preprocess_input_gray(img_gray_uint8):
+    """
+    Converts gray image from CV2 (uint8) to keras (float 0.0:255.0, 1 channel)
+    for VGG19(grayscale=True): ImageNet mean is subtracted in the network
+    """
+
+    # (int) [0,255] -> [0.0:255.0] (float)
+    img_gray_float = img_gray_uint8.astype('float32')
+
+    # extend as tensor [1,H,W,1] (or [1,1,H,W])
+    if K.image_data_format() == 'channels_first':
+        img_keras = img_gray_float[np.newaxis,np.newaxis,:,:]
+    else:
+        img_keras = img_gray_float[np.newaxis,:,:,np.newaxis]
+    return img_keras
+
+
+def gray_conv1_weights(kernel, bias):
+    """
+    Folds block1_conv1 weights for a gray input replicated to BGR.
+    kernel: [3,3,3,C] (BGR, mean-subtracted input), bias: [C]
+    Returns [kernel [3,3,2,C], bias] for the input (gray, ones):
+      sum_c W_c * (gray - mean_c) = (sum_c W_c) * gray + (-sum_c W_c * mean_c) * 1
+    Inside the image, the 2nd plane only adds a constant (= mean offset in the bias);
+    it is kept as a plane, so that 'same' zero-padding at the image border
+    drops the offset exactly like the mean-subtracted BGR input.
+    """
+    mean = np.array(imagenet_mean, dtype=np.float64).reshape(1, 1, 3, 1)
+    kernel_gray = np.sum(kernel.astype(np.float64)       , axis=2, keepdims=True)
+    kernel_ones = -np.sum(kernel.astype(np.float64) * mean, axis=2, keepdims=True)
+
+    kernel_folded = np.concatenate([kernel_gray, kernel_ones], axis=2).astype(kernel.dtype)
+    return [kernel_folded, bias]
+
+
+###############################################################################
+# memory estimation for batched forward pass
+###############################################################################
+vgg19_channels = [ ## (block, number of conv. layers, channels)
+    (1, 2,  64),
+    (2, 2, 128),
+    (3, 4, 256),
+    (4, 4, 512),
+    (5, 4, 512),
+]
+
+def layer_names():
+    """
+    Returns names of conv./pooling layers in order.
+    """
+    names = []
+    for block, num_conv, channels in vgg19_channels:
+        names += ['block{0}_conv{1}'.format(block, k) for k in range(1, num_conv+1)]
+        names += ['block{0}_pool'.format(block)]
+    return names
+
+def layer_flops(imageH_px, imageW_px, feature_layers=None, grayscale=False):
+    """
+    Returns [(layer name, FLOPs, output shape [H,W,C])] of a single image
+    up to the deepest layer of feature_layers (None: all layers).
+    A 3x3 conv. counts 2*9*C_in*C_out per output pixel, a 2x2 pooling 4 per output value.
+    grayscale: block1_conv1 on 2 planes (gray, ones) instead of 3 (BGR)
+    """
+    names = layer_names()
+    last_layer = names[-1] if feature_layers is None else max(feature_layers, key=names.index)
+
+    H, W, C_in = imageH_px, imageW_px, 2 if grayscale else 3
+    flops = []
+    for block, num_conv, channels in vgg19_channels:
+        for k in range(1, num_conv+1):
+            name = 'block{0}_conv{1}'.format(block, k)
+            flops.append( (name, 2 * 9 * C_in * channels * H * W, (H, W, channels)) )
+            C_in = channels
+            if name == last_layer: return flops
+
+        name = 'block{0}_pool'.format(block)
+        H, W = H // 2, W // 2
+        flops.append( (name, 4 * H * W * channels, (H, W, channels)) )
+        if name == last_layer: return flops
+    return flops
+
+def activation_bytes(imageH_px, imageW_px, feature_layers=None, grayscale=False, bytes_per_value=4):
+    """
+    Returns bytes of the input and all layer outputs (conv. & pooling) of a single image
+    up to the deepest layer of feature_layers (None: all layers), as built by VGG19().
+    Workspace of the backend (e.g. convolution buffers) is not included.
+    grayscale: 1-channel input and its (gray, ones) planes instead of the BGR input
+    """
+    num_values = imageH_px * imageW_px * (1 + 2 if grayscale else 3)
+    for _, _, (H, W, C) in layer_flops(imageH_px, imageW_px, feature_layers, grayscale):
+        num_values += H * W * C
+    return num_values * bytes_per_value
+
+
 ###############################################################################
 # compute gram matrix (in numpy/keras)
 ###############################################################################
@@ -0,0 +1,114 @@
+###############################################################################
+## equivalence check: 1-channel gray VGG19 vs. BGR->GRAY->BGR input
+## Author: Seung-Tak Noh (seungtak.noh@gmail.com)
+###############################################################################
+import os, sys
+import argparse
+import runpy
+import time
+
+import numpy as np
+import cv2
+
+from stNoh import vgg19
+from keras import backend as K
+
+
+###############################################################################
+## reference: gray image replicated to 3 planes, 3-channel network
+###############################################################################
+def GrayGramBGR(features, img_cv2):
+    img_gray = cv2.cvtColor(img_cv2 , cv2.COLOR_BGR2GRAY)
+    img_BGR  = cv2.cvtColor(img_gray, cv2.COLOR_GRAY2BGR)
+    outputs  = features["func_layer_max"]([vgg19.preprocess_input(img_BGR)])
+
+    G = []
+    for l, _ in enumerate(features["feature_layers_max"]):
+        G_l = vgg19.np_gram_matrix(outputs[l][0] if K.backend()=='cntk' else outputs[l]) * features["weight_layers_max"][l]
+        G.append(G_l)
+    return G
+
+def RelativeErrors(G_ref, G_dst):
+    """
+    Returns ||G_dst - G_ref|| / ||G_ref|| (Frobenius) per layer.
+    """
+    return [float(np.linalg.norm(G_dst_l - G_ref_l) / max(np.linalg.norm(G_ref_l), 1e-30))
+            for G_ref_l, G_dst_l in zip(G_ref, G_dst)]
+
+def MeanTime(func, repeat):
+    func() ## warmup
+    t_start = time.perf_counter()
+    for n in range(repeat):
+        func()
+    return (time.perf_counter() - t_start) / repeat
+
+
+###############################################################################
+## main routine
+###############################################################################
+if "__main__" == __name__:
+
+    ############################################################
+    ## user specified parameters
+    ############################################################
+    parser = argparse.ArgumentParser(description="Checks that the gray VGG19 (folded block1_conv1) gives the same Gram matrices.")
+    parser.add_argument("images", nargs="*", help="input images (default: synthetic 960x540 images)")
+    parser.add_argument("--tol", type=float, default=1e-4, help="max. relative error of Gram matrices per layer")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed calls per path")
+    parser.add_argument("--init-feature", default=None, help="script defining the feature functions (default: init_feature.py)")
+    args = parser.parse_args()
+
+    init_feature_path = args.init_feature if args.init_feature is not None else \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "init_feature.py")
+    features = runpy.run_path(init_feature_path, run_name="__main__")
+
+    ## inputs: noise, gradient and bright constant image (border of 'same' padding matters)
+    if len(args.images) > 0:
+        imgs = [(os.path.basename(path), cv2.imread(path)) for path in args.images]
+    else:
+        rng = np.random.RandomState(0)
+        ramp_x = np.tile(np.linspace(0, 255, 960), (540, 1))
+        ramp_y = np.tile(np.linspace(0, 255, 540)[:,np.newaxis], (1, 960))
+        imgs = [
+            ("noise"   , rng.randint(0, 256, (540, 960, 3)).astype(np.uint8)),
+            ("gradient", np.dstack([ramp_x, ramp_y, 255 - ramp_x]).astype(np.uint8)),
+            ("constant", np.full((540, 960, 3), 230, dtype=np.uint8)),
+        ]
+
+    ## first layer: where the weights are folded
+    func_conv1_BGR  = K.function([features["model_max"].input ], [features["model_max"].get_layer("block1_conv1").output])
+    func_conv1_gray = K.function([features["model_gray"].input], [features["model_gray"].get_layer("block1_conv1").output])
+
+    ############################################################
+    ## compare per image
+    ############################################################
+    err_max = 0.0
+    for name, img_cv2 in imgs:
+        img_gray = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2GRAY)
+        conv1_BGR  = func_conv1_BGR ([vgg19.preprocess_input(cv2.cvtColor(img_gray, cv2.COLOR_GRAY2BGR))])[0]
+        conv1_gray = func_conv1_gray([vgg19.preprocess_input_gray(img_gray)])[0]
+        err_conv1  = float(np.max(np.abs(conv1_gray - conv1_BGR)) / max(np.max(np.abs(conv1_BGR)), 1e-30))
+
+        G_ref = GrayGramBGR(features, img_cv2)
+        G_new, _ = features["vgg_max_gray_gram"](img_cv2)
+        G_batch, _ = features["vgg_max_gray_gram"].batch([img_cv2, img_cv2])
+        errs = RelativeErrors(G_ref, G_new)
+        errs_batch = [max(RelativeErrors(G_ref, G_b)) for G_b in G_batch]
+
+        err_max = max([err_max] + errs + errs_batch)
+        print("{0:<16} block1_conv1 {1:.2e} | Gram ".format(name, err_conv1) +
+              " ".join(["{0}={1:.2e}".format(layer, err) for layer, err in zip(features["feature_layers_max"], errs)]) +
+              " | batch {0:.2e}".format(max(errs_batch)))
+
+    ############################################################
+    ## time per call of both paths
+    ############################################################
+    img_cv2 = imgs[0][1]
+    t_BGR  = MeanTime(lambda: GrayGramBGR(features, img_cv2), args.repeat)
+    t_gray = MeanTime(lambda: features["vgg_max_gray_gram"](img_cv2), args.repeat)
+    print("time per call: BGR {0:.1f} ms, gray {1:.1f} ms".format(t_BGR * 1e3, t_gray * 1e3))
+
+    if err_max > args.tol:
+        print("FAILED: max. relative error {0:.2e} > {1:.2e}".format(err_max, args.tol))
+        sys.exit(1)
+    print("OK: max. relative error {0:.2e} <= {1:.2e}".format(err_max, args.tol))